@@ -2,17 +2,29 @@
 import time
 import os
 import uuid
-import subprocess
 import sys
 import re
 import ast
 import json
+import hashlib
+import shutil
 from decimal import Decimal
 
 from installed_clients.KBaseReportClient import KBaseReport
 
 from kb_Msuite.Utils.DataStagingUtils import DataStagingUtils
-from kb_Msuite.Utils.OutputBuilder import OutputBuilder
+from kb_Msuite.Utils.DistPlotData import DistPlotData
+from kb_Msuite.Utils.DistPlotRenderer import DistPlotRenderer
+from kb_Msuite.Utils.OutputBuilder import (OutputBuilder, read_bin_stats, read_failed_bins,
+                                           write_failed_bins)
+from kb_Msuite.Utils.OverviewPlot import OverviewPlot
+from kb_Msuite.Utils.PipelineExecutor import PipelineExecutor
+from kb_Msuite.Utils.ProcessWatchdog import ProcessWatchdog, CheckMProcessError
+from kb_Msuite.Utils.ResourceBroker import ResourceBroker
+from kb_Msuite.Utils.RunCoalescer import RunCoalescer
+from kb_Msuite.Utils.RunTelemetry import RunTelemetry
+from kb_Msuite.Utils.RunWorkspace import RunWorkspace
+from kb_Msuite.Utils.ScratchManager import ScratchManager, remove_path
 
 
 def log(message, prefix_newline=False):
@@ -23,16 +35,91 @@ def log(message, prefix_newline=False):
 
 class CheckMUtil:
 
+    # 'image': dist plots are rendered by `checkm dist_plot`
+    # 'interactive': the per-contig plot data is written instead and plotted in the browser
+    # 'native': dist plot images are drawn in-process, in parallel, without `checkm dist_plot`
+    DIST_PLOT_MODES = ['image', 'interactive', 'native']
+
+    # which bins get a dist plot: every bin, the bins that pass the QC filters, the bins with
+    # questionable quality scores, or the largest bins
+    PLOT_POLICIES = ['all', 'retained', 'flagged', 'top_n']
+    DEFAULT_PLOT_CONTAMINATION_PERC = 10.0
+    DEFAULT_PLOT_TOP_N = 100
+
+    CHECKM_SUBCOMMANDS = ['lineage_wf', 'tetra', 'dist_plot']
+
+    # `checkm tetra` runs alongside lineage_wf, on the CPU left over in the default budget
+    TETRA_THREADS = 1
+
+    # the memory, in GB, reserved for checkm subcommands (see ResourceBroker); pplacer needs
+    # about 40 GB with the full reference tree, and less than 16 GB with the reduced tree
+    CHECKM_MEMORY_GB = {'lineage_wf': 40, 'lineage_wf_reduced_tree': 16, 'tetra': 1,
+                        'dist_plot': 2}
+
+    # the parameters that the filter and dist plot stages depend on; a completed stage is
+    # run again if they change
+    FILTER_PARAMS = ['workspace_name', 'output_filtered_binnedcontigs_obj_name',
+                     'completeness_perc', 'contamination_perc']
+    PLOT_PARAMS = ['dist_plot_mode', 'plot_policy', 'plot_contamination_perc',
+                   'plot_completeness_perc', 'plot_top_n']
+    # the parameters that the run ID depends on, besides the input object version; the
+    # other parameters only change stages that have them in their key, or that always run
+    RUN_PARAMS = ['reduced_tree', 'isolate_failed_bins']
+
     def __init__(self, config, ctx):
         self.config = config
         self.ctx = ctx
         self.callback_url = config['SDK_CALLBACK_URL']
         self.scratch = config['scratch']
         self.threads = config['threads']
+        self.upload_threads = int(config.get('upload_threads', 4))
+        # CPUs that the stages of a run may use at once; see PipelineExecutor
+        self.cpu_budget = int(config.get('cpu_budget') or int(self.threads) + self.TETRA_THREADS)
+        # optional time limits, in seconds, for checkm subcommands, e.g. lineage_wf_timeout;
+        # and how long a subcommand may run without using CPU or writing output
+        self.checkm_timeouts = dict((sub, int(config[sub + '_timeout']))
+                                    for sub in self.CHECKM_SUBCOMMANDS
+                                    if config.get(sub + '_timeout'))
+        self.checkm_stall_timeout = int(config.get('checkm_stall_timeout') or 0)
+        # how often, in seconds, the resource use of a running checkm subcommand is sampled
+        self.checkm_sample_interval = float(config.get('checkm_sample_interval') or 5)
+        # the threads and memory for checkm subcommands are granted by a broker shared with
+        # the other runs in the container; resource_threads and resource_memory_gb default to
+        # the CPUs and memory available, and e.g. lineage_wf_memory_gb overrides the estimate
+        self.checkm_memory_gb = dict(self.CHECKM_MEMORY_GB)
+        self.checkm_memory_gb.update((key, float(config[key + '_memory_gb']))
+                                     for key in self.CHECKM_MEMORY_GB
+                                     if config.get(key + '_memory_gb'))
+        resource_memory_gb = float(config.get('resource_memory_gb') or 0)
+        self.resource_broker = ResourceBroker(
+            config.get('resource_ledger_dir') or os.path.join(self.scratch, 'resource_ledger'),
+            total_threads=int(config.get('resource_threads') or 0),
+            total_memory=int(resource_memory_gb * 1073741824))
+        # with cpu_affinity = 1, each checkm subcommand is pinned to CPUs of its own
+        self.cpu_affinity = str(config.get('cpu_affinity') or 0) == '1'
+        # each run has a directory tree of its own under run_workspace_dir for its
+        # intermediates and logs, see RunWorkspace; with keep_run_workspace = 1 the tree of a
+        # successful run is kept, otherwise it is removed as soon as the run is done
+        self.run_root = config.get('run_workspace_dir') or os.path.join(self.scratch, 'runs')
+        self.run_retention_hours = float(config.get('run_retention_hours') or
+                                         RunWorkspace.DEFAULT_RETENTION_HOURS)
+        self.keep_run_workspace = str(config.get('keep_run_workspace') or 0) == '1'
+        self.workspace = None
+        # intermediates are removed as soon as no stage needs them, see ScratchManager; with
+        # tmpfs_staging_max_mb, input known to be up to that size is moved to tmpfs_dir (in memory)
+        self.tmpfs_dir = config.get('tmpfs_dir') or '/dev/shm'
+        self.tmpfs_max_bytes = int(float(config.get('tmpfs_staging_max_mb') or 0) * 1048576)
+        self.scratch_sample_interval = float(config.get('scratch_sample_interval') or 30)
+        # per-stage resource use of the current run_checkM_lineage_wf run, see RunTelemetry
+        self.telemetry = None
+        self.fasta_extension = 'fna'
+        self.binned_contigs_builder_fasta_extension = 'fasta'
 
-    def run_checkM_lineage_wf(self, params):
+    def run_checkM_lineage_wf(self, params, profiler=None):
         '''
         Main entry point for running the lineage_wf as a KBase App
+        profiler - an optional running MethodProfiler; its results are added to the report
+                   as a package once the outputs are uploaded
         '''
 
         # 0) validate basic parameters
@@ -40,72 +127,247 @@ class CheckMUtil:
             raise ValueError('input_ref field was not set in params for run_checkM_lineage_wf')
         if 'workspace_name' not in params:
             raise ValueError('workspace_name field was not set in params for run_checkM_lineage_wf')
-
-        # 1) stage input data
-        self.fasta_extension = 'fna'
-        self.binned_contigs_builder_fasta_extension = 'fasta'
+        dist_plot_mode = params.get('dist_plot_mode') or 'image'
+        if dist_plot_mode not in self.DIST_PLOT_MODES:
+            raise ValueError('Invalid dist_plot_mode: ' + str(dist_plot_mode) +
+                             ' (must be one of ' + ', '.join(self.DIST_PLOT_MODES) + ')')
+        plot_policy = params.get('plot_policy') or 'all'
+        if plot_policy not in self.PLOT_POLICIES:
+            raise ValueError('Invalid plot_policy: ' + str(plot_policy) +
+                             ' (must be one of ' + ', '.join(self.PLOT_POLICIES) + ')')
+
+        self.telemetry = RunTelemetry()
+
+        # 1) the run ID is a hash of the input object version and the parameters that change
+        #    the lineage_wf results, so a retried job, or a duplicate of a job in progress,
+        #    finds the stages that the other one completed in its run directory
         dsu = DataStagingUtils(self.config, self.ctx)
-        staged_input = dsu.stage_input(params['input_ref'], self.fasta_extension)
-        input_dir = staged_input['input_dir']
-        suffix = staged_input['folder_suffix']
-        all_seq_fasta_file = staged_input['all_seq_fasta']
-
-        filtered_bins_dir = os.path.join(self.scratch, 'filtered_bins_' + suffix)
-        output_dir = os.path.join(self.scratch, 'output_' + suffix)
-        plots_dir = os.path.join(self.scratch, 'plot_' + suffix)
-        html_dir = os.path.join(self.scratch, 'html_' + suffix)
-        tetra_file = os.path.join(self.scratch, 'tetra_' + suffix + '.tsv')
-
-        log('Staged input directory: ' + input_dir)
-
-        # 2) run the lineage workflow
-        lineage_wf_options = {'bin_folder': input_dir,
-                              'out_folder': output_dir,
-                              'threads': self.threads
-                              }
-        if ('reduced_tree' in params and params['reduced_tree'] is not None and
-           int(params['reduced_tree'])) == 1:
-            lineage_wf_options['reduced_tree'] = params['reduced_tree']
-
-        self.run_checkM('lineage_wf', lineage_wf_options)
-
-        # 3) optionally filter bins by quality scores and save object
-        binned_contig_obj_ref = None
-        created_objects = None
-        removed_bins = None
-        outputBuilder = OutputBuilder(output_dir, plots_dir, self.scratch, self.callback_url)
-        if dsu.get_data_obj_type (params['input_ref']) == 'KBaseMetagenomes.BinnedContigs' \
-           and params.get('output_filtered_binnedcontigs_obj_name'):
-
-            filtered_obj_info = self._filter_binned_contigs (params,
-                                                             dsu,
-                                                             outputBuilder,
-                                                             input_dir,
-                                                             output_dir,
-                                                             filtered_bins_dir)
-            if filtered_obj_info == None:
-                log("No Bins passed QC filters.  Not saving filtered BinnedContig object")
-            else:
-                binned_contig_obj_ref = filtered_obj_info['filtered_obj_ref']
-                removed_bins = filtered_obj_info['removed_bin_IDs']
-                created_objects = [{'ref': binned_contig_obj_ref,
-                                    'description': 'HQ BinnedContigs '+filtered_obj_info['filtered_obj_name']}]
-
-        # 4) make the plots:
-        self.build_checkM_lineage_wf_plots(input_dir, output_dir, plots_dir,
-                                           all_seq_fasta_file, tetra_file)
-
-        # 5) Package results
-        output_packages = self._build_output_packages(params, outputBuilder, input_dir)
-
-        # 6) build the HTML report
-        os.makedirs(html_dir)
-        html_files = outputBuilder.build_html_output_for_lineage_wf(html_dir, params['input_ref'], removed_bins=removed_bins)
-        html_zipped = outputBuilder.package_folder(html_dir,
-                                                   html_files[0],
-                                                   'Summarized report from CheckM')
-
-        # 7) save report
+        versioned_ref = dsu.get_versioned_ref(params['input_ref'])
+        suffix = self._run_id(params, versioned_ref)
+        # 2) one run with this run ID at a time, in its workspace; the lock is taken before the
+        #    workspace is allocated, so that an identical run that is finishing keeps it
+        with RunCoalescer(self.run_root).run(suffix) as coalesce_wait:
+            self.workspace = RunWorkspace.allocate(self.run_root, suffix,
+                                                   self.run_retention_hours)
+            run_dir = self.workspace.dir('checkpoints')
+            staged_input = dsu.staged_input_paths(self.fasta_extension, suffix,
+                                                  staging_dir=self.workspace.path)
+            input_dir = staged_input['input_dir']
+            all_seq_fasta_file = staged_input['all_seq_fasta']
+
+            filtered_bins_dir = self.workspace.dir('filtered_bins')
+            output_dir = self.workspace.dir('output')
+            plots_dir = self.workspace.dir('plot')
+            # the dist plots have a directory of their own, so that the plots of an earlier
+            # run with other plot parameters are removed before they are made again
+            dist_plots_dir = os.path.join(plots_dir, 'dist')
+            dist_plot_bins_dir = dist_plots_dir + '_bins'
+            overview_plot_file = os.path.join(plots_dir, 'bin_qa_plot.png')
+            html_dir = self.workspace.dir('html')
+            tetra_file = self.workspace.dir('tetra.tsv')
+
+            log('Run ID ' + suffix + ' for ' + versioned_ref + '; run directory: ' +
+                self.workspace.path)
+
+            # the intermediates, and the stages that read them
+            scratch_manager = ScratchManager(self.workspace.path, tmpfs_dir=self.tmpfs_dir,
+                                             tmpfs_max_bytes=self.tmpfs_max_bytes,
+                                             interval=self.scratch_sample_interval)
+            scratch_manager.register(input_dir, ['lineage_wf', 'filter', 'dist_plots'])
+            scratch_manager.register(all_seq_fasta_file, ['tetra'])
+            scratch_manager.register(tetra_file, ['dist_plots'])
+            scratch_manager.register(filtered_bins_dir, ['filter'])
+            scratch_manager.register(dist_plot_bins_dir, ['dist_plots'])
+
+            # 3) stage the input and run the lineage workflow, plots and packaging as a dependency graph of stages;
+            #    e.g. `checkm tetra` only needs the staged fasta, so it runs alongside lineage_wf
+            lineage_wf_options = {'bin_folder': input_dir,
+                                  'out_folder': output_dir,
+                                  'threads': self.threads
+                                  }
+            if ('reduced_tree' in params and params['reduced_tree'] is not None and
+               int(params['reduced_tree'])) == 1:
+                lineage_wf_options['reduced_tree'] = params['reduced_tree']
+
+            outputBuilder = OutputBuilder(output_dir, plots_dir, self.scratch, self.callback_url,
+                                          upload_threads=self.upload_threads,
+                                          table_mode=params.get('summary_table_mode') or 'auto',
+                                          optimize_images=str(params.get('optimize_plot_images', 1)) == '1',
+                                          image_workers=self.threads,
+                                          image_byte_budget=params.get('plot_image_byte_budget'),
+                                          telemetry=self.telemetry,
+                                          dist_plots_dir=dist_plots_dir)
+            if not os.path.exists(plots_dir):
+                os.makedirs(plots_dir)
+
+            # optionally filter bins by quality scores and save object
+            def filter_bins(results):
+                filtered = {'binned_contig_obj_ref': None,
+                            'created_objects': None,
+                            'removed_bins': None,
+                            'retained_bins': None}
+                if dsu.get_data_obj_type (params['input_ref']) != 'KBaseMetagenomes.BinnedContigs' \
+                   or not params.get('output_filtered_binnedcontigs_obj_name'):
+                    return filtered
+
+                filtered_obj_info = self._filter_binned_contigs (params,
+                                                                 dsu,
+                                                                 outputBuilder,
+                                                                 input_dir,
+                                                                 output_dir,
+                                                                 filtered_bins_dir)
+                if filtered_obj_info == None:
+                    log("No Bins passed QC filters.  Not saving filtered BinnedContig object")
+                    filtered['retained_bins'] = dict()
+                    self.telemetry.count(retained_bins=0)
+                else:
+                    filtered['binned_contig_obj_ref'] = filtered_obj_info['filtered_obj_ref']
+                    filtered['removed_bins'] = filtered_obj_info['removed_bin_IDs']
+                    filtered['retained_bins'] = filtered_obj_info['retained_bin_IDs']
+                    filtered['created_objects'] = [{'ref': filtered_obj_info['filtered_obj_ref'],
+                                                    'description': 'HQ BinnedContigs '+filtered_obj_info['filtered_obj_name']}]
+                    self.telemetry.count(retained_bins=len(filtered['retained_bins']),
+                                         removed_bins=len(filtered['removed_bins']))
+                return filtered
+
+            # make the dist plots, for the bins selected by the plot policy
+            def dist_plots(results):
+                bin_stats = outputBuilder.read_bin_stats()
+                retained_bins = (results['filter']['retained_bins']
+                                 if plot_policy == 'retained' else None)
+                plot_bin_ids = self._select_plot_bins(params, plot_policy, bin_stats,
+                                                      retained_bins)
+                if plot_bin_ids is None and bin_stats and read_failed_bins(output_dir):
+                    # the bins that lineage_wf failed on have nothing to plot
+                    plot_bin_ids = set(bin_stats.keys())
+                os.makedirs(dist_plots_dir)
+                self._build_dist_plots(input_dir, output_dir, dist_plots_dir, tetra_file,
+                                       dist_plot_mode=dist_plot_mode, plot_bin_ids=plot_bin_ids)
+                self.telemetry.count(bins=len(plot_bin_ids) if plot_bin_ids is not None
+                                     else len(bin_stats or []))
+                return sorted(plot_bin_ids) if plot_bin_ids is not None else None
+
+            # stage the input on disk, where the callback containers can write it; then move it
+            # to tmpfs if that is enabled and the input is known to be small. Count the bins
+            def stage_input(results):
+                # left over from an earlier, incomplete run; possibly links to tmpfs
+                remove_path(input_dir)
+                remove_path(all_seq_fasta_file)
+                use_tmpfs = (scratch_manager.tmpfs_dir is not None and
+                             scratch_manager.use_tmpfs(
+                                 dsu.estimate_staged_size(params['input_ref'])))
+                staged = dsu.stage_input(params['input_ref'], self.fasta_extension,
+                                         folder_suffix=suffix, staging_dir=self.workspace.path)
+                if use_tmpfs:
+                    scratch_manager.move_to_tmpfs([staged['input_dir'], staged['all_seq_fasta']],
+                                                  suffix)
+                self.telemetry.count(bins=len(self._bin_ids_in_folder(input_dir)))
+                return staged
+
+            # run lineage_wf, and count the bins it completed and failed on
+            def lineage_wf(results):
+                failed_bins = self._run_lineage_wf(lineage_wf_options, isolate_failed_bins)
+                bin_stats = read_bin_stats(output_dir)
+                self.telemetry.count(bins=len(bin_stats or []), failed_bins=len(failed_bins))
+                return failed_bins
+
+            # build the HTML report, with the telemetry of the stages done so far, and start
+            # its upload
+            def html_report(results):
+                os.makedirs(html_dir)
+                plotted_bins = results['dist_plots']
+                telemetry = self.telemetry.summary(run_id=suffix,
+                                                   input_ref=versioned_ref,
+                                                   cpu_budget=self.cpu_budget,
+                                                   threads=int(self.threads),
+                                                   pipeline=pipeline.stage_timing(),
+                                                   critical_path=pipeline.critical_path(),
+                                                   skipped_stages=pipeline.skipped,
+                                                   coalesce_wait_seconds=round(coalesce_wait, 3),
+                                                   scratch=scratch_manager.summary())
+                html_files = outputBuilder.build_html_output_for_lineage_wf(
+                    html_dir, params['input_ref'],
+                    removed_bins=results['filter']['removed_bins'],
+                    plotted_bins=set(plotted_bins) if plotted_bins is not None else None,
+                    telemetry=telemetry)
+                return outputBuilder.package_folder_async(html_dir,
+                                                          html_files[0],
+                                                          'Summarized report from CheckM')
+
+            isolate_failed_bins = str(params.get('isolate_failed_bins', 1)) == '1'
+            pipeline = PipelineExecutor(self.cpu_budget, run_dir=run_dir, telemetry=self.telemetry,
+                                        scratch_manager=scratch_manager)
+            pipeline.add_stage('stage_input', stage_input,
+                               key=versioned_ref, outputs=[input_dir, all_seq_fasta_file],
+                               checkpoint=True)
+            pipeline.add_stage('lineage_wf', lineage_wf, deps=['stage_input'], cpus=self.threads,
+                               key=[lineage_wf_options, isolate_failed_bins],
+                               outputs=[output_dir], checkpoint=True)
+            pipeline.add_stage('tetra',
+                               lambda results: self._run_tetra(all_seq_fasta_file, tetra_file,
+                                                               self.TETRA_THREADS),
+                               deps=['stage_input'], cpus=self.TETRA_THREADS,
+                               outputs=[tetra_file], checkpoint=True)
+            pipeline.add_stage('filter', filter_bins, deps=['stage_input', 'lineage_wf'],
+                               key=dict((k, params.get(k)) for k in self.FILTER_PARAMS),
+                               checkpoint=True)
+            # the summary table is final as soon as lineage_wf is done, so start its upload now;
+            # it runs in the background while the plots are made
+            pipeline.add_stage('summary_tsv',
+                               lambda results: self._build_summary_tsv_package(outputBuilder),
+                               deps=['lineage_wf'], cpus=0)
+            pipeline.add_stage('overview_plot',
+                               lambda results: self._build_overview_plot(output_dir, plots_dir),
+                               deps=['lineage_wf'], outputs=[overview_plot_file],
+                               checkpoint=True)
+            # the plots only wait for the filtered bins to be saved if they are selected by them
+            pipeline.add_stage('dist_plots', dist_plots,
+                               deps=['stage_input', 'lineage_wf', 'tetra'] +
+                               (['filter'] if plot_policy == 'retained' else []),
+                               cpus=self.threads,
+                               key=dict((k, params.get(k)) for k in self.PLOT_PARAMS),
+                               outputs=[dist_plots_dir, dist_plot_bins_dir], checkpoint=True)
+            # package results; `checkm dist_plot` writes to the output dir log, so wait for it
+            pipeline.add_stage('output_packages',
+                               lambda results: self._build_output_packages(params, outputBuilder,
+                                                                           input_dir),
+                               deps=['summary_tsv', 'overview_plot', 'dist_plots'], cpus=0)
+            pipeline.add_stage('html_report', html_report,
+                               deps=['filter', 'overview_plot', 'dist_plots'], cpus=self.threads,
+                               outputs=[html_dir])
+
+            # 4) run the stages and wait for the uploads; then save report
+            scratch_manager.start()
+            try:
+                results = pipeline.run()
+                pipeline.log_timing()
+                output_packages = outputBuilder.wait_for_packages([results['summary_tsv']] +
+                                                                  results['output_packages'])
+                html_zipped = results['html_report'].result()
+            finally:
+                outputBuilder.shutdown_uploads()
+                scratch_manager.stop()
+                self.telemetry.log_summary()
+                footprint = scratch_manager.summary()
+                log('Peak scratch footprint {0:.1f} MB on disk, {1:.1f} MB on tmpfs; '
+                    '{2:.1f} MB of intermediates removed early'.format(
+                        footprint['peak_bytes'] / 1048576.0,
+                        footprint['peak_tmpfs_bytes'] / 1048576.0,
+                        footprint['freed_bytes'] / 1048576.0))
+
+            if profiler:
+                profile_dir = self.workspace.private_dir('profile')
+                profiler.write(profile_dir)
+                output_packages.append(outputBuilder.package_folder(profile_dir, 'profile.zip',
+                                                                    'Profile of the run'))
+
+        # everything is uploaded; a failed run keeps its workspace, to resume from
+        if not self.keep_run_workspace:
+            self.workspace.remove()
+
+        binned_contig_obj_ref = results['filter']['binned_contig_obj_ref']
+        created_objects = results['filter']['created_objects']
+
         report_params = {'message': '',
                          'direct_html_link_index': 0,
                          'html_links': [html_zipped],
@@ -127,28 +389,249 @@ class CheckMUtil:
         return returnVal
 
 
-    def build_checkM_lineage_wf_plots(self, bin_folder, out_folder, plots_folder,
-                                      all_seq_fasta_file, tetra_file):
+    def _run_lineage_wf(self, lineage_wf_options, isolate_failed_bins=True):
+        '''
+        Run lineage_wf.  If it fails and isolate_failed_bins is set, the bins are bisected
+        to find the ones it fails on, and the outputs for the other bins are merged into the
+        out_folder; the failed bins are recorded with write_failed_bins().  The error is only
+        raised if lineage_wf fails on every bin, or runs out of memory with the reduced tree.
+        Returns the dict of failed bin IDs => error messages.
+        '''
+        try:
+            self.run_checkM('lineage_wf', lineage_wf_options)
+            return dict()
+        except ValueError as e:
+            error = e
+        if getattr(error, 'oom', False) and str(lineage_wf_options.get('reduced_tree')) != '1':
+            # the full tree needs far more memory than the reduced one (~40 GB vs. ~14 GB)
+            log('lineage_wf ran out of memory with the full reference tree; retrying with ' +
+                '--reduced_tree')
+            lineage_wf_options = dict(lineage_wf_options)
+            lineage_wf_options['reduced_tree'] = 1
+            try:
+                self.run_checkM('lineage_wf', lineage_wf_options)
+                return dict()
+            except ValueError as e:
+                error = e
+        # the memory is taken by the reference tree, not the bins, so running fewer bins at a
+        # time won't avoid running out of it
+        bin_ids = self._bin_ids_in_folder(lineage_wf_options['bin_folder'])
+        if getattr(error, 'oom', False) or not isolate_failed_bins or len(bin_ids) < 2:
+            raise error
+
+        log('lineage_wf failed on ' + str(len(bin_ids)) + ' bins; splitting the bins to find ' +
+            'the ones it fails on')
+        out_folder = lineage_wf_options['out_folder']
+        work_dir = out_folder.rstrip(os.sep) + '_bisect'
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+
+        passed_out_folders = []
+        failed_bins = dict()
+        half = len(bin_ids) // 2
+        subsets = [bin_ids[:half], bin_ids[half:]]
+        attempt = 0
+        while subsets:
+            subset = subsets.pop(0)
+            attempt += 1
+            subset_dir = os.path.join(work_dir, 'part_' + str(attempt))
+            subset_options = dict(lineage_wf_options)
+            subset_options['bin_folder'] = self._link_bins(
+                lineage_wf_options['bin_folder'], os.path.join(subset_dir, 'bins'), subset)
+            subset_options['out_folder'] = os.path.join(subset_dir, 'out')
+            try:
+                self.run_checkM('lineage_wf', subset_options)
+                passed_out_folders.append(subset_options['out_folder'])
+            except ValueError as e:
+                if len(subset) == 1:
+                    log('lineage_wf failed on bin ' + subset[0])
+                    failed_bins[subset[0]] = 'lineage_wf failed on this bin (' + \
+                        str(e).strip().split('\n')[-1] + ')'
+                else:
+                    half = len(subset) // 2
+                    subsets.extend([subset[:half], subset[half:]])
+
+        if not passed_out_folders:
+            raise error
+
+        log('lineage_wf failed on ' + str(len(failed_bins)) + ' of ' + str(len(bin_ids)) +
+            ' bins: ' + ', '.join(sorted(failed_bins.keys())))
+        self._merge_lineage_wf_outputs(passed_out_folders, out_folder)
+        write_failed_bins(out_folder, failed_bins)
+        shutil.rmtree(work_dir)
+        return failed_bins
+
+    def _bin_ids_in_folder(self, bin_folder):
+        ext = '.' + self.fasta_extension
+        return sorted(f[:-len(ext)] for f in os.listdir(bin_folder) if f.endswith(ext))
+
+    def _merge_lineage_wf_outputs(self, part_out_folders, out_folder):
+        '''
+        Combine lineage_wf outputs for disjoint sets of bins into out_folder: the per-bin
+        folders in bins/, the lines of the storage/*.tsv tables, lineage.ms and checkm.log.
+        Other intermediate files (e.g. the tree) are not merged.
+        '''
+        if os.path.exists(out_folder):
+            shutil.rmtree(out_folder)
+        os.makedirs(os.path.join(out_folder, 'bins'))
+        os.makedirs(os.path.join(out_folder, 'storage'))
+
+        def append_lines(src_path, dest_path, skip_header=False):
+            with open(src_path) as src, open(dest_path, 'a') as dest:
+                for line in src:
+                    if skip_header and line.startswith('#'):
+                        continue
+                    dest.write(line)
+
+        for part_i, part in enumerate(part_out_folders):
+            part_bins = os.path.join(part, 'bins')
+            if os.path.isdir(part_bins):
+                for bin_id in os.listdir(part_bins):
+                    os.rename(os.path.join(part_bins, bin_id),
+                              os.path.join(out_folder, 'bins', bin_id))
+            part_storage = os.path.join(part, 'storage')
+            if os.path.isdir(part_storage):
+                for filename in os.listdir(part_storage):
+                    if filename.endswith('.tsv'):
+                        append_lines(os.path.join(part_storage, filename),
+                                     os.path.join(out_folder, 'storage', filename))
+            for filename in ['lineage.ms', 'checkm.log']:
+                if os.path.isfile(os.path.join(part, filename)):
+                    # keep the marker file header line only once
+                    append_lines(os.path.join(part, filename),
+                                 os.path.join(out_folder, filename),
+                                 skip_header=(filename == 'lineage.ms' and part_i > 0))
+
+    def _run_id(self, params, versioned_ref):
+        '''
+        Deterministic ID for a run of run_checkM_lineage_wf: a hash of the version of the
+        input object and of the RUN_PARAMS
+        '''
+        run_params = dict((k, params.get(k)) for k in self.RUN_PARAMS)
+        run_key = json.dumps({'input_ref': versioned_ref, 'params': run_params},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(run_key.encode('utf-8')).hexdigest()[:16]
+
+    def _select_plot_bins(self, params, plot_policy, bin_stats, retained_bins):
+        '''
+        The IDs of the bins to make dist plots for, according to plot_policy, or None to plot
+        every bin.  retained_bins is the QC filter result, keyed by bin ID without the
+        'Bin.' style prefix, or None if the bins were not filtered.
+        '''
+        if plot_policy == 'all' or not bin_stats:
+            return None
+
+        if plot_policy == 'retained':
+            if retained_bins is None:
+                return None
+            selected = [bid for bid in bin_stats
+                        if re.sub('^[^\.]+\.', '', bid) in retained_bins]
+
+        elif plot_policy == 'flagged':
+            # an explicit 0 is a threshold too: any contamination is flagged
+            max_cont = self._plot_param(params, 'plot_contamination_perc',
+                                        self.DEFAULT_PLOT_CONTAMINATION_PERC)
+            min_comp = self._plot_param(params, 'plot_completeness_perc', None)
+            selected = []
+            for bid, data in bin_stats.items():
+                if float(data.get('Contamination', 0)) > float(max_cont) or \
+                   (min_comp is not None and
+                    float(data.get('Completeness', 0)) < float(min_comp)):
+                    selected.append(bid)
 
-        # first build generic plot for entire dataset
-#         log('Creating basic QA plot (checkm bin_qa_plot) ...')
-#         bin_qa_plot_options = {'bin_folder': bin_folder,
-#                                'out_folder': out_folder,
-#                                'plots_folder': plots_folder
-#                                }
-#         self.run_checkM('bin_qa_plot', bin_qa_plot_options, dropOutput=True)
+        else:
+            top_n = int(self._plot_param(params, 'plot_top_n', self.DEFAULT_PLOT_TOP_N))
+            by_size = sorted(bin_stats.keys(),
+                             key=lambda bid: (-int(bin_stats[bid].get('Genome size', 0)), bid))
+            selected = by_size[:top_n]
+
+        log('Plot policy ' + plot_policy + ': plotting ' + str(len(selected)) + ' of ' +
+            str(len(bin_stats)) + ' bins')
+        return set(selected)
+
+    def _plot_param(self, params, name, default):
+        ''' params[name], or default if it is not set; unlike `or`, 0 is kept '''
+        value = params.get(name)
+        if value is None or value == '':
+            return default
+        return value
+
+    def _link_bins(self, bin_folder, subset_folder, bin_ids):
+        ''' symlink the fasta files of bin_ids into subset_folder, to run checkm on a subset '''
+        if not os.path.exists(subset_folder):
+            os.makedirs(subset_folder)
+        ext = '.' + self.fasta_extension
+        bin_ids = set(bin_ids)
+        for filename in os.listdir(bin_folder):
+            if filename.endswith(ext) and filename[:-len(ext)] in bin_ids:
+                link = os.path.join(subset_folder, filename)
+                if os.path.lexists(link):
+                    os.remove(link)
+                os.symlink(os.path.join(os.path.abspath(bin_folder), filename), link)
+        return subset_folder
 
+    def build_checkM_lineage_wf_plots(self, bin_folder, out_folder, plots_folder,
+                                      all_seq_fasta_file, tetra_file, dist_plot_mode='image',
+                                      plot_bin_ids=None):
+        '''
+        Make the bin QA overview plot and the per-bin dist plots.  If plot_bin_ids is given,
+        dist plots are only made for those bins.
+        '''
+        self._build_overview_plot(out_folder, plots_folder)
+        self._run_tetra(all_seq_fasta_file, tetra_file, self.threads)
+        self._build_dist_plots(bin_folder, out_folder, plots_folder, tetra_file,
+                               dist_plot_mode=dist_plot_mode, plot_bin_ids=plot_bin_ids)
+
+    def _build_overview_plot(self, out_folder, plots_folder):
+        # generic plot for entire dataset.  `checkm bin_qa_plot` draws a row per bin and fails
+        # on large datasets, so this is an aggregated plot of the bin stats
+        log('Creating bin QA overview plot...')
+        if not os.path.exists(plots_folder):
+            os.makedirs(plots_folder)
+        bin_stats = read_bin_stats(out_folder)
+        if bin_stats:
+            OverviewPlot().plot(bin_stats, os.path.join(plots_folder, 'bin_qa_plot.png'))
+
+    def _run_tetra(self, all_seq_fasta_file, tetra_file, threads):
         # compute tetranucleotide frequencies based on the concatenated fasta file
         log('Computing tetranucleotide distributions...')
         tetra_options = {'seq_file': all_seq_fasta_file,
                          'tetra_file': tetra_file,
-                         'threads': self.threads,
+                         'threads': threads,
                          'quiet': 1
                          }
         self.run_checkM('tetra', tetra_options, dropOutput=True)
 
+    def _build_dist_plots(self, bin_folder, out_folder, plots_folder, tetra_file,
+                          dist_plot_mode='image', plot_bin_ids=None):
+        if plot_bin_ids is not None and not plot_bin_ids:
+            log('No bins selected for distribution plots')
+            return
+
+        if dist_plot_mode == 'interactive':
+            # write the data behind the plots; they are drawn by the HTML report
+            log('Writing distribution plot data per bin...')
+            dist_data = DistPlotData(bin_folder, out_folder, tetra_file, self.fasta_extension,
+                                     dist_value=95)
+            dist_data.write_bin_data(plots_folder, bin_ids=plot_bin_ids)
+            return
+
+        if dist_plot_mode == 'native':
+            if DistPlotRenderer.is_available():
+                log('Drawing distribution plots per bin...')
+                dist_data = DistPlotData(bin_folder, out_folder, tetra_file, self.fasta_extension,
+                                         dist_value=95)
+                DistPlotRenderer(dist_data, workers=self.threads).render(plots_folder,
+                                                                         bin_ids=plot_bin_ids)
+                return
+            log('Warning: matplotlib is not available; using checkm dist_plot instead')
+
         # plot distributions for each bin
         log('Creating distribution plots per bin...')
+        if plot_bin_ids is not None:
+            # checkm dist_plot plots every bin in bin_folder
+            bin_folder = self._link_bins(bin_folder, plots_folder.rstrip(os.sep) + '_bins',
+                                              plot_bin_ids)
         dist_plot_options = {'bin_folder': bin_folder,
                              'out_folder': out_folder,
                              'plots_folder': plots_folder,
@@ -171,29 +654,56 @@ class CheckMUtil:
                 threads
                 dist_value
         '''
-        command = self._build_command(subcommand, options)
-        log('Running: ' + ' '.join(command))
-
-        log_output_file = None
-        if dropOutput:
-            # necessary because the checkM --quiet flag doesn't work on the tetra subcommand,
-            # and that produces a line per contig
-            log_output_file = open(os.path.join(self.scratch, subcommand + '.out'), 'w')
-            p = subprocess.Popen(command, cwd=self.scratch, shell=False,
-                                 stdout=log_output_file, stderr=subprocess.STDOUT)
-        else:
-            p = subprocess.Popen(command, cwd=self.scratch, shell=False)
-        exitCode = p.wait()
-
-        if log_output_file:
-            log_output_file.close()
+        # wait for the threads and memory to run it; the command uses the threads granted,
+        # which are fewer than asked for if the container doesn't have that many
+        memory_key = subcommand
+        if subcommand == 'lineage_wf' and str(options.get('reduced_tree')) == '1':
+            memory_key = 'lineage_wf_reduced_tree'
+        memory = int(self.checkm_memory_gb.get(memory_key, 0) * 1073741824)
+        with self.resource_broker.grant(options.get('threads') or 1, memory, subcommand,
+                                        pin=self.cpu_affinity) as grant:
+            if options.get('threads'):
+                options = dict(options, threads=grant['threads'])
+            command = self._build_command(subcommand, options)
+            log('Running: ' + ' '.join(command) +
+                (' on CPUs ' + ','.join(str(c) for c in grant['cpus']) if grant['cpus'] else ''))
+
+            # the output always goes to a file, which the watchdog uses as a heartbeat; it is
+            # only echoed to the log without dropOutput, because the checkM --quiet flag
+            # doesn't work on the tetra subcommand, and that produces a line per contig.  It
+            # runs in the run's workspace, or in one of its own outside of a lineage_wf run
+            if self.workspace is None:
+                self.workspace = RunWorkspace.allocate(self.run_root,
+                                                       retention_hours=self.run_retention_hours)
+            watchdog = ProcessWatchdog(command, self.workspace.log_path(subcommand),
+                                       cwd=self.workspace.path,
+                                       timeout=self.checkm_timeouts.get(subcommand),
+                                       stall_timeout=self.checkm_stall_timeout,
+                                       interval=self.checkm_sample_interval,
+                                       echo_output=not dropOutput,
+                                       cpus=grant['cpus'])
+            exitCode = watchdog.run()
+        if self.telemetry is not None:
+            self.telemetry.add_process(subcommand, watchdog,
+                                       queue_wait_seconds=grant['wait_seconds'])
+        log('checkm ' + subcommand + ': wall time {0:.1f}s, CPU time {1:.1f}s, peak RSS {2:.1f} MB'
+            .format(watchdog.wall_seconds, watchdog.cpu_seconds, watchdog.peak_rss / 1048576.0))
 
         if (exitCode == 0):
             log('Executed command: ' + ' '.join(command) + '\n' +
                 'Exit Code: ' + str(exitCode))
         else:
-            raise ValueError('Error running command: ' + ' '.join(command) + '\n' +
-                             'Exit Code: ' + str(exitCode))
+            reason = ''
+            if watchdog.timed_out:
+                reason = ' (time limit of ' + str(watchdog.timeout) + 's exceeded)'
+            elif watchdog.stalled:
+                reason = ' (stalled for ' + str(watchdog.stall_timeout) + 's)'
+            elif watchdog.oom:
+                reason = ' (out of memory)'
+            raise CheckMProcessError('Error running command: ' + ' '.join(command) + '\n' +
+                                     'Exit Code: ' + str(exitCode) + reason,
+                                     exit_code=exitCode, oom=watchdog.oom,
+                                     timed_out=watchdog.timed_out, stalled=watchdog.stalled)
 
     def _process_universal_options(self, command_list, options):
         if options.get('threads'):
@@ -278,10 +788,14 @@ class CheckMUtil:
             os.makedirs(filtered_bins_dir)
         bin_stats_ext_file = os.path.join(output_dir, 'storage', 'bin_stats_ext.tsv')
         bin_fasta_files_by_bin_ID = dataStagingUtils.get_bin_fasta_files(input_dir, self.fasta_extension)
+        failed_bin_IDs = [re.sub('^[^\.]+\.', '', bid) for bid in read_failed_bins(output_dir)]
         bin_IDs = []
         for bin_ID in sorted(bin_fasta_files_by_bin_ID.keys()):
-            bin_IDs.append(bin_ID)
             log("Contigs Fasta file found for Bin ID: "+bin_ID)
+            if bin_ID in failed_bin_IDs:
+                log("Bin "+bin_ID+" failed in lineage_wf.  Skipping.")
+                continue
+            bin_IDs.append(bin_ID)
 
         # read CheckM stats to get completeness and contamination scores
         bin_stats_obj = dict()
@@ -340,7 +854,7 @@ class CheckMUtil:
                 src_path = bin_fasta_files_by_bin_ID[bin_ID]
                 dst_path = os.path.join(filtered_bins_dir, bin_basename+'.'+str(bin_ID)+'.'+self.binned_contigs_builder_fasta_extension)
                 outputBuilder._copy_file_new_name_ignore_errors (src_path, dst_path)
-        for bin_ID in bin_IDs:
+        for bin_ID in bin_IDs + failed_bin_IDs:
             if bin_ID not in retained_bin_IDs:
                 removed_bin_IDs[bin_ID] = True
 
@@ -358,42 +872,48 @@ class CheckMUtil:
              }
 
 
-    def _build_output_packages(self, params, outputBuilder, input_dir):
-        output_packages = []
-
-
-        # create bin report summary TSV table text file
+    def _build_summary_tsv_package(self, outputBuilder):
+        '''
+        Write the bin report summary TSV table and start uploading it.
+        Returns the pending (Future) package.
+        '''
         log('creating TSV summary table text file')
         tab_text_dir = os.path.join(outputBuilder.output_dir, 'tab_text')
         tab_text_file = 'CheckM_summary_table.tsv'
         tab_text_files = outputBuilder.build_summary_tsv_file(tab_text_dir, tab_text_file)
-        tab_text_zipped = outputBuilder.package_folder(tab_text_dir,
-                                                       tab_text_file+'.zip',
-                                                       'TSV Summary Table from CheckM')
-        output_packages.append(tab_text_zipped)
+        return outputBuilder.package_folder_async(tab_text_dir,
+                                                  tab_text_file+'.zip',
+                                                  'TSV Summary Table from CheckM')
 
+    def _build_output_packages(self, params, outputBuilder, input_dir):
+        '''
+        Start uploading the full output and (optionally) the plots directory.
+        Returns a list of pending (Future) packages; use outputBuilder.wait_for_packages
+        to collect them.
+        '''
+        output_packages = []
 
         # if 'save_output_dir' in params and str(params['save_output_dir']) == '1':
         if True:
             log('packaging full output directory')
-            zipped_output_file = outputBuilder.package_folder(outputBuilder.output_dir,
-                                                              'full_output.zip',
-                                                              'Full output of CheckM')
+            zipped_output_file = outputBuilder.package_folder_async(outputBuilder.output_dir,
+                                                                    'full_output.zip',
+                                                                    'Full output of CheckM')
             output_packages.append(zipped_output_file)
         else:  # ADD LATER?
             log('not packaging full output directory, selecting specific files')
-            crit_out_dir = os.path.join(self.scratch, 'critical_output_' + os.path.basename(
-                                                                                    input_dir))
+            crit_out_dir = self.workspace.dir('critical_output')
             os.makedirs(crit_out_dir)
-            zipped_output_file = outputBuilder.package_folder(outputBuilder.output_dir,
-                                                              'selected_output.zip',
-                                                              'Selected output from the CheckM analysis')
+            zipped_output_file = outputBuilder.package_folder_async(outputBuilder.output_dir,
+                                                                    'selected_output.zip',
+                                                                    'Selected output from the CheckM analysis')
             output_packages.append(zipped_output_file)
 
         if 'save_plots_dir' in params and str(params['save_plots_dir']) == '1':
             log('packaging output plots directory')
-            zipped_output_file = outputBuilder.package_folder(outputBuilder.plots_dir, 'plots.zip',
-                                                              'Output plots from CheckM')
+            zipped_output_file = outputBuilder.package_folder_async(outputBuilder.plots_dir,
+                                                                    'plots.zip',
+                                                                    'Output plots from CheckM')
             output_packages.append(zipped_output_file)
         else:
             log('not packaging output plots directory')
@@ -1,7 +1,9 @@
 import os
 import time
+import uuid
 import glob
 import re
+import shutil
 import subprocess
 
 from installed_clients.WorkspaceClient import Workspace
@@ -22,14 +24,16 @@ class DataStagingUtils(object):
             os.makedirs(self.scratch)
 
 
-    def stage_input(self, input_ref, fasta_file_extension):
+    def stage_input(self, input_ref, fasta_file_extension, folder_suffix=None, staging_dir=None):
         '''
         Stage input based on an input data reference for CheckM
 
         input_ref can be a reference to an Assembly, BinnedContigs, or (not yet implemented) a Genome
 
         This method creates a directory in the scratch area with the set of Fasta files, names
-        will have the fasta_file_extension parameter tacked on.
+        will have the fasta_file_extension parameter tacked on.  The directory name ends in
+        folder_suffix, if given, or else a time stamp and a random part.  With staging_dir
+        (e.g. a run workspace), the input goes there instead, see staged_input_paths().
 
             ex:
 
@@ -45,11 +49,14 @@ class DataStagingUtils(object):
         ws = Workspace(self.ws_url)
 
         # 1) generate a folder in scratch to hold the input
-        suffix = str(int(time.time() * 1000))
-        input_dir = os.path.join(self.scratch, 'bins_' + suffix)
-        all_seq_fasta = os.path.join(self.scratch, 'all_sequences_' + suffix + '.' + fasta_file_extension)
-        if not os.path.exists(input_dir):
-            os.makedirs(input_dir)
+        suffix = folder_suffix or str(int(time.time() * 1000)) + '_' + uuid.uuid4().hex[:8]
+        staged_paths = self.staged_input_paths(fasta_file_extension, suffix, staging_dir)
+        input_dir = staged_paths['input_dir']
+        all_seq_fasta = staged_paths['all_seq_fasta']
+        if os.path.exists(input_dir):
+            # left over from an earlier, incomplete run with the same suffix
+            shutil.rmtree(input_dir)
+        os.makedirs(input_dir)
 
 
         # 2) based on type, download the files
@@ -215,6 +222,22 @@ class DataStagingUtils(object):
 
         return {'input_dir': input_dir, 'folder_suffix': suffix, 'all_seq_fasta': all_seq_fasta}
 
+    def staged_input_paths(self, fasta_file_extension, folder_suffix, staging_dir=None):
+        '''
+        where stage_input puts the input for a given folder_suffix: bins_<folder_suffix> and
+        all_sequences_<folder_suffix>.<ext> in scratch, or bins and all_sequences.<ext> in
+        staging_dir
+        '''
+        if staging_dir:
+            return {'input_dir': os.path.join(staging_dir, 'bins'),
+                    'folder_suffix': folder_suffix,
+                    'all_seq_fasta': os.path.join(staging_dir,
+                                                  'all_sequences.' + fasta_file_extension)}
+        return {'input_dir': os.path.join(self.scratch, 'bins_' + folder_suffix),
+                'folder_suffix': folder_suffix,
+                'all_seq_fasta': os.path.join(self.scratch, 'all_sequences_' + folder_suffix +
+                                              '.' + fasta_file_extension)}
+
 
     def fasta_seq_len_at_least(self, fasta_path, min_fasta_len=1):
         '''
@@ -319,6 +342,42 @@ class DataStagingUtils(object):
         #type_name = input_info[TYPE_I].split('-')[0]
         return obj_name
 
+    def get_versioned_ref(self, input_ref):
+        ''' the wsid/objid/version reference that input_ref currently resolves to '''
+        [OBJID_I, NAME_I, TYPE_I, SAVE_DATE_I, VERSION_I, SAVED_BY_I, WSID_I, WORKSPACE_I, CHSUM_I, SIZE_I, META_I] = range(11)  # object_info tuple
+        ws = Workspace(self.ws_url)
+        input_info = ws.get_object_info3({'objects': [{'ref': input_ref}]})['infos'][0]
+        return '/'.join([str(input_info[WSID_I]), str(input_info[OBJID_I]),
+                         str(input_info[VERSION_I])])
+
+    def estimate_staged_size(self, input_ref):
+        '''
+        the bytes that stage_input will write for input_ref, estimated from the workspace
+        before anything is downloaded: the bin fasta files and the file of all sequences,
+        each about the number of bases, plus line breaks and headers.  None if the number of
+        bases is not known without fetching the data (e.g. for sets)
+        '''
+        [OBJID_I, NAME_I, TYPE_I, SAVE_DATE_I, VERSION_I, SAVED_BY_I, WSID_I, WORKSPACE_I, CHSUM_I, SIZE_I, META_I] = range(11)  # object_info tuple
+        ws = Workspace(self.ws_url)
+        input_info = ws.get_object_info3({'objects': [{'ref': input_ref}],
+                                          'includeMetadata': 1})['infos'][0]
+        type_name = input_info[TYPE_I].split('-')[0]
+        bases = None
+        try:
+            if type_name in ['KBaseGenomeAnnotations.Assembly', 'KBaseGenomes.Genome']:
+                bases = int((input_info[META_I] or {}).get('Size'))
+            elif type_name == 'KBaseMetagenomes.BinnedContigs':
+                bins = ws.get_objects2({'objects': [{'ref': input_ref,
+                                                     'included': ['/bins/[*]/sum_contig_len']}]
+                                        })['data'][0]['data']['bins']
+                bases = sum(int(bin_item['sum_contig_len']) for bin_item in bins)
+        except (TypeError, ValueError, KeyError, IndexError):
+            bases = None
+        if bases is None:
+            return None
+        # 60 bases per line, and the headers
+        return int(2 * bases * 1.1)
+
     def get_data_obj_type(self, input_ref, remove_module=False):
         [OBJID_I, NAME_I, TYPE_I, SAVE_DATE_I, VERSION_I, SAVED_BY_I, WSID_I, WORKSPACE_I, CHSUM_I, SIZE_I, META_I] = range(11)  # object_info tuple
         ws = Workspace(self.ws_url)
@@ -0,0 +1,266 @@
+import os
+import ast
+import json
+import sys
+import time
+
+try:
+    from checkm.defaultValues import DefaultValues as _CheckMDefaults
+except ImportError:
+    _CheckMDefaults = None
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+    sys.stdout.flush()
+
+
+class DistPlotData(object):
+    '''
+    Computes the per-contig data behind the CheckM dist plots (GC, coding density and
+    tetranucleotide distance, each against sequence length) without rendering anything,
+    so that the plots can be drawn in the browser instead of by `checkm dist_plot`.
+
+    Inputs are the same as for dist_plot: the lineage_wf bin and output folders and the
+    tetra file made by `checkm tetra`.  Coding density is taken from the prodigal gene
+    calls that lineage_wf leaves in <out_folder>/bins/<bin_id>/genes.gff.
+    '''
+
+    DIST_DATA_EXT = '.dist_data.js'
+    REFERENCE_DISTRIBUTIONS = ['gc_dist', 'cd_dist', 'td_dist']
+
+    # reference distributions are the same for every run; read them once per process
+    _reference_cache = None
+
+    def __init__(self, bin_folder, out_folder, tetra_file, fasta_extension, dist_value=95):
+        self.bin_folder = bin_folder
+        self.out_folder = out_folder
+        self.tetra_file = tetra_file
+        self.fasta_extension = fasta_extension
+        self.dist_value = dist_value
+        self._tetra_sigs = None
+        self._bounds_cache = dict()
+
+    @classmethod
+    def load_reference_distributions(cls):
+        '''
+        Read CheckM's reference GC, coding density and tetra distance distributions.
+        Returns a dict keyed by distribution name; it is empty if CheckM is not importable.
+        '''
+        if cls._reference_cache is not None:
+            return cls._reference_cache
+
+        distributions = dict()
+        if _CheckMDefaults is None:
+            log('Warning: CheckM is not importable; dist plots will not show reference ' +
+                'distributions')
+        else:
+            for name in cls.REFERENCE_DISTRIBUTIONS:
+                dist_file = os.path.join(_CheckMDefaults.DISTRIBUTION_DIR, name + '.txt')
+                try:
+                    with open(dist_file) as dist_handle:
+                        distributions[name] = ast.literal_eval(dist_handle.read())
+                except (IOError, OSError, ValueError, SyntaxError) as e:
+                    log('Warning: unable to read reference distribution ' + dist_file +
+                        ': ' + str(e))
+        cls._reference_cache = distributions
+        return distributions
+
+    @staticmethod
+    def _nearest_key(table, value):
+        return min(table.keys(), key=lambda k: abs(float(k) - value))
+
+    def reference_bounds(self, name, mean=None):
+        '''
+        The dist_value percentile bounds of a reference distribution, by sequence length, as
+        a list of [length, lower, upper], read the way `checkm dist_plot` reads them.
+
+        GC and coding density distributions are keyed by the genome mean, as a fraction,
+        then by sequence length and by percentile; the table closest to mean (a percentage)
+        is used, the bounds are the percentiles either side of the central dist_value
+        percent, e.g. 2.5 and 97.5, and they are converted from fractions to percentages.
+        The tetranucleotide distance distribution is keyed by sequence length and then by
+        percentile, with a single (upper) bound at dist_value; lower is None.
+        '''
+        dist = self.load_reference_distributions().get(name)
+        if not dist:
+            return []
+
+        table = dist
+        table_key = None
+        first = table[next(iter(table))]
+        by_mean = isinstance(first, dict) and isinstance(first[next(iter(first))], dict)
+        if by_mean:
+            if mean is None:
+                return []
+            table_key = self._nearest_key(table, mean / 100.0)
+            table = table[table_key]
+        if (name, table_key) in self._bounds_cache:
+            return self._bounds_cache[(name, table_key)]
+
+        percentiles = table[next(iter(table))]
+        if by_mean:
+            lower_key = self._nearest_key(percentiles, (100.0 - self.dist_value) / 2.0)
+            upper_key = self._nearest_key(percentiles, (100.0 + self.dist_value) / 2.0)
+        else:
+            upper_key = self._nearest_key(percentiles, self.dist_value)
+
+        curve = []
+        for window_size in sorted(table.keys(), key=float):
+            percentiles = table[window_size]
+            if by_mean:
+                curve.append([float(window_size), 100.0 * float(percentiles[lower_key]),
+                              100.0 * float(percentiles[upper_key])])
+            else:
+                curve.append([float(window_size), None, float(percentiles[upper_key])])
+        self._bounds_cache[(name, table_key)] = curve
+        return curve
+
+    def preload(self):
+        '''
+        Read the reference distributions and tetra signatures now, e.g. before forking
+        worker processes so that they share one copy.
+        '''
+        self.load_reference_distributions()
+        self._read_tetra_sigs()
+
+    def _read_tetra_sigs(self):
+        if self._tetra_sigs is None:
+            self._tetra_sigs = dict()
+            with open(self.tetra_file) as tetra_handle:
+                for line in tetra_handle:
+                    cols = line.rstrip('\n').split('\t')
+                    if len(cols) < 2:
+                        continue
+                    try:
+                        self._tetra_sigs[cols[0]] = [float(c) for c in cols[1:]]
+                    except ValueError:
+                        # header line
+                        continue
+        return self._tetra_sigs
+
+    def _read_contigs(self, fasta_path):
+        ''' returns [(contig_id, length, gc_bases, acgt_bases), ...] in file order '''
+        contigs = []
+        seq_id = None
+        length = gc = acgt = 0
+        with open(fasta_path) as fasta_handle:
+            for line in fasta_handle:
+                line = line.strip()
+                if line.startswith('>'):
+                    if seq_id is not None:
+                        contigs.append((seq_id, length, gc, acgt))
+                    seq_id = line[1:].split()[0] if len(line) > 1 else ''
+                    length = gc = acgt = 0
+                    continue
+                line = line.upper()
+                length += len(line)
+                g_c = line.count('G') + line.count('C')
+                gc += g_c
+                acgt += g_c + line.count('A') + line.count('T')
+        if seq_id is not None:
+            contigs.append((seq_id, length, gc, acgt))
+        return contigs
+
+    def _read_coding_bases(self, bin_id):
+        ''' coding bases per contig, from the prodigal gene calls made by lineage_wf '''
+        coding = dict()
+        gff_file = os.path.join(self.out_folder, 'bins', bin_id, 'genes.gff')
+        if not os.path.isfile(gff_file):
+            return None
+        with open(gff_file) as gff_handle:
+            for line in gff_handle:
+                if line.startswith('#'):
+                    continue
+                cols = line.split('\t')
+                if len(cols) < 5 or cols[2] != 'CDS':
+                    continue
+                coding[cols[0]] = coding.get(cols[0], 0) + int(cols[4]) - int(cols[3]) + 1
+        return coding
+
+    def bin_data(self, bin_id, fasta_path):
+        '''
+        Per-contig dist plot data for one bin, as a dict of parallel arrays:
+            {'bin_id': ..., 'dist_value': 95,
+             'mean_gc': ..., 'mean_cd': ...,
+             'contigs': [...], 'length': [...],
+             'delta_gc': [...], 'delta_cd': [...], 'td': [...],
+             'reference': {'gc': [[length, lower, upper], ...], 'cd': [...], 'td': [...]}}
+        GC and coding density are percentages; delta_cd and td are None for contigs without
+        gene calls or tetra signatures.
+        '''
+        contigs = self._read_contigs(fasta_path)
+        coding = self._read_coding_bases(bin_id)
+        tetra_sigs = self._read_tetra_sigs()
+
+        total_gc = sum(c[2] for c in contigs)
+        total_acgt = sum(c[3] for c in contigs)
+        total_len = sum(c[1] for c in contigs)
+        mean_gc = 100.0 * total_gc / total_acgt if total_acgt else 0.0
+        mean_cd = None
+        if coding is not None and total_len:
+            mean_cd = 100.0 * sum(coding.get(c[0], 0) for c in contigs) / total_len
+
+        sigs = [tetra_sigs[c[0]] for c in contigs if c[0] in tetra_sigs]
+        mean_sig = None
+        if sigs:
+            mean_sig = [sum(col) / len(sigs) for col in zip(*sigs)]
+
+        data = {'bin_id': bin_id,
+                'dist_value': self.dist_value,
+                'mean_gc': round(mean_gc, 2),
+                'mean_cd': round(mean_cd, 2) if mean_cd is not None else None,
+                'contigs': [], 'length': [], 'delta_gc': [], 'delta_cd': [], 'td': []}
+        for (contig_id, length, gc, acgt) in contigs:
+            data['contigs'].append(contig_id)
+            data['length'].append(length)
+            gc_perc = 100.0 * gc / acgt if acgt else mean_gc
+            data['delta_gc'].append(round(gc_perc - mean_gc, 2))
+            if mean_cd is not None and length:
+                cd_perc = 100.0 * coding.get(contig_id, 0) / length
+                data['delta_cd'].append(round(cd_perc - mean_cd, 2))
+            else:
+                data['delta_cd'].append(None)
+            if mean_sig is not None and contig_id in tetra_sigs:
+                td = sum(abs(a - b) for a, b in zip(tetra_sigs[contig_id], mean_sig))
+                data['td'].append(round(td, 4))
+            else:
+                data['td'].append(None)
+
+        data['reference'] = {'gc': self.reference_bounds('gc_dist', mean_gc),
+                             'cd': self.reference_bounds('cd_dist', mean_cd)
+                                   if mean_cd is not None else [],
+                             'td': self.reference_bounds('td_dist')}
+        return data
+
+    def bin_fasta_files(self):
+        ''' bin ID => fasta path for the bins in bin_folder '''
+        ext = '.' + self.fasta_extension
+        bin_files = dict()
+        for filename in sorted(os.listdir(self.bin_folder)):
+            path = os.path.join(self.bin_folder, filename)
+            if os.path.isfile(path) and filename.endswith(ext):
+                bin_files[filename[:-len(ext)]] = path
+        return bin_files
+
+    def write_bin_data(self, plots_folder, bin_ids=None):
+        '''
+        Write a <bin_id>.dist_data.js file to plots_folder for each bin (or just bin_ids).
+        Each file assigns the bin_data dict to window.CHECKM_DIST_DATA, so it can be loaded
+        with a script tag.  Returns the list of files written.
+        '''
+        if not os.path.exists(plots_folder):
+            os.makedirs(plots_folder)
+
+        written = []
+        for bin_id, fasta_path in self.bin_fasta_files().items():
+            if bin_ids is not None and bin_id not in bin_ids:
+                continue
+            data_file = os.path.join(plots_folder, bin_id + self.DIST_DATA_EXT)
+            with open(data_file, 'w') as data_handle:
+                data_handle.write('window.CHECKM_DIST_DATA = ')
+                json.dump(self.bin_data(bin_id, fasta_path), data_handle, separators=(',', ':'))
+                data_handle.write(';\n')
+            written.append(data_file)
+        return written
@@ -0,0 +1,195 @@
+import os
+import sys
+import time
+import multiprocessing
+
+try:
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import numpy as np
+except ImportError:
+    Figure = None
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+    sys.stdout.flush()
+
+
+# the _BinPainter of a worker process, set by _init_worker once it has been forked
+_worker_painter = None
+
+
+def _init_worker(painter):
+    global _worker_painter
+    _worker_painter = painter
+
+
+def _render_bins(jobs):
+    return _worker_painter.render_bins(jobs)
+
+
+def _values(values):
+    return np.array([v if v is not None else np.nan for v in values], dtype=float)
+
+
+class _BinPainter(object):
+    '''
+    Draws the dist plots of bins on a single figure, redrawn for every bin.  The figure is
+    drawn with its own Agg canvas rather than through pyplot, so that painters in other
+    threads or forked processes share no state with it.
+    '''
+
+    def __init__(self, dist_data, dpi):
+        self.dist_data = dist_data
+        self.dpi = dpi
+        self.figure = None
+        self.axes = None
+        self.curves = dict()
+
+    def _get_figure(self):
+        if self.figure is None:
+            self.figure = Figure(figsize=DistPlotRenderer.FIG_SIZE)
+            FigureCanvasAgg(self.figure)
+            self.axes = self.figure.subplots(3, 2)
+            # a fixed layout; tight_layout would cost more than the drawing itself on every bin
+            self.figure.subplots_adjust(left=0.08, right=0.97, bottom=0.06, top=0.93,
+                                        hspace=0.35, wspace=0.25)
+        return self.figure, self.axes
+
+    def _curve_array(self, curve):
+        # DistPlotData caches reference curves, so the same list comes back for every bin
+        # with a similar mean; convert each one once
+        key = id(curve)
+        if key not in self.curves:
+            self.curves[key] = (curve, np.array([[c if c is not None else np.nan for c in row]
+                                                 for row in curve], dtype=float))
+        return self.curves[key][1]
+
+    def _draw_panel(self, hist_ax, delta_ax, lengths, values, curve, mean, label,
+                    delta_label):
+        hist_ax.clear()
+        delta_ax.clear()
+
+        present = ~np.isnan(values)
+        if present.any():
+            shown = values[present] + (mean if mean is not None else 0.0)
+            hist_ax.hist(shown, bins=20, weights=lengths[present] / 1000.0)
+            delta_ax.scatter(values[present], lengths[present] / 1000.0, s=6, alpha=0.6,
+                             edgecolors='none')
+        else:
+            hist_ax.text(0.5, 0.5, 'no data', ha='center', va='center',
+                         transform=hist_ax.transAxes)
+        hist_ax.set_xlabel(label)
+        hist_ax.set_ylabel('Sequence length (kbp)')
+
+        if len(curve):
+            ref = self._curve_array(curve)
+            # reference curves are bounds on the deviation for a sequence length
+            delta_ax.plot(ref[:, 2], ref[:, 0] / 1000.0, color='red', linewidth=1)
+            if not np.isnan(ref[:, 1]).all():
+                delta_ax.plot(ref[:, 1], ref[:, 0] / 1000.0, color='red', linewidth=1)
+        delta_ax.set_xlabel(delta_label)
+        delta_ax.set_ylabel('Sequence length (kbp)')
+
+    def render_bins(self, jobs):
+        '''
+        Draw the dist plots for a batch of (bin_id, fasta_path, plot_path).  Returns the list
+        of plot files written and a list of warnings; nothing is logged here, as a forked
+        worker may have inherited the lock of an output stream another thread held.
+        '''
+        fig, axes = self._get_figure()
+        written = []
+        warnings = []
+        for (bin_id, fasta_path, plot_path) in jobs:
+            try:
+                data = self.dist_data.bin_data(bin_id, fasta_path)
+                lengths = np.array(data['length'], dtype=float)
+                fig.suptitle('Bin ' + bin_id + ' (' + str(len(lengths)) + ' sequences)')
+                self._draw_panel(axes[0][0], axes[0][1], lengths, _values(data['delta_gc']),
+                                 data['reference']['gc'], data['mean_gc'],
+                                 'GC (%)', 'Deviation from mean GC (%)')
+                self._draw_panel(axes[1][0], axes[1][1], lengths, _values(data['delta_cd']),
+                                 data['reference']['cd'], data['mean_cd'],
+                                 'Coding density (%)',
+                                 'Deviation from mean coding density (%)')
+                self._draw_panel(axes[2][0], axes[2][1], lengths, _values(data['td']),
+                                 data['reference']['td'], None,
+                                 'Tetranucleotide distance', 'Tetranucleotide distance')
+                fig.savefig(plot_path, dpi=self.dpi)
+                written.append(plot_path)
+            except (IOError, OSError, ValueError) as e:
+                warnings.append('Warning: unable to draw dist plot for bin ' + bin_id + ': ' +
+                                str(e))
+        return written, warnings
+
+
+class DistPlotRenderer(object):
+    '''
+    Draws the per-bin dist plots in-process, as a replacement for `checkm dist_plot`.
+    The plot data comes from DistPlotData; the tetra signatures and reference distributions
+    are read once, before the worker processes are forked, and each worker reuses a single
+    figure for all of its bins instead of building and tearing one down per bin.  Nothing
+    is drawn through pyplot, so rendering is safe alongside the other stages' threads.
+    '''
+
+    PLOT_EXT = '.ref_dist_plots.png'
+    FIG_SIZE = (10, 10)
+    DPI = 100
+    BATCHES_PER_WORKER = 4
+
+    def __init__(self, dist_data, workers=1, dpi=None):
+        self.dist_data = dist_data
+        self.workers = max(1, int(workers))
+        self.dpi = dpi or self.DPI
+
+    @staticmethod
+    def is_available():
+        return Figure is not None
+
+    def render(self, plots_folder, bin_ids=None):
+        '''
+        Write a <bin_id>.ref_dist_plots.png to plots_folder for each bin (or just bin_ids).
+        Returns the list of files written.
+        '''
+        if not os.path.exists(plots_folder):
+            os.makedirs(plots_folder)
+
+        jobs = []
+        for bin_id, fasta_path in self.dist_data.bin_fasta_files().items():
+            if bin_ids is not None and bin_id not in bin_ids:
+                continue
+            jobs.append((bin_id, fasta_path, os.path.join(plots_folder, bin_id + self.PLOT_EXT)))
+        if not jobs:
+            return []
+
+        self.dist_data.preload()
+        painter = _BinPainter(self.dist_data, self.dpi)
+        workers = min(self.workers, len(jobs))
+        if workers == 1:
+            written, warnings = painter.render_bins(jobs)
+        else:
+            # interleave the bins so that each batch gets a mix of large and small ones
+            n_batches = min(len(jobs), workers * self.BATCHES_PER_WORKER)
+            batches = [jobs[i::n_batches] for i in range(n_batches)]
+            written = []
+            warnings = []
+            # fork, so that the workers share the data read by preload() rather than
+            # pickling it
+            pool = multiprocessing.get_context('fork').Pool(processes=workers,
+                                                            initializer=_init_worker,
+                                                            initargs=(painter,))
+            try:
+                for batch_written, batch_warnings in pool.map(_render_bins, batches):
+                    written.extend(batch_written)
+                    warnings.extend(batch_warnings)
+                pool.close()
+            except BaseException:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        for warning in warnings:
+            log(warning)
+        return written
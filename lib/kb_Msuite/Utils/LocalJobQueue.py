@@ -0,0 +1,181 @@
+import os
+import sys
+import time
+import json
+import uuid
+import socket
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+    sys.stdout.flush()
+
+
+class LocalJobQueue(object):
+    '''
+    Runs method calls in the background, on a pool of at most `workers` threads, so the
+    caller gets a job ID at once instead of holding a server thread and its connection for
+    the whole run.  The state of each job is a JSON file in state_dir:
+        {'job_id', 'method', 'user_id', 'status', 'submitted', 'started', 'completed',
+         'pid', 'host', 'result', 'error'}
+    with status one of queued, running, completed or error, so the jobs can be checked from
+    any server process on the host.  The worker pool is per process.
+
+    The call itself (and the auth token in its context) is only held in memory: jobs that
+    were queued or running in a process that is gone are marked as errors and have to be
+    resubmitted (the lineage_wf pipeline resumes from its checkpoints).  That is done when
+    a queue is created and whenever such a job is checked.
+    '''
+
+    STATUSES = ['queued', 'running', 'completed', 'error']
+    FINISHED = ['completed', 'error']
+    STATE_EXT = '.job.json'
+
+    def __init__(self, state_dir, workers=1, retention_days=7):
+        self.state_dir = state_dir
+        self.workers = max(1, int(workers))
+        self.retention_seconds = float(retention_days) * 86400
+        self.host = socket.gethostname()
+        if not os.path.exists(self.state_dir):
+            os.makedirs(self.state_dir)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._recover()
+
+    def submit(self, method_name, func, user_id=None):
+        '''
+        Queue func (called with no arguments) as a job for method_name; returns the job ID.
+        The job result is what func returns, which must be JSON serializable.
+        '''
+        job_id = str(uuid.uuid4())
+        job = {'job_id': job_id,
+               'method': method_name,
+               'user_id': user_id,
+               'status': 'queued',
+               'submitted': time.time(),
+               'started': None,
+               'completed': None,
+               'pid': os.getpid(),
+               'host': self.host,
+               'result': None,
+               'error': None}
+        self._write_state(job)
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+            self._pool.submit(self._run, job, func)
+        log('Queued job ' + job_id + ' for ' + method_name)
+        return job_id
+
+    def check(self, job_id, user_id=None):
+        '''
+        The state of a job: the job dict above, with 'finished' set to 1 once it has
+        completed or failed.  This is the state that the SDK clients' run_job() polls for
+        with _check_job.
+        '''
+        job = self._read_state(job_id, user_id)
+        if job['status'] not in self.FINISHED:
+            # the process running it may have been recycled since the server started
+            self._fail_orphaned(job)
+        job['finished'] = 1 if job['status'] in self.FINISHED else 0
+        return job
+
+    def _run(self, job, func):
+        job['status'] = 'running'
+        job['started'] = time.time()
+        self._write_state(job)
+        log('Running job ' + job['job_id'] + ' for ' + job['method'])
+        try:
+            job['result'] = func()
+            job['status'] = 'completed'
+        except Exception as e:
+            # JSON-RPC errors carry a code, name (message), details (data) and trace
+            job['error'] = {'code': getattr(e, 'code', 0),
+                            'name': getattr(e, 'message', None) or type(e).__name__,
+                            'message': getattr(e, 'data', None) or str(e),
+                            'error': getattr(e, 'trace', None) or traceback.format_exc()}
+            job['status'] = 'error'
+        job['completed'] = time.time()
+        try:
+            self._write_state(job)
+        except (TypeError, ValueError) as e:
+            job['result'] = None
+            job['error'] = {'code': 0, 'name': 'Unexpected Server Error',
+                            'message': 'Job result could not be saved: ' + str(e),
+                            'error': traceback.format_exc()}
+            job['status'] = 'error'
+            self._write_state(job)
+        log('Job ' + job['job_id'] + ' ' + job['status'] + ' after {0:.1f}s'.format(
+            job['completed'] - job['started']))
+
+    def _state_path(self, job_id):
+        return os.path.join(self.state_dir, job_id + self.STATE_EXT)
+
+    def _write_state(self, job):
+        # write and rename, so a reader never sees a partial file
+        tmp_path = self._state_path(job['job_id']) + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'w') as state_handle:
+            json.dump(job, state_handle)
+        os.replace(tmp_path, self._state_path(job['job_id']))
+
+    def _read_state(self, job_id, user_id=None):
+        # job IDs are UUIDs; anything else can't name a state file
+        try:
+            job_id = str(uuid.UUID(str(job_id)))
+        except ValueError:
+            raise ValueError('Invalid job ID: ' + str(job_id))
+        try:
+            with open(self._state_path(job_id)) as state_handle:
+                job = json.load(state_handle)
+        except (IOError, OSError):
+            raise ValueError('Unknown job ID: ' + job_id)
+        if user_id is not None and job.get('user_id') not in (None, user_id):
+            raise ValueError('Job ' + job_id + ' was not submitted by ' + str(user_id))
+        return job
+
+    def _pid_alive(self, pid):
+        if not pid:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            # exists, but belongs to another user
+            return True
+        return True
+
+    def _recover(self):
+        ''' fail the unfinished jobs of processes that are gone, and remove old jobs '''
+        now = time.time()
+        for filename in os.listdir(self.state_dir):
+            if not filename.endswith(self.STATE_EXT):
+                continue
+            path = os.path.join(self.state_dir, filename)
+            try:
+                with open(path) as state_handle:
+                    job = json.load(state_handle)
+            except (IOError, OSError, ValueError):
+                continue
+            if job['status'] in self.FINISHED:
+                if now - (job.get('completed') or now) > self.retention_seconds:
+                    os.remove(path)
+                continue
+            self._fail_orphaned(job)
+
+    def _fail_orphaned(self, job):
+        ''' fail job if it is unfinished and its process on this host is gone '''
+        if job.get('host') != self.host or self._pid_alive(job.get('pid')):
+            return
+        log('Job ' + job['job_id'] + ' was interrupted: its server process exited')
+        job['status'] = 'error'
+        job['completed'] = time.time()
+        job['error'] = {'code': 0, 'name': 'Job interrupted',
+                        'message': 'The server process running the job exited; ' +
+                                   'please resubmit it',
+                        'error': None}
+        self._write_state(job)
@@ -0,0 +1,169 @@
+import os
+import sys
+import time
+import cProfile
+import pstats
+import threading
+import tracemalloc
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+    sys.stdout.flush()
+
+
+# tracemalloc and threading.setprofile are global to the process, so one call is profiled at a
+# time; held from start() to stop()
+_profiling = threading.Lock()
+
+
+class MethodProfiler(object):
+    '''
+    Opt-in cProfile and tracemalloc profiling of a kb_Msuite method call.  Profiling is
+    requested with the 'profile' parameter set to 1, or with the KB_MSUITE_PROFILE environment
+    variable set to 1 (every method) or to a comma separated list of method names.
+
+    cProfile only sees the thread it is enabled on, so threads started while the profiler
+    runs (e.g. the pipeline stages and uploads) get a profiler of their own, and the stats
+    of all of them are combined.  Work done in subprocesses is not profiled.
+
+    Only one call in a process is profiled at a time; a call that asks for a profile while
+    another is being profiled runs without one.
+    '''
+
+    ENV_VAR = 'KB_MSUITE_PROFILE'
+    PARAM = 'profile'
+    TRACEMALLOC_FRAMES = 10
+    TOP_FUNCTIONS = 100
+    TOP_ALLOCATIONS = 50
+
+    @classmethod
+    def from_params(cls, method_name, params):
+        '''
+        A started MethodProfiler for method_name if profiling is requested, otherwise None;
+        the method then runs exactly as it would without this class.
+        '''
+        requested = str(params.get(cls.PARAM, 0)) == '1'
+        env_value = os.environ.get(cls.ENV_VAR, '').strip()
+        if env_value in ('1', 'true', 'all') or \
+           method_name in [m.strip() for m in env_value.split(',')]:
+            requested = True
+        if not requested:
+            return None
+        profiler = cls(method_name)
+        if not profiler.start():
+            return None
+        return profiler
+
+    def __init__(self, method_name):
+        self.method_name = method_name
+        self.running = False
+        self.written = False
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._start = None
+        self._wall_seconds = None
+        self._peak_traced = None
+
+    def start(self):
+        ''' start profiling; returns False, and does nothing, if another profile is running '''
+        if not _profiling.acquire(blocking=False):
+            log('Not profiling ' + self.method_name + ': another method call is being profiled')
+            return False
+        log('Profiling ' + self.method_name)
+        tracemalloc.start(self.TRACEMALLOC_FRAMES)
+        threading.setprofile(self._profile_new_thread)
+        self._start = time.time()
+        self.running = True
+        profile = cProfile.Profile()
+        self._profiles.append(profile)
+        profile.enable()
+        return True
+
+    def _profile_new_thread(self, frame, event, arg):
+        # threading calls this on the first event in each new thread; hand over to cProfile
+        sys.setprofile(None)
+        if not self.running:
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # from Python 3.12 a profiler already sees every thread, and only one can be active
+            return
+        with self._lock:
+            self._profiles.append(profile)
+
+    def stop(self):
+        ''' stop profiling; the calling thread must be the one that started it '''
+        if not self.running:
+            return
+        self.running = False
+        threading.setprofile(None)
+        self._profiles[0].disable()
+        self._wall_seconds = time.time() - self._start
+        self._snapshot = tracemalloc.take_snapshot()
+        self._peak_traced = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        _profiling.release()
+
+    def write(self, folder):
+        '''
+        Stop profiling and write the results to folder:
+            <method>.prof - the combined cProfile stats, for pstats or e.g. snakeviz
+            <method>.profile.txt - the top functions by cumulative time
+            <method>.allocations.txt - the top allocations still held when profiling stopped
+        Returns the list of files written.
+        '''
+        self.stop()
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        with self._lock:
+            profiles = list(self._profiles)
+        stats = None
+        for profile in profiles:
+            # a profile still enabled on a thread that is alive is snapshot as it is
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+        prof_file = os.path.join(folder, self.method_name + '.prof')
+        text_file = os.path.join(folder, self.method_name + '.profile.txt')
+        with open(text_file, 'w') as text_handle:
+            text_handle.write('Profile of {0}: {1:.1f}s wall time, {2} threads\n\n'.format(
+                self.method_name, self._wall_seconds, len(profiles)))
+            if stats is not None:
+                stats.dump_stats(prof_file)
+                stats.stream = text_handle
+                stats.sort_stats('cumulative').print_stats(self.TOP_FUNCTIONS)
+
+        alloc_file = os.path.join(folder, self.method_name + '.allocations.txt')
+        with open(alloc_file, 'w') as alloc_handle:
+            top_stats = self._snapshot.statistics('traceback')
+            alloc_handle.write('Peak traced memory {0:.1f} MB\n'.format(
+                self._peak_traced / 1048576.0))
+            alloc_handle.write('Top {0} of {1} allocations held, {2:.1f} MB in total\n\n'.format(
+                min(self.TOP_ALLOCATIONS, len(top_stats)), len(top_stats),
+                sum(stat.size for stat in top_stats) / 1048576.0))
+            for stat in top_stats[:self.TOP_ALLOCATIONS]:
+                alloc_handle.write('{0:.1f} KB in {1} blocks\n'.format(stat.size / 1024.0,
+                                                                      stat.count))
+                for line in stat.traceback.format():
+                    alloc_handle.write(line + '\n')
+                alloc_handle.write('\n')
+
+        self.written = True
+        log('Wrote profile of ' + self.method_name + ' to ' + folder)
+        return [f for f in [prof_file, text_file, alloc_file] if os.path.exists(f)]
+
+    def finish(self, folder):
+        ''' write the results to folder, unless they were already written elsewhere '''
+        if not self.written:
+            self.write(folder)
@@ -2,12 +2,26 @@ import os
 import shutil
 import re
 import ast
+import json
 import sys
 import time
+import math
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from html import escape
+from itertools import repeat
+from urllib.parse import quote
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 from installed_clients.DataFileUtilClient import DataFileUtil
 from installed_clients.MetagenomeUtilsClient import MetagenomeUtils
 
+from kb_Msuite.Utils.DistPlotData import DistPlotData
+from kb_Msuite.Utils.ResourceTimeline import timeline_svg
+
 
 def log(message, prefix_newline=False):
     """Logging function, provides a hook to suppress or redirect log messages."""
@@ -15,18 +29,172 @@ def log(message, prefix_newline=False):
     sys.stdout.flush()
 
 
+def read_bin_stats(output_dir):
+    '''
+    Parse storage/bin_stats_ext.tsv from the lineage_wf output in output_dir into a dict keyed
+    by bin ID.  Returns None if the stats file does not exist.
+    '''
+    stats_file = os.path.join(output_dir, 'storage', 'bin_stats_ext.tsv')
+    if not os.path.isfile(stats_file):
+        log('Warning! no stats file found (looking at: ' + stats_file + ')')
+        return None
+
+    bin_stats = dict()
+    with open(stats_file) as lf:
+        for line in lf:
+            if not line:
+                continue
+            if line.startswith('#'):
+                continue
+            col = line.split('\t')
+            bin_id = str(col[0])
+            data = ast.literal_eval(col[1])
+            bin_stats[bin_id] = data
+    return bin_stats
+
+
+FAILED_BINS_FILE = 'failed_bins.tsv'
+
+
+def write_failed_bins(output_dir, failed_bins):
+    '''
+    Record the bins that lineage_wf failed on, as a dict of bin ID => error message, in
+    storage/failed_bins.tsv of the lineage_wf output in output_dir
+    '''
+    storage_dir = os.path.join(output_dir, 'storage')
+    if not os.path.exists(storage_dir):
+        os.makedirs(storage_dir)
+    with open(os.path.join(storage_dir, FAILED_BINS_FILE), 'w') as failed_handle:
+        for bin_id in sorted(failed_bins.keys()):
+            failed_handle.write(bin_id + '\t' + ' '.join(str(failed_bins[bin_id]).split()) + '\n')
+
+
+def read_failed_bins(output_dir):
+    ''' bin ID => error message for the bins that lineage_wf failed on; see write_failed_bins() '''
+    failed_bins = dict()
+    failed_file = os.path.join(output_dir, 'storage', FAILED_BINS_FILE)
+    if os.path.isfile(failed_file):
+        with open(failed_file) as failed_handle:
+            for line in failed_handle:
+                col = line.rstrip('\n').split('\t', 1)
+                if col[0]:
+                    failed_bins[col[0]] = col[1] if len(col) > 1 else ''
+    return failed_bins
+
+
+def _save_palette_png(img, path):
+    img.quantize(colors=256).save(path, format='PNG', optimize=True)
+
+
+def _write_thumbnail(img, thumb_path, thumb_size):
+    ''' write a thumbnail of img, of at most thumb_size, to thumb_path; returns its size '''
+    thumb = img.copy()
+    thumb.thumbnail(thumb_size, Image.LANCZOS)
+    _save_palette_png(thumb, thumb_path)
+    return os.path.getsize(thumb_path)
+
+
+def _rewrite_thumbnail(image_path, thumb_path, thumb_size):
+    '''
+    Write a thumbnail of a plot image again, of at most thumb_size.
+    Runs in a worker process of OutputBuilder.optimize_plot_images.
+    '''
+    img = Image.open(image_path)
+    img.load()
+    return _write_thumbnail(img.convert('RGB'), thumb_path, thumb_size)
+
+
+def _optimize_plot_image(image_path, thumb_path, thumb_size, scale=1.0):
+    '''
+    Recompress a plot image as a 256 colour PNG, scaled down by scale, and write a thumbnail
+    of at most thumb_size to thumb_path (skipped if thumb_path is None).  The image is
+    replaced rather than rewritten, so any hard-linked original is left alone.
+    Runs in a worker process of OutputBuilder.optimize_plot_images.
+    Returns the sizes in bytes of (image, thumbnail).
+    '''
+    img = Image.open(image_path)
+    img.load()
+    img = img.convert('RGB')
+
+    thumb_bytes = _write_thumbnail(img, thumb_path, thumb_size) if thumb_path else 0
+
+    if scale < 1.0:
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))),
+                         Image.LANCZOS)
+    tmp_path = image_path + '.tmp'
+    _save_palette_png(img, tmp_path)
+    if scale >= 1.0 and os.path.getsize(tmp_path) >= os.path.getsize(image_path):
+        # already well compressed; keep the original
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, image_path)
+
+    return os.path.getsize(image_path), thumb_bytes
+
+
 class OutputBuilder(object):
     '''
     Constructs the output HTML report and artifacts based on a CheckM lineage_wf
     run.  This includes running any necssary plotting utilities of CheckM.
     '''
 
-    def __init__(self, output_dir, plots_dir, scratch_dir, callback_url):
+    # summary table columns, in display order
+    SUMMARY_FIELDS = [{'id': 'marker lineage', 'display': 'Marker Lineage'},
+                      {'id': '# genomes', 'display': '# Genomes'},
+                      {'id': '# markers', 'display': '# Markers'},
+                      {'id': '# marker sets', 'display': '# Marker Sets'},
+                      {'id': '0', 'display': '0'},
+                      {'id': '1', 'display': '1'},
+                      {'id': '2', 'display': '2'},
+                      {'id': '3', 'display': '3'},
+                      {'id': '4', 'display': '4'},
+                      {'id': '5+', 'display': '5+'},
+                      {'id': 'Completeness', 'display': 'Completeness', 'round': 2},
+                      {'id': 'Contamination', 'display': 'Contamination', 'round': 2}]
+
+    # summary table modes: 'html' writes every bin as a table row, 'data' writes the bin stats
+    # to a data file that is rendered client side, 'auto' picks 'data' for large bin counts
+    TABLE_MODES = ['auto', 'html', 'data']
+    DATA_TABLE_MIN_BINS = 500
+    SUMMARY_DATA_FILE = 'CheckM_summary_data.js'
+
+    # single page used to view the dist plot of any bin, selected by the URL fragment
+    DIST_PLOT_VIEWER = 'CheckM_Bin_Plot.html'
+
+    # dist plot thumbnails, shown in the summary table
+    THUMB_EXT = '.ref_dist_plots.thumb.png'
+    THUMB_SIZE = (300, 100)
+    # with an image byte budget, the thumbnails are made smaller, down to THUMB_MIN_SIZE, if
+    # they would take more than this share of it
+    THUMB_BUDGET_SHARE = 0.5
+    THUMB_MIN_SIZE = (60, 20)
+
+    # per-bin dist plot data, drawn in the browser (see DistPlotData)
+    DIST_DATA_EXT = DistPlotData.DIST_DATA_EXT
+
+    # machine readable run telemetry, see RunTelemetry
+    TELEMETRY_FILE = 'CheckM_telemetry.json'
+
+    def __init__(self, output_dir, plots_dir, scratch_dir, callback_url, upload_threads=4,
+                 table_mode='auto', optimize_images=True, image_workers=1,
+                 image_byte_budget=None, telemetry=None, dist_plots_dir=None):
         self.output_dir = output_dir
         self.plots_dir = plots_dir
+        # where the dist plots are, if not with the overview plot in plots_dir
+        self.dist_plots_dir = dist_plots_dir or plots_dir
         self.scratch = scratch_dir
         self.callback_url = callback_url
         self.DIST_PLOT_EXT = '.ref_dist_plots.png'
+        if table_mode not in self.TABLE_MODES:
+            raise ValueError('Invalid summary table mode: ' + str(table_mode) +
+                             ' (must be one of ' + ', '.join(self.TABLE_MODES) + ')')
+        self.table_mode = table_mode
+        self.upload_threads = max(1, int(upload_threads))
+        self._upload_executor = None
+        self.optimize_images = optimize_images
+        self.image_workers = max(1, int(image_workers))
+        self.image_byte_budget = int(image_byte_budget) if image_byte_budget else None
+        self.telemetry = telemetry
 
     def package_folder(self, folder_path, zip_file_name, zip_file_description):
         ''' Simple utility for packaging a folder and saving to shock '''
@@ -35,13 +203,53 @@ class OutputBuilder(object):
         dfu = DataFileUtil(self.callback_url)
         if not os.path.exists(folder_path):
             raise ValueError("cannot package folder that doesn't exist: "+folder_path)
-        output = dfu.file_to_shock({'file_path': folder_path,
-                                    'make_handle': 0,
-                                    'pack': 'zip'})
+        if self.telemetry is not None:
+            with self.telemetry.stage('upload ' + zip_file_name):
+                self.telemetry.count(**self._folder_size(folder_path))
+                output = dfu.file_to_shock({'file_path': folder_path,
+                                            'make_handle': 0,
+                                            'pack': 'zip'})
+        else:
+            output = dfu.file_to_shock({'file_path': folder_path,
+                                        'make_handle': 0,
+                                        'pack': 'zip'})
         return {'shock_id': output['shock_id'],
                 'name': zip_file_name,
                 'description': zip_file_description}
 
+    def _folder_size(self, folder_path):
+        files = 0
+        size = 0
+        for root, dirs, filenames in os.walk(folder_path):
+            for filename in filenames:
+                files += 1
+                size += os.path.getsize(os.path.join(root, filename))
+        return {'files': files, 'bytes': size}
+
+    def package_folder_async(self, folder_path, zip_file_name, zip_file_description):
+        '''
+        Start packaging a folder in the background and return a Future that resolves to the
+        same dict as package_folder.  The folder must not change after this is called.
+        Uploads share a thread pool of at most upload_threads workers.
+        '''
+        if self._upload_executor is None:
+            self._upload_executor = ThreadPoolExecutor(max_workers=self.upload_threads)
+        return self._upload_executor.submit(self.package_folder, folder_path,
+                                            zip_file_name, zip_file_description)
+
+    def wait_for_packages(self, pending_packages):
+        '''
+        Block until the given package_folder_async uploads are done and return their
+        results, in the same order.  Any upload error is raised here.
+        '''
+        return [pending.result() for pending in pending_packages]
+
+    def shutdown_uploads(self):
+        ''' Wait for any outstanding uploads and release the upload thread pool '''
+        if self._upload_executor is not None:
+            self._upload_executor.shutdown(wait=True)
+            self._upload_executor = None
+
     def build_critical_output(self, critical_out_dir):
         src = self.output_dir
         dest = critical_out_dir
@@ -58,9 +266,14 @@ class OutputBuilder(object):
         self._copy_file_ignore_errors(os.path.join('storage', 'marker_gene_stats.tsv'), src, dest)
         self._copy_file_ignore_errors(os.path.join('storage', 'tree', 'concatenated.tre'), src, dest)
 
-    def build_html_output_for_lineage_wf(self, html_dir, object_name, removed_bins=None):
+    def build_html_output_for_lineage_wf(self, html_dir, object_name, removed_bins=None,
+                                         plotted_bins=None, telemetry=None):
         '''
-        Based on the output of CheckM lineage_wf, build an HTML report
+        Based on the output of CheckM lineage_wf, build an HTML report.
+        plotted_bins is the set of bins that dist plots were made for, or None if every bin
+        was plotted; the others are marked as not plotted in the summary table.
+        telemetry is a RunTelemetry summary; it is saved in the report as JSON and shown
+        below the plot.
         '''
         html_files = []
 
@@ -71,11 +284,15 @@ class OutputBuilder(object):
         if plot_exists:
             shutil.copy(plot_path, os.path.join(html_dir, plot_name))
         else:
-            log(
-                'Warning: the bin_qa_plot image was not generated. '
-                'This is most likely due to image and file size.'
-            )
-        self._copy_ref_dist_plots(self.plots_dir, html_dir)
+            log('Warning: the bin_qa_plot image was not generated.')
+        if (os.path.isdir(self.dist_plots_dir) and
+           self._copy_ref_dist_plots(self.dist_plots_dir, html_dir)):
+            if any(f.endswith(self.DIST_DATA_EXT) for f in os.listdir(html_dir)):
+                self._write_interactive_dist_plot_viewer(html_dir)
+            else:
+                if self.optimize_images:
+                    self.optimize_plot_images(html_dir)
+                self._write_dist_plot_viewer(html_dir)
 
         # write the html report to file
         report_type = 'Plot'
@@ -97,11 +314,10 @@ class OutputBuilder(object):
             html.write('<img src="' + plot_name + '" width="90%" />\n')
             html.write('</div>\n')
         else:
-            html.write(
-                '<p>Sorry, the Bin QA Plot was not generated. '
-                'This is likely due to having too many bins and '
-                'too large of an image size to properly render.</p>'
-            )
+            html.write('<p>Sorry, the Bin QA Plot was not generated.</p>')
+
+        if telemetry:
+            self.build_telemetry_table(html, html_dir, telemetry)
 
         # close the CheckM plot
         #self._write_script(html)  # don't need for tabs anymore
@@ -122,7 +338,8 @@ class OutputBuilder(object):
         # tabs
         self._write_tabs(html, report_type)
         html.write('<br><br><br>\n')
-        self.build_summary_table(html, html_dir, removed_bins=removed_bins)
+        self.build_summary_table(html, html_dir, removed_bins=removed_bins,
+                                 plotted_bins=plotted_bins)
         #self._write_script(html)  # don't need for tabs anymore
 
         html.write('</body>\n</html>\n')
@@ -131,6 +348,64 @@ class OutputBuilder(object):
         return html_files
 
 
+    def build_telemetry_table(self, html, html_dir, telemetry):
+        '''
+        Save the run telemetry (see RunTelemetry) to html_dir and write a table of the time
+        and resources used by each stage, followed by a timeline chart of the CPU and memory
+        use of each CheckM process
+        '''
+        with open(os.path.join(html_dir, self.TELEMETRY_FILE), 'w') as telemetry_handle:
+            json.dump(telemetry, telemetry_handle, indent=1, sort_keys=True)
+
+        def mb(n_bytes):
+            return '{0:.1f}'.format(n_bytes / 1048576.0)
+
+        html.write('<br><br>\n')
+        html.write('<h3>Run statistics</h3>\n')
+        html.write('<p>Wall time {0:.1f}s; CPU time {1:.1f}s (CheckM and other child '
+                   'processes {2:.1f}s); peak RSS of the largest child process {3} MB.  '
+                   'All of the figures are in <a href="{4}">{4}</a>.</p>\n'
+                   .format(telemetry['wall_seconds'],
+                           telemetry['cpu_seconds'] + telemetry['children_cpu_seconds'],
+                           telemetry['children_cpu_seconds'],
+                           mb(telemetry['children_peak_rss']),
+                           self.TELEMETRY_FILE))
+        if telemetry.get('scratch'):
+            scratch = telemetry['scratch']
+            html.write('<p>Peak scratch footprint {0} MB on disk and {1} MB on tmpfs, '
+                       'at {2}s; {3} MB of intermediates removed as soon as they were no '
+                       'longer needed.</p>\n'
+                       .format(mb(scratch['peak_bytes']), mb(scratch['peak_tmpfs_bytes']),
+                               scratch['peak_time'], mb(scratch['freed_bytes'])))
+        html.write('<table>\n<tr><th>Stage</th><th>Start (s)</th><th>Wall time (s)</th>'
+                   '<th>CPU time (s)</th><th>Peak RSS (MB)</th><th>Read (MB)</th>'
+                   '<th>Written (MB)</th><th>Queue wait (s)</th><th>Counts</th></tr>\n')
+        for stage in telemetry['stages']:
+            counts = ', '.join(k + ': ' + str(v) for k, v in sorted(stage['counts'].items()))
+            html.write('<tr><td>' + stage['name'] + (' (failed)' if stage['failed'] else '') +
+                       '</td><td>{0:.1f}</td><td>{1:.1f}</td><td>{2:.1f}</td><td>{3}</td>'
+                       '<td>{4}</td><td>{5}</td><td>{6:.1f}</td><td>{7}</td></tr>\n'
+                       .format(stage['start'], stage['wall_seconds'], stage['cpu_seconds'],
+                               mb(stage['peak_rss']), mb(stage['read_bytes']),
+                               mb(stage['write_bytes']), stage.get('queue_wait_seconds', 0.0),
+                               counts))
+        html.write('</table>\n')
+        if telemetry.get('skipped_stages'):
+            html.write('<p>Completed in an earlier run: ' +
+                       ', '.join(telemetry['skipped_stages']) + '</p>\n')
+
+        for stage in telemetry['stages']:
+            for i, process in enumerate(stage['processes']):
+                title = 'checkm ' + process['name'] + ' (' + stage['name'] + ')'
+                svg = timeline_svg(process.get('timeline') or {}, title)
+                if svg is None:
+                    continue
+                svg_file = 'CheckM_timeline_' + re.sub('[^\w.-]', '_', stage['name']) + \
+                    '_' + str(i) + '.svg'
+                with open(os.path.join(html_dir, svg_file), 'w') as svg_handle:
+                    svg_handle.write(svg)
+                html.write('<div><img src="' + svg_file + '" alt="' + title + '" /></div>\n')
+
     def _write_tabs(self, html, report_type):
         #tabs = '''
         #<div class="tab">
@@ -172,37 +447,56 @@ class OutputBuilder(object):
         '''
         html.write(script)
 
-    def build_summary_table(self, html, html_dir, removed_bins=None):
+    def read_bin_stats(self):
+        ''' Parse the bin stats of this lineage_wf output; see read_bin_stats() '''
+        return read_bin_stats(self.output_dir)
 
-        stats_file = os.path.join(self.output_dir, 'storage', 'bin_stats_ext.tsv')
-        if not os.path.isfile(stats_file):
-            log('Warning! no stats file found (looking at: ' + stats_file + ')')
+    def read_summary_bin_stats(self):
+        '''
+        The bin stats for the summary tables: read_bin_stats(), plus an entry for each bin
+        that lineage_wf failed on, with the error in place of the marker lineage.
+        Returns (bin_stats, failed_bins), or (None, None) if there are no bin stats.
+        '''
+        bin_stats = self.read_bin_stats()
+        if bin_stats is None:
+            return None, None
+        failed_bins = read_failed_bins(self.output_dir)
+        for bid, error in failed_bins.items():
+            bin_stats[bid] = {'marker lineage': 'ERROR: ' + error}
+        return bin_stats, failed_bins
+
+    def _bin_is_removed(self, bid, removed_bins):
+        if not removed_bins:
+            return False
+        bin_id = re.sub('^[^\.]+\.', '', bid)
+        return bin_id in removed_bins
+
+    def _bin_not_plotted(self, bid, plotted_bins):
+        return plotted_bins is not None and bid not in plotted_bins
+
+    def _summary_value(self, bin_data, field):
+        ''' the display value of field for a bin, or None if the bin doesn't have it '''
+        if field['id'] not in bin_data:
+            return None
+        if field.get('round'):
+            return round(bin_data[field['id']], field['round'])
+        return bin_data[field['id']]
+
+    def build_summary_table(self, html, html_dir, removed_bins=None, plotted_bins=None):
+
+        bin_stats, failed_bins = self.read_summary_bin_stats()
+        if bin_stats is None:
             return
 
-        bin_stats = dict()
-        with open(stats_file) as lf:
-            for line in lf:
-                if not line:
-                    continue
-                if line.startswith('#'):
-                    continue
-                col = line.split('\t')
-                bin_id = str(col[0])
-                data = ast.literal_eval(col[1])
-                bin_stats[bin_id] = data
-
-        fields = [{'id': 'marker lineage', 'display': 'Marker Lineage'},
-                  {'id': '# genomes', 'display': '# Genomes'},
-                  {'id': '# markers', 'display': '# Markers'},
-                  {'id': '# marker sets', 'display': '# Marker Sets'},
-                  {'id': '0', 'display': '0'},
-                  {'id': '1', 'display': '1'},
-                  {'id': '2', 'display': '2'},
-                  {'id': '3', 'display': '3'},
-                  {'id': '4', 'display': '4'},
-                  {'id': '5+', 'display': '5+'},
-                  {'id': 'Completeness', 'display': 'Completeness', 'round': 2},
-                  {'id': 'Contamination', 'display': 'Contamination', 'round': 2}]
+        table_mode = self.table_mode
+        if table_mode == 'auto':
+            table_mode = 'data' if len(bin_stats) >= self.DATA_TABLE_MIN_BINS else 'html'
+        if table_mode == 'data':
+            self.build_summary_data_table(html, html_dir, bin_stats, removed_bins=removed_bins,
+                                          plotted_bins=plotted_bins, failed_bins=failed_bins)
+            return
+
+        fields = self.SUMMARY_FIELDS
 
         html.write('<div id="Summary" class="tabcontent">\n')
         html.write('<table>\n')
@@ -210,35 +504,38 @@ class OutputBuilder(object):
         html.write('    <th><b>Bin Name</b></th>\n')
         for f in fields:
             html.write('    <th>' + f['display'] + '</th>\n')
+        with_thumbs = self._has_thumbnails(html_dir)
+        plot_column = with_thumbs or plotted_bins is not None
+        if plot_column:
+            html.write('    <th>Dist Plot</th>\n')
         html.write('  </tr>\n')
 
-
-        # DEBUG
-        #for bid in sorted(bin_stats.keys()):
-        #    print ("BIN STATS BID: "+bid)
-        #for bid in removed_bins:
-        #    print ("REMOVED BID: "+bid)
-
         for bid in sorted(bin_stats.keys()):
             row_opening = '<tr>'
-            if removed_bins:
-                bin_id = re.sub('^[^\.]+\.', '', bid)
-                if bin_id in removed_bins:
-                    row_bgcolor = '#F9E3E2'
-                    row_opening = '<tr style="background-color:'+row_bgcolor+'">'
+            if bid in failed_bins:
+                row_opening = '<tr style="background-color:#F4CCCC; color:#990000">'
+            elif self._bin_is_removed(bid, removed_bins):
+                row_bgcolor = '#F9E3E2'
+                row_opening = '<tr style="background-color:'+row_bgcolor+'">'
             html.write('  '+row_opening+'\n')
-            dist_plot_file = os.path.join(html_dir, str(bid) + self.DIST_PLOT_EXT)
-            if os.path.isfile(dist_plot_file):
-                self._write_dist_html_page(html_dir, bid)
-                html.write('    <td><a href="' + bid + '.html">' + bid + '</td>\n')
+            if self._has_dist_plot(html_dir, bid):
+                html.write('    <td><a href="' + self._dist_plot_link(bid) + '">' + escape(bid) +
+                           '</a></td>\n')
             else:
-                html.write('    <td>' + bid + '</td>\n')
+                html.write('    <td>' + escape(bid) + '</td>\n')
             for f in fields:
-                if f['id'] in bin_stats[bid]:
-                    value = str(bin_stats[bid][f['id']])
-                    if f.get('round'):
-                        value = str(round(bin_stats[bid][f['id']], f['round']))
-                    html.write('    <td>' + value + '</td>\n')
+                value = self._summary_value(bin_stats[bid], f)
+                if value is not None:
+                    html.write('    <td>' + str(value) + '</td>\n')
+                else:
+                    html.write('    <td></td>\n')
+            if plot_column:
+                if with_thumbs and os.path.isfile(os.path.join(html_dir, str(bid) + self.THUMB_EXT)):
+                    html.write('    <td><a href="' + self._dist_plot_link(bid) + '">' +
+                               '<img src="' + quote(bid) + self.THUMB_EXT + '" height="40" ' +
+                               'loading="lazy" /></a></td>\n')
+                elif self._bin_not_plotted(bid, plotted_bins):
+                    html.write('    <td><i>not plotted</i></td>\n')
                 else:
                     html.write('    <td></td>\n')
             html.write('  </tr>\n')
@@ -246,41 +543,211 @@ class OutputBuilder(object):
         html.write('</table>\n')
         html.write('</div>\n')
 
+    def build_summary_data_table(self, html, html_dir, bin_stats, removed_bins=None,
+                                 plotted_bins=None, failed_bins=None):
+        '''
+        Write the bin stats to a compact data file in html_dir and a fixed-size table to html
+        that loads the data file and renders it client side, with virtual scrolling, sorting and
+        filtering.  The HTML does not grow with the number of bins.
+
+        The data file is a script that assigns the JSON data to window.CHECKM_SUMMARY, so that
+        it can be loaded with a script tag whether or not the report is served over HTTP:
+            {"columns": ["Bin Name", "Marker Lineage", ...],
+             "rows": [[bin_name, value, ..., flags], ...]}
+        flags is a bit field: 1 = bin was removed by the QC filters, 2 = bin has a dist plot,
+        4 = bin has a dist plot thumbnail, 8 = bin was skipped by the plot policy,
+        16 = lineage_wf failed on the bin
+        '''
+        columns = ['Bin Name'] + [f['display'] for f in self.SUMMARY_FIELDS]
+        rows = []
+        for bid in sorted(bin_stats.keys()):
+            flags = 0
+            if self._bin_is_removed(bid, removed_bins):
+                flags |= 1
+            if self._has_dist_plot(html_dir, bid):
+                flags |= 2
+            if os.path.isfile(os.path.join(html_dir, str(bid) + self.THUMB_EXT)):
+                flags |= 4
+            if self._bin_not_plotted(bid, plotted_bins):
+                flags |= 8
+            if failed_bins and bid in failed_bins:
+                flags |= 16
+            row = [bid]
+            for f in self.SUMMARY_FIELDS:
+                row.append(self._summary_value(bin_stats[bid], f))
+            row.append(flags)
+            rows.append(row)
+
+        with open(os.path.join(html_dir, self.SUMMARY_DATA_FILE), 'w') as data_handle:
+            data_handle.write('window.CHECKM_SUMMARY = ')
+            with_thumbs = self._has_thumbnails(html_dir)
+            json.dump({'columns': columns, 'rows': rows,
+                       'thumbnails': with_thumbs,
+                       'plot_column': with_thumbs or plotted_bins is not None},
+                      data_handle, separators=(',', ':'))
+            data_handle.write(';\n')
+
+        html.write('''
+<style>
+  #checkm-viewport { height: 70vh; overflow-y: auto; border: 1px solid #bbb; }
+  #checkm-viewport table { border: none; width: 100%; }
+  #checkm-viewport th { position: sticky; top: 0; background-color: #eee; cursor: pointer;
+                        white-space: nowrap; }
+  #checkm-viewport td { white-space: nowrap; }
+  #checkm-viewport td.thumb { height: 40px; padding-top: 0; padding-bottom: 0; }
+  #checkm-viewport tr.removed { background-color: #F9E3E2; }
+  #checkm-viewport tr.failed { background-color: #F4CCCC; color: #990000; }
+  #checkm-controls { margin-bottom: 8px; }
+  #checkm-controls input { margin-right: 12px; }
+</style>
+<div id="Summary" class="tabcontent">
+  <div id="checkm-controls">
+    Filter: <input id="checkm-filter" type="search" placeholder="bin name or lineage">
+    Min. completeness: <input id="checkm-min-comp" type="number" min="0" max="100" step="any">
+    Max. contamination: <input id="checkm-max-cont" type="number" min="0" step="any">
+    <span id="checkm-count"></span>
+  </div>
+  <div id="checkm-viewport">
+    <table>
+      <thead><tr id="checkm-header"></tr></thead>
+      <tbody id="checkm-body"></tbody>
+    </table>
+  </div>
+</div>
+''')
+        html.write('<script src="' + self.SUMMARY_DATA_FILE + '"></script>\n')
+        self._write_data_table_script(html)
+
+    def _write_data_table_script(self, html):
+        script = '''
+<script>
+(function () {
+  "use strict";
+  var data = window.CHECKM_SUMMARY;
+  var cols = data.columns, nCols = cols.length;
+  var compIdx = cols.indexOf('Completeness'), contIdx = cols.indexOf('Contamination'),
+      lineageIdx = cols.indexOf('Marker Lineage');
+  var viewport = document.getElementById('checkm-viewport'),
+      body = document.getElementById('checkm-body'),
+      header = document.getElementById('checkm-header');
+  var rowHeight = data.thumbnails ? 42 : 33, buffer = 20, view = data.rows, sortCol = 0,
+      sortDir = 1, pending = false;
+
+  function esc(s) {
+    return String(s).replace(/[&<>"]/g, function (c) {
+      return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}[c];
+    });
+  }
+
+  function compare(a, b) {
+    var x = a[sortCol], y = b[sortCol];
+    if (x === y) { return 0; }
+    if (x === null) { return 1; }
+    if (y === null) { return -1; }
+    return (x < y ? -1 : 1) * sortDir;
+  }
+
+  function rowHtml(row) {
+    var cells = [], name = esc(row[0]);
+    cells.push(row[nCols] & 2 ? '<a href="VIEWER#' + esc(encodeURIComponent(row[0])) + '">' +
+                                name + '</a>' : name);
+    for (var i = 1; i < nCols; i++) {
+      cells.push(row[i] === null ? '' : esc(row[i]));
+    }
+    if (data.plot_column) {
+      cells.push(row[nCols] & 4 ? '<a href="VIEWER#' + esc(encodeURIComponent(row[0])) + '">' +
+                                  '<img src="' + esc(encodeURIComponent(row[0])) + 'THUMB_EXT" ' +
+                                  'height="40" /></a>' :
+                 row[nCols] & 8 ? '<i>not plotted</i>' : '');
+    }
+    var rowClass = row[nCols] & 16 ? ' class="failed"' : (row[nCols] & 1 ? ' class="removed"' : '');
+    return '<tr' + rowClass + '><td>' +
+           cells.slice(0, nCols).join('</td><td>') + '</td>' +
+           (data.plot_column ? '<td class="thumb">' + cells[nCols] + '</td>' : '') + '</tr>';
+  }
+
+  function render() {
+    pending = false;
+    var first = Math.max(0, Math.floor(viewport.scrollTop / rowHeight) - buffer);
+    var last = Math.min(view.length,
+                        first + Math.ceil(viewport.clientHeight / rowHeight) + 2 * buffer);
+    var out = ['<tr style="height:' + (first * rowHeight) + 'px"></tr>'];
+    for (var i = first; i < last; i++) {
+      out.push(rowHtml(view[i]));
+    }
+    out.push('<tr style="height:' + ((view.length - last) * rowHeight) + 'px"></tr>');
+    body.innerHTML = out.join('');
+  }
+
+  function schedule() {
+    if (!pending) {
+      pending = true;
+      window.requestAnimationFrame(render);
+    }
+  }
+
+  function update() {
+    var text = document.getElementById('checkm-filter').value.toLowerCase(),
+        minComp = parseFloat(document.getElementById('checkm-min-comp').value),
+        maxCont = parseFloat(document.getElementById('checkm-max-cont').value);
+    view = data.rows.filter(function (row) {
+      if (text && String(row[0]).toLowerCase().indexOf(text) < 0 &&
+          String(row[lineageIdx]).toLowerCase().indexOf(text) < 0) { return false; }
+      if (!isNaN(minComp) && !(row[compIdx] >= minComp)) { return false; }
+      if (!isNaN(maxCont) && !(row[contIdx] <= maxCont)) { return false; }
+      return true;
+    });
+    view.sort(compare);
+    document.getElementById('checkm-count').textContent =
+      view.length + ' of ' + data.rows.length + ' bins';
+    viewport.scrollTop = 0;
+    render();
+  }
+
+  cols.forEach(function (col, i) {
+    var th = document.createElement('th');
+    th.textContent = col;
+    th.addEventListener('click', function () {
+      sortDir = (sortCol === i) ? -sortDir : 1;
+      sortCol = i;
+      update();
+    });
+    header.appendChild(th);
+  });
+  if (data.plot_column) {
+    var plotTh = document.createElement('th');
+    plotTh.textContent = 'Dist Plot';
+    header.appendChild(plotTh);
+  }
+  ['checkm-filter', 'checkm-min-comp', 'checkm-max-cont'].forEach(function (id) {
+    document.getElementById(id).addEventListener('input', update);
+  });
+  viewport.addEventListener('scroll', schedule);
+  window.addEventListener('resize', schedule);
+
+  update();
+  // measure the real row height once some rows have been rendered
+  if (body.rows.length > 1 && body.rows[1].offsetHeight) {
+    rowHeight = body.rows[1].offsetHeight;
+    render();
+  }
+})();
+</script>
+'''
+        html.write(script.replace('VIEWER', self.DIST_PLOT_VIEWER)
+                         .replace('THUMB_EXT', self.THUMB_EXT))
+
 
     def build_summary_tsv_file(self, tab_text_dir, tab_text_file):
 
         if not os.path.exists(tab_text_dir):
             os.makedirs(tab_text_dir)
 
-        stats_file = os.path.join(self.output_dir, 'storage', 'bin_stats_ext.tsv')
-        if not os.path.isfile(stats_file):
-            log('Warning! no stats file found (looking at: ' + stats_file + ')')
+        bin_stats, failed_bins = self.read_summary_bin_stats()
+        if bin_stats is None:
             return
 
-        bin_stats = dict()
-        with open(stats_file) as lf:
-            for line in lf:
-                if not line:
-                    continue
-                if line.startswith('#'):
-                    continue
-                col = line.split('\t')
-                bin_id = str(col[0])
-                data = ast.literal_eval(col[1])
-                bin_stats[bin_id] = data
-
-        fields = [{'id': 'marker lineage', 'display': 'Marker Lineage'},
-                  {'id': '# genomes', 'display': '# Genomes'},
-                  {'id': '# markers', 'display': '# Markers'},
-                  {'id': '# marker sets', 'display': '# Marker Sets'},
-                  {'id': '0', 'display': '0'},
-                  {'id': '1', 'display': '1'},
-                  {'id': '2', 'display': '2'},
-                  {'id': '3', 'display': '3'},
-                  {'id': '4', 'display': '4'},
-                  {'id': '5+', 'display': '5+'},
-                  {'id': 'Completeness', 'display': 'Completeness', 'round': 2},
-                  {'id': 'Contamination', 'display': 'Contamination', 'round': 2}]
+        fields = self.SUMMARY_FIELDS
 
         tab_text_files = []
         tab_text_path = os.path.join (tab_text_dir, tab_text_file)
@@ -292,18 +759,12 @@ class OutputBuilder(object):
                 out_header.append(f['display'])
             out_handle.write("\t".join(out_header)+"\n")
 
-            # DEBUG
-            #for bid in sorted(bin_stats.keys()):
-            #    print ("BIN STATS BID: "+bid)
-
             for bid in sorted(bin_stats.keys()):
                 row = []
                 row.append(bid)
                 for f in fields:
-                    if f['id'] in bin_stats[bid]:
-                        value = str(bin_stats[bid][f['id']])
-                        if f.get('round'):
-                            value = str(round(bin_stats[bid][f['id']], f['round']))
+                    value = self._summary_value(bin_stats[bid], f)
+                    if value is not None:
                         row.append(str(value))
                 out_handle.write("\t".join(row)+"\n")
 
@@ -412,33 +873,317 @@ class OutputBuilder(object):
             # TODO: add error message reporting
             log('copy failed')
 
-    def _write_dist_html_page(self, html_dir, bin_id):
+    def _dist_plot_link(self, bin_id):
+        # the viewer reads the bin ID with decodeURIComponent, which undoes quote()
+        return self.DIST_PLOT_VIEWER + '#' + quote(bin_id)
 
-        # write the html report to file
-        html = open(os.path.join(html_dir, bin_id + '.html'), 'w')
+    def _write_dist_plot_viewer(self, html_dir):
+        '''
+        Write the single dist plot viewer page.  The bin to show is taken from the URL fragment
+        (CheckM_Bin_Plot.html#<bin_id>) and only that bin's plot image is loaded.
+        '''
+        html = open(os.path.join(html_dir, self.DIST_PLOT_VIEWER), 'w')
 
         html.write('<html>\n')
         html.write('<head>\n')
-        html.write('<title>CheckM Dist Plots for Bin' + bin_id + '</title>')
+        html.write('<title>CheckM Dist Plots</title>')
         html.write('<style style="text/css">\n a { color: #337ab7; } \n a:hover { color: #23527c; }\n</style>\n')
+        html.write('</head>\n')
         html.write('<body>\n')
         html.write('<br><a href="CheckM_Table.html">Back to summary</a><br>\n')
-        html.write('<center><h2>Bin: ' + bin_id + '</h2></center>\n')
-        html.write('<img src="' + bin_id + self.DIST_PLOT_EXT + '" width="90%" />\n')
+        html.write('<center><h2>Bin: <span id="bin-id"></span></h2></center>\n')
+        html.write('<img id="dist-plot" width="90%" />\n')
+        html.write('<p id="no-plot" style="display:none">No dist plot was found for this bin.</p>\n')
         html.write('<br><br><br>\n')
+        html.write('''<script>
+(function () {
+  "use strict";
+  var img = document.getElementById('dist-plot');
+  img.onerror = function () {
+    // the full size image may have been dropped to fit the report size budget
+    var thumb = encodeURIComponent(img.dataset.binId) + 'THUMB_EXT';
+    if (img.src.indexOf(thumb) < 0) {
+      img.src = thumb;
+      return;
+    }
+    img.style.display = 'none';
+    document.getElementById('no-plot').style.display = 'block';
+  };
+  function show() {
+    var binId = decodeURIComponent(window.location.hash.substring(1));
+    document.getElementById('bin-id').textContent = binId;
+    document.title = 'CheckM Dist Plots for Bin ' + binId;
+    document.getElementById('no-plot').style.display = 'none';
+    img.style.display = binId ? 'inline' : 'none';
+    if (binId) {
+      img.dataset.binId = binId;
+      img.alt = 'CheckM dist plot for bin ' + binId;
+      img.src = encodeURIComponent(binId) + 'DIST_PLOT_EXT';
+    }
+  }
+  window.addEventListener('hashchange', show);
+  show();
+})();
+</script>
+'''.replace('DIST_PLOT_EXT', self.DIST_PLOT_EXT).replace('THUMB_EXT', self.THUMB_EXT))
         html.write('</body>\n</html>\n')
         html.close()
 
+    def _write_interactive_dist_plot_viewer(self, html_dir):
+        '''
+        Write the dist plot viewer page for the 'interactive' dist plot mode.  As with the
+        image viewer, the bin is taken from the URL fragment; its <bin_id>.dist_data.js file
+        is loaded and the GC, coding density and tetranucleotide distance plots are drawn on
+        canvases, with the reference distribution bounds where available.
+        '''
+        html = open(os.path.join(html_dir, self.DIST_PLOT_VIEWER), 'w')
+
+        html.write('<html>\n')
+        html.write('<head>\n')
+        html.write('<title>CheckM Dist Plots</title>')
+        html.write('<style style="text/css">\n a { color: #337ab7; } \n a:hover { color: #23527c; }\n' +
+                   ' canvas { border: 1px solid #bbb; margin: 4px; }\n' +
+                   ' #tooltip { position: absolute; display: none; background: #fff; ' +
+                   'border: 1px solid #bbb; padding: 4px; font-size: 12px; }\n</style>\n')
+        html.write('</head>\n')
+        html.write('<body>\n')
+        html.write('<br><a href="CheckM_Table.html">Back to summary</a><br>\n')
+        html.write('<center><h2>Bin: <span id="bin-id"></span></h2>\n')
+        html.write('<p id="bin-summary"></p>\n')
+        html.write('<canvas id="panel-0" width="420" height="360"></canvas>')
+        html.write('<canvas id="panel-1" width="420" height="360"></canvas>')
+        html.write('<canvas id="panel-2" width="420" height="360"></canvas>\n')
+        html.write('<p id="no-plot" style="display:none">No dist plot data was found for this bin.</p>\n')
+        html.write('</center>\n')
+        html.write('<div id="tooltip"></div>\n')
+        html.write('''<script>
+(function () {
+  "use strict";
+  var panels = [
+    {key: 'delta_gc', ref: 'gc', label: 'Deviation from mean GC (%)'},
+    {key: 'delta_cd', ref: 'cd', label: 'Deviation from mean coding density (%)'},
+    {key: 'td', ref: 'td', label: 'Tetranucleotide distance'}
+  ];
+  var margin = {left: 60, right: 12, top: 12, bottom: 44};
+  var tooltip = document.getElementById('tooltip');
+
+  function extent(values) {
+    var lo = Infinity, hi = -Infinity;
+    values.forEach(function (v) {
+      if (v !== null && isFinite(v)) { lo = Math.min(lo, v); hi = Math.max(hi, v); }
+    });
+    return lo <= hi ? [lo, hi] : [0, 1];
+  }
+
+  function drawPanel(canvas, panel, data) {
+    var ctx = canvas.getContext('2d'), w = canvas.width, h = canvas.height;
+    var xs = data[panel.key], ref = data.reference[panel.ref] || [], points = [];
+    for (var i = 0; i < xs.length; i++) {
+      if (xs[i] !== null && data.length[i] > 0) {
+        points.push({x: xs[i], y: data.length[i], i: i});
+      }
+    }
+    var refX = [];
+    ref.forEach(function (r) { refX.push(r[1], r[2]); });
+    var xr = extent(points.map(function (p) { return p.x; }).concat(refX, [0]));
+    var pad = (xr[1] - xr[0]) * 0.05 || 1;
+    xr = [xr[0] - pad, xr[1] + pad];
+    var yr = extent(points.map(function (p) { return Math.log10(p.y); })
+                    .concat(ref.map(function (r) { return Math.log10(r[0]); })));
+    yr = [Math.floor(yr[0]), Math.ceil(yr[1]) === Math.floor(yr[0]) ? Math.floor(yr[0]) + 1
+                                                                   : Math.ceil(yr[1])];
+    function px(x) { return margin.left + (x - xr[0]) / (xr[1] - xr[0]) * (w - margin.left - margin.right); }
+    function py(y) { return h - margin.bottom - (Math.log10(y) - yr[0]) / (yr[1] - yr[0]) * (h - margin.top - margin.bottom); }
+
+    ctx.clearRect(0, 0, w, h);
+    ctx.strokeStyle = '#333';
+    ctx.fillStyle = '#333';
+    ctx.font = '11px sans-serif';
+    ctx.strokeRect(margin.left, margin.top, w - margin.left - margin.right, h - margin.top - margin.bottom);
+    ctx.textAlign = 'center';
+    for (var t = 0; t <= 4; t++) {
+      var xv = xr[0] + (xr[1] - xr[0]) * t / 4;
+      ctx.fillText(xv.toPrecision(3), px(xv), h - margin.bottom + 14);
+    }
+    ctx.fillText(panel.label, (margin.left + w - margin.right) / 2, h - 8);
+    ctx.textAlign = 'right';
+    for (var e = yr[0]; e <= yr[1]; e++) {
+      ctx.fillText('1e' + e, margin.left - 4, py(Math.pow(10, e)) + 4);
+    }
+    ctx.save();
+    ctx.translate(14, (margin.top + h - margin.bottom) / 2);
+    ctx.rotate(-Math.PI / 2);
+    ctx.textAlign = 'center';
+    ctx.fillText('Sequence length (bp)', 0, 0);
+    ctx.restore();
+
+    // reference distribution bounds
+    ctx.strokeStyle = '#d62728';
+    [1, 2].forEach(function (b) {
+      ctx.beginPath();
+      var started = false;
+      ref.forEach(function (r) {
+        if (r[b] === null) { return; }
+        if (started) { ctx.lineTo(px(r[b]), py(r[0])); } else { ctx.moveTo(px(r[b]), py(r[0])); started = true; }
+      });
+      ctx.stroke();
+    });
+
+    ctx.fillStyle = 'rgba(31, 119, 180, 0.6)';
+    points.forEach(function (p) {
+      p.px = px(p.x);
+      p.py = py(p.y);
+      ctx.fillRect(p.px - 2, p.py - 2, 4, 4);
+    });
+
+    canvas.onmousemove = function (ev) {
+      var rect = canvas.getBoundingClientRect(), mx = ev.clientX - rect.left, my = ev.clientY - rect.top;
+      var best = null, bestD = 36;
+      points.forEach(function (p) {
+        var d = (p.px - mx) * (p.px - mx) + (p.py - my) * (p.py - my);
+        if (d < bestD) { best = p; bestD = d; }
+      });
+      if (!best) { tooltip.style.display = 'none'; return; }
+      tooltip.textContent = data.contigs[best.i] + ': ' + data.length[best.i] + ' bp, ' + best.x;
+      tooltip.style.left = (ev.pageX + 10) + 'px';
+      tooltip.style.top = (ev.pageY + 10) + 'px';
+      tooltip.style.display = 'block';
+    };
+    canvas.onmouseleave = function () { tooltip.style.display = 'none'; };
+  }
+
+  function draw(data) {
+    document.getElementById('bin-summary').textContent =
+      data.contigs.length + ' sequences; mean GC ' + data.mean_gc + '%' +
+      (data.mean_cd === null ? '' : '; mean coding density ' + data.mean_cd + '%') +
+      '; reference bounds for ' + data.dist_value + '% of reference genomes';
+    panels.forEach(function (panel, i) {
+      drawPanel(document.getElementById('panel-' + i), panel, data);
+    });
+  }
+
+  function show() {
+    var binId = decodeURIComponent(window.location.hash.substring(1));
+    document.getElementById('bin-id').textContent = binId;
+    document.title = 'CheckM Dist Plots for Bin ' + binId;
+    document.getElementById('no-plot').style.display = 'none';
+    var old = document.getElementById('dist-data');
+    if (old) { old.parentNode.removeChild(old); }
+    if (!binId) { return; }
+    window.CHECKM_DIST_DATA = null;
+    var script = document.createElement('script');
+    script.id = 'dist-data';
+    script.src = encodeURIComponent(binId) + 'DIST_DATA_EXT';
+    script.onload = function () { draw(window.CHECKM_DIST_DATA); };
+    script.onerror = function () { document.getElementById('no-plot').style.display = 'block'; };
+    document.body.appendChild(script);
+  }
+  window.addEventListener('hashchange', show);
+  show();
+})();
+</script>
+'''.replace('DIST_DATA_EXT', self.DIST_DATA_EXT))
+        html.write('</body>\n</html>\n')
+        html.close()
+
+    def _has_dist_plot(self, html_dir, bin_id):
+        return any(os.path.isfile(os.path.join(html_dir, str(bin_id) + ext))
+                   for ext in [self.DIST_PLOT_EXT, self.THUMB_EXT, self.DIST_DATA_EXT])
+
+    def _has_thumbnails(self, html_dir):
+        return any(f.endswith(self.THUMB_EXT) for f in os.listdir(html_dir))
+
+    def optimize_plot_images(self, html_dir):
+        '''
+        Write a thumbnail of each dist plot in html_dir and recompress the full size images,
+        using a pool of image_workers processes.  If image_byte_budget is set and the images
+        are larger than that in total, the thumbnails are made smaller if they take more than
+        THUMB_BUDGET_SHARE of the budget, then the full size images are scaled down to fit
+        and, as a last resort, dropped (the thumbnails are kept).  Needs Pillow; if it is not
+        installed the images are left as they are.
+        Returns a dict with the image count, the total image and thumbnail bytes, and whether
+        they are within the budget.
+        '''
+        if Image is None:
+            log('Pillow is not available; not optimizing plot images')
+            return None
+
+        plot_files = sorted(f for f in os.listdir(html_dir) if f.endswith(self.DIST_PLOT_EXT))
+        plot_paths = [os.path.join(html_dir, f) for f in plot_files]
+        thumb_paths = [p[:-len(self.DIST_PLOT_EXT)] + self.THUMB_EXT for p in plot_paths]
+        if not plot_paths:
+            return None
+
+        log('optimizing ' + str(len(plot_paths)) + ' plot images')
+        budget = self.image_byte_budget
+        with ProcessPoolExecutor(max_workers=self.image_workers) as pool:
+            sizes = list(pool.map(_optimize_plot_image, plot_paths, thumb_paths,
+                                  repeat(self.THUMB_SIZE)))
+            image_bytes = sum(s[0] for s in sizes)
+            thumb_bytes = sum(s[1] for s in sizes)
+
+            thumb_budget = self.THUMB_BUDGET_SHARE * budget if budget else None
+            if budget and image_bytes + thumb_bytes > budget and thumb_bytes > thumb_budget:
+                # thumbnail size scales roughly with pixel count too
+                thumb_scale = 0.95 * math.sqrt(thumb_budget / thumb_bytes)
+                thumb_size = (max(self.THUMB_MIN_SIZE[0], int(self.THUMB_SIZE[0] * thumb_scale)),
+                              max(self.THUMB_MIN_SIZE[1], int(self.THUMB_SIZE[1] * thumb_scale)))
+                log('plot thumbnails are ' + str(thumb_bytes) + ' bytes, over ' +
+                    str(int(thumb_budget)) + ' of the budget; making them at most ' +
+                    str(thumb_size[0]) + 'x' + str(thumb_size[1]))
+                thumb_bytes = sum(pool.map(_rewrite_thumbnail, plot_paths, thumb_paths,
+                                           repeat(thumb_size)))
+
+            if budget and image_bytes + thumb_bytes > budget and budget > thumb_bytes:
+                # PNG size scales roughly with pixel count
+                scale = 0.95 * math.sqrt(float(budget - thumb_bytes) / image_bytes)
+                log('plot images are ' + str(image_bytes + thumb_bytes) + ' bytes, over the ' +
+                    'budget of ' + str(budget) + '; scaling them by ' + '{0:.2f}'.format(scale))
+                sizes = list(pool.map(_optimize_plot_image, plot_paths, repeat(None),
+                                      repeat(self.THUMB_SIZE), repeat(scale)))
+                image_bytes = sum(s[0] for s in sizes)
+
+        if budget and image_bytes + thumb_bytes > budget:
+            for plot_path, (plot_bytes, _) in reversed(list(zip(plot_paths, sizes))):
+                if image_bytes + thumb_bytes <= budget:
+                    break
+                os.remove(plot_path)
+                image_bytes -= plot_bytes
+            log('Warning: some full size plot images were dropped to fit the image budget of ' +
+                str(budget) + ' bytes; only their thumbnails are in the report')
+
+        within_budget = not budget or image_bytes + thumb_bytes <= budget
+        if not within_budget:
+            log('Warning: the plot thumbnails alone are ' + str(thumb_bytes) + ' bytes, so ' +
+                'the image budget of ' + str(budget) + ' bytes can not be met')
+        log('plot images: ' + str(image_bytes) + ' bytes, thumbnails: ' +
+            str(thumb_bytes) + ' bytes')
+        return {'n_images': len(plot_paths),
+                'image_bytes': image_bytes,
+                'thumbnail_bytes': thumb_bytes,
+                'within_budget': within_budget}
+
     def _copy_ref_dist_plots(self, plots_dir, dest_folder):
+        '''
+        Put the dist plot images (or dist plot data files) into the html folder.  Files are
+        hard linked where possible rather than copied.  Returns the number of plots added.
+        '''
+        n_plots = 0
         for plotfile in os.listdir(plots_dir):
             plot_file_path = os.path.join(plots_dir, plotfile)
-            if os.path.isfile(plot_file_path) and plotfile.endswith(self.DIST_PLOT_EXT):
+            if os.path.isfile(plot_file_path) and (plotfile.endswith(self.DIST_PLOT_EXT) or
+                                                   plotfile.endswith(self.DIST_DATA_EXT)):
+                dest_path = os.path.join(dest_folder, plotfile)
                 try:
-                    shutil.copy(os.path.join(plots_dir, plotfile),
-                                os.path.join(dest_folder, plotfile))
+                    try:
+                        os.link(plot_file_path, dest_path)
+                    except OSError:
+                        shutil.copy(plot_file_path, dest_path)
+                    n_plots += 1
                 except:
                     # TODO: add error message reporting
                     log('copy of ' + plot_file_path + ' to html directory failed')
+        return n_plots
 
 
     def save_binned_contigs(self, params, assembly_ref, filtered_bins_dir):
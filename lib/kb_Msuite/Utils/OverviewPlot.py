@@ -0,0 +1,130 @@
+import sys
+import time
+
+try:
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import numpy as np
+except ImportError:
+    Figure = None
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+    sys.stdout.flush()
+
+
+class OverviewPlot(object):
+    '''
+    Draws the bin QA overview plot from the parsed CheckM bin stats (see
+    OutputBuilder.read_bin_stats).  Unlike `checkm bin_qa_plot`, which draws a row per bin,
+    everything here is aggregated, so the image size and drawing time are the same for 10
+    bins or 50,000:
+        - completeness vs contamination, as a scatter plot for small bin counts and as a
+          density (hexbin) plot above MAX_SCATTER_BINS
+        - histograms of completeness and contamination
+        - bin counts per quality tier
+    The figure is drawn with its own Agg canvas rather than through pyplot, as it is made on
+    a pipeline thread alongside other stages that draw.
+    '''
+
+    MAX_SCATTER_BINS = 1000
+    FIG_SIZE = (12, 8)
+    DPI = 100
+
+    COMPLETENESS_EDGES = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
+    CONTAMINATION_EDGES = [0, 1, 2, 5, 10, 20, 50, 100, float('inf')]
+
+    # (name, min completeness, max contamination); a bin is in the first tier with at least
+    # its min completeness and less than its max contamination
+    QUALITY_TIERS = [('High', 90.0, 5.0),
+                     ('Medium', 50.0, 10.0),
+                     ('Low', 0.0, float('inf'))]
+
+    @staticmethod
+    def tier_label(name, min_comp, max_cont):
+        ''' e.g. "High (>=90% / <5%)", with the comparisons that assign bins to the tier '''
+        if not min_comp and max_cont == float('inf'):
+            return name
+        return '{0} (>={1:g}% / <{2:g}%)'.format(name, min_comp, max_cont)
+
+    def plot(self, bin_stats, plot_path):
+        '''
+        Write the overview plot for bin_stats to plot_path.
+        Returns True if a plot was written, False if there was nothing to plot or matplotlib
+        is not available.
+        '''
+        if Figure is None:
+            log('Warning: matplotlib is not available; not creating the bin QA overview plot')
+            return False
+
+        completeness = []
+        contamination = []
+        for data in bin_stats.values():
+            if 'Completeness' in data and 'Contamination' in data:
+                completeness.append(float(data['Completeness']))
+                contamination.append(float(data['Contamination']))
+        if not completeness:
+            log('Warning: no bin stats to plot in the bin QA overview plot')
+            return False
+        completeness = np.array(completeness)
+        contamination = np.array(contamination)
+
+        fig = Figure(figsize=self.FIG_SIZE)
+        FigureCanvasAgg(fig)
+        axes = fig.subplots(2, 2)
+        fig.suptitle('CheckM bin quality overview (' + str(len(completeness)) + ' bins)')
+        self._plot_comp_vs_cont(axes[0][0], fig, completeness, contamination)
+        self._plot_tiers(axes[0][1], completeness, contamination)
+
+        comp_counts, _ = np.histogram(completeness, bins=self.COMPLETENESS_EDGES)
+        self._plot_counts(axes[1][0], comp_counts,
+                          ['{0:g}-{1:g}'.format(lo, hi) for lo, hi in
+                           zip(self.COMPLETENESS_EDGES[:-1], self.COMPLETENESS_EDGES[1:])],
+                          'Completeness (%)')
+
+        cont_counts, _ = np.histogram(contamination, bins=self.CONTAMINATION_EDGES)
+        cont_labels = ['{0:g}-{1:g}'.format(lo, hi) for lo, hi in
+                       zip(self.CONTAMINATION_EDGES[:-2], self.CONTAMINATION_EDGES[1:-1])]
+        cont_labels.append('>{0:g}'.format(self.CONTAMINATION_EDGES[-2]))
+        self._plot_counts(axes[1][1], cont_counts, cont_labels, 'Contamination (%)')
+
+        fig.tight_layout(rect=[0, 0, 1, 0.96])
+        fig.savefig(plot_path, dpi=self.DPI)
+        return True
+
+    def _plot_comp_vs_cont(self, ax, fig, completeness, contamination):
+        if len(completeness) <= self.MAX_SCATTER_BINS:
+            ax.scatter(completeness, contamination, s=12, alpha=0.6, edgecolors='none')
+        else:
+            hb = ax.hexbin(completeness, np.minimum(contamination, 100.0), gridsize=50,
+                           bins='log', mincnt=1, cmap='viridis')
+            fig.colorbar(hb, ax=ax, label='bins')
+        ax.set_xlabel('Completeness (%)')
+        ax.set_ylabel('Contamination (%)')
+        ax.set_xlim(0, 100)
+        ax.set_ylim(bottom=0)
+        ax.set_title('Completeness vs contamination')
+
+    def _plot_tiers(self, ax, completeness, contamination):
+        assigned = np.zeros(len(completeness), dtype=bool)
+        counts = []
+        for (name, min_comp, max_cont) in self.QUALITY_TIERS:
+            in_tier = ~assigned & (completeness >= min_comp) & (contamination < max_cont)
+            counts.append(int(in_tier.sum()))
+            assigned |= in_tier
+        self._plot_counts(ax, counts, [self.tier_label(*t) for t in self.QUALITY_TIERS],
+                          'Quality tier')
+        ax.set_title('Bins per quality tier (completeness / contamination)')
+
+    def _plot_counts(self, ax, counts, labels, xlabel):
+        positions = range(len(counts))
+        bars = ax.bar(positions, counts)
+        for bar, count in zip(bars, counts):
+            ax.annotate(str(int(count)), (bar.get_x() + bar.get_width() / 2, bar.get_height()),
+                        ha='center', va='bottom', fontsize=8)
+        ax.set_xticks(list(positions))
+        ax.set_xticklabels(labels, rotation=30, ha='right', fontsize=8)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel('Bins')
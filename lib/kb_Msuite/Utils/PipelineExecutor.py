@@ -0,0 +1,273 @@
+import os
+import sys
+import time
+import json
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+    sys.stdout.flush()
+
+
+class PipelineExecutor(object):
+    '''
+    Runs a set of stages, each declaring the stages it depends on and the number of CPUs it
+    uses, as a dependency graph.  A stage is started as soon as all of its dependencies are
+    done and the CPUs it needs fit in the cpu_budget alongside the stages already running, so
+    independent stages (e.g. `checkm tetra` and `checkm lineage_wf`) overlap.  Stages run on
+    threads; they are expected to spend their time in subprocesses or I/O.
+
+    Stage functions are called with the dict of results of the stages run so far, keyed by
+    stage name, and their return value is added to it.  If a stage fails, no new stages are
+    started, the running ones are waited for and the first error is raised.
+
+    With a run_dir, checkpoint stages write a manifest there when they complete, with a hash
+    of their inputs (the stage key and the hashes of its dependencies), their output paths and
+    their (JSON) result.  A later run in the same run_dir skips a checkpoint stage if its
+    manifest matches and its outputs still exist, and only runs an incomplete stage if a
+    stage that has to run depends on it.  An output that is missing because the
+    scratch_manager removed it as an intermediate does not invalidate the checkpoint, unless a
+    stage that reads it has to run.
+
+    With a telemetry (RunTelemetry), the resource use of each stage that runs is recorded.
+    With a scratch_manager (ScratchManager), it is told when each stage has completed, or
+    does not have to run, so it can remove the intermediates that are no longer needed.
+    '''
+
+    MANIFEST_EXT = '.manifest.json'
+
+    def __init__(self, cpu_budget, run_dir=None, telemetry=None, scratch_manager=None):
+        self.cpu_budget = max(1, int(cpu_budget))
+        self.run_dir = run_dir
+        self.telemetry = telemetry
+        self.scratch_manager = scratch_manager
+        self.stages = []
+        self._stage_by_name = dict()
+        self.results = dict()
+        self.timing = dict()
+        self.skipped = []
+        # for each valid checkpoint, the stages that read its outputs that were removed
+        self._released = dict()
+        self._t0 = None
+
+    def add_stage(self, name, func, deps=None, cpus=1, key=None, outputs=None,
+                  checkpoint=False):
+        '''
+        Add a stage.  Stages must be added after the stages they depend on; stages that are
+        ready at the same time are started in the order they were added.  A stage that
+        needs more CPUs than the budget runs once it has the whole budget to itself.
+
+        key - JSON-able value describing the stage's parameters, for the input hash
+        outputs - files or folders the stage makes; they are removed before the stage runs
+                  and must exist for a checkpoint to be valid
+        checkpoint - if True (and the executor has a run_dir), the stage can be skipped on a
+                     later run; its result must be JSON serializable
+        '''
+        if name in self._stage_by_name:
+            raise ValueError('Duplicate pipeline stage: ' + str(name))
+        deps = list(deps or [])
+        for dep in deps:
+            if dep not in self._stage_by_name:
+                raise ValueError('Pipeline stage ' + str(name) + ' depends on unknown stage ' +
+                                 str(dep))
+        input_hash = hashlib.sha256(json.dumps(
+            {'stage': name, 'key': key,
+             'deps': [self._stage_by_name[dep]['input_hash'] for dep in deps]},
+            sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        stage = {'name': name, 'func': func, 'deps': deps,
+                 'cpus': min(max(0, int(cpus)), self.cpu_budget),
+                 'outputs': list(outputs or []),
+                 'checkpoint': bool(checkpoint and self.run_dir),
+                 'input_hash': input_hash}
+        self.stages.append(stage)
+        self._stage_by_name[name] = stage
+
+    def _manifest_path(self, stage):
+        return os.path.join(self.run_dir, stage['name'] + self.MANIFEST_EXT)
+
+    def _read_checkpoint(self, stage):
+        ''' the manifest of a completed stage, or None if the stage has to run '''
+        if not stage['checkpoint'] or not os.path.isfile(self._manifest_path(stage)):
+            return None
+        try:
+            with open(self._manifest_path(stage)) as manifest_handle:
+                manifest = json.load(manifest_handle)
+        except (IOError, OSError, ValueError) as e:
+            log('Warning: unable to read manifest of pipeline stage ' + stage['name'] + ': ' +
+                str(e))
+            return None
+        if manifest.get('input_hash') != stage['input_hash']:
+            return None
+        released = set()
+        for path in stage['outputs']:
+            if os.path.exists(path):
+                continue
+            consumers = (self.scratch_manager.consumers(path)
+                         if self.scratch_manager is not None else None)
+            if not consumers:
+                return None
+            released |= consumers
+        self._released[stage['name']] = released
+        return manifest
+
+    def _write_checkpoint(self, stage, result):
+        manifest = {'stage': stage['name'],
+                    'input_hash': stage['input_hash'],
+                    'outputs': stage['outputs'],
+                    'result': result,
+                    'completed': time.time()}
+        tmp_path = self._manifest_path(stage) + '.tmp'
+        with open(tmp_path, 'w') as manifest_handle:
+            json.dump(manifest, manifest_handle, indent=1)
+        os.replace(tmp_path, self._manifest_path(stage))
+
+    def _run_stage(self, stage):
+        if stage['checkpoint'] and os.path.isfile(self._manifest_path(stage)):
+            os.remove(self._manifest_path(stage))
+        for path in stage['outputs']:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path):
+                os.remove(path)
+        if self.telemetry is not None:
+            with self.telemetry.stage(stage['name']):
+                result = stage['func'](self.results)
+        else:
+            result = stage['func'](self.results)
+        if stage['checkpoint']:
+            self._write_checkpoint(stage, result)
+        return result
+
+    def _stages_to_run(self):
+        '''
+        Load the results of the completed checkpoint stages that are needed, and return the
+        stages that have to run: stages that either have no dependents or have a dependent
+        that runs, and are not complete or had outputs removed that a stage that runs reads.
+        '''
+        if self.run_dir and not os.path.exists(self.run_dir):
+            os.makedirs(self.run_dir)
+        checkpoints = dict((stage['name'], self._read_checkpoint(stage)) for stage in self.stages)
+
+        to_run = set()
+        needed = set()
+        for stage in reversed(self.stages):
+            dependents = [s for s in self.stages if stage['name'] in s['deps']]
+            if dependents and not any(s['name'] in to_run for s in dependents):
+                continue
+            needed.add(stage['name'])
+            if (checkpoints[stage['name']] is None or
+               self._released.get(stage['name'], set()) & to_run):
+                to_run.add(stage['name'])
+
+        for stage in self.stages:
+            if stage['name'] in needed and stage['name'] not in to_run:
+                log('Skipping pipeline stage ' + stage['name'] + ', completed in an earlier run')
+                self.results[stage['name']] = checkpoints[stage['name']].get('result')
+                self.skipped.append(stage['name'])
+        return [stage for stage in self.stages if stage['name'] in to_run]
+
+    def run(self):
+        ''' Run the stages; returns the dict of stage results '''
+        self._t0 = time.time()
+        pending = self._stages_to_run()
+        if self.scratch_manager is not None:
+            for stage in self.stages:
+                if stage not in pending:
+                    self.scratch_manager.stage_done(stage['name'])
+        running = dict()
+        cpus_in_use = 0
+        error = None
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.stages))) as pool:
+            while pending or running:
+                if error is None:
+                    for stage in list(pending):
+                        if not all(dep in self.results for dep in stage['deps']):
+                            continue
+                        if cpus_in_use + stage['cpus'] > self.cpu_budget:
+                            continue
+                        pending.remove(stage)
+                        cpus_in_use += stage['cpus']
+                        log('Starting pipeline stage ' + stage['name'] + ' (' +
+                            str(stage['cpus']) + ' cpus)')
+                        self.timing[stage['name']] = {'start': time.time()}
+                        running[pool.submit(self._run_stage, stage)] = stage
+                elif not running:
+                    break
+
+                if not running:
+                    # only possible if the graph can never finish, which add_stage prevents
+                    raise ValueError('Pipeline stages cannot be scheduled: ' +
+                                     ', '.join(s['name'] for s in pending))
+
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    cpus_in_use -= stage['cpus']
+                    self.timing[stage['name']]['end'] = time.time()
+                    try:
+                        self.results[stage['name']] = future.result()
+                        if self.scratch_manager is not None and error is None:
+                            self.scratch_manager.stage_done(stage['name'])
+                    except Exception as e:
+                        log('Pipeline stage ' + stage['name'] + ' failed: ' + str(e))
+                        if error is None:
+                            error = e
+
+        if error is not None:
+            raise error
+        return self.results
+
+    def stage_timing(self):
+        '''
+        [{'name', 'deps', 'cpus', 'start', 'end', 'duration'}, ...] for the stages that ran,
+        in start order; start and end are in seconds from the start of the run
+        '''
+        timing = []
+        for stage in self.stages:
+            t = self.timing.get(stage['name'])
+            if not t or 'end' not in t:
+                continue
+            timing.append({'name': stage['name'],
+                           'deps': stage['deps'],
+                           'cpus': stage['cpus'],
+                           'start': round(t['start'] - self._t0, 3),
+                           'end': round(t['end'] - self._t0, 3),
+                           'duration': round(t['end'] - t['start'], 3)})
+        return sorted(timing, key=lambda t: t['start'])
+
+    def critical_path(self):
+        '''
+        The chain of stages that determined the total run time: starting from the stage that
+        finished last, repeatedly step back to the dependency that finished last.
+        '''
+        timing = dict((t['name'], t) for t in self.stage_timing())
+        if not timing:
+            return []
+        path = [max(timing.values(), key=lambda t: t['end'])['name']]
+        while True:
+            deps = [d for d in timing[path[-1]]['deps'] if d in timing]
+            if not deps:
+                break
+            path.append(max(deps, key=lambda d: timing[d]['end']))
+        path.reverse()
+        return path
+
+    def log_timing(self):
+        timing = self.stage_timing()
+        if not timing:
+            return
+        total = max(t['end'] for t in timing)
+        lines = ['Pipeline stage timing (seconds):']
+        for t in timing:
+            lines.append('  {0:<24} start {1:>9.2f}  end {2:>9.2f}  took {3:>9.2f}  cpus {4}'
+                         .format(t['name'], t['start'], t['end'], t['duration'], t['cpus']))
+        path = self.critical_path()
+        path_time = sum(t['duration'] for t in timing if t['name'] in path)
+        lines.append('  total: {0:.2f}; critical path: {1} ({2:.2f})'
+                     .format(total, ' -> '.join(path), path_time))
+        log('\n'.join(lines))
@@ -0,0 +1,160 @@
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import threading
+from urllib.parse import urlparse
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+
+from installed_clients import baseclient
+from installed_clients.baseclient import ServerError, _JSONObjectEncoder
+
+# the generated class, as it was before install()
+_GeneratedBaseClient = baseclient.BaseClient
+
+# connections are pooled, and kept alive, per scheme and host; the pools are shared by all
+# of the clients in the process.  KB_CLIENT_POOL_SIZE is the number of connections kept
+# per host, and request bodies of at least KB_CLIENT_COMPRESS_MIN_BYTES are sent gzipped
+# (off by default: the server must accept Content-Encoding: gzip)
+POOL_SIZE = int(os.environ.get('KB_CLIENT_POOL_SIZE') or 10)
+COMPRESS_MIN_BYTES = int(os.environ.get('KB_CLIENT_COMPRESS_MIN_BYTES') or 0)
+_sessions = dict()
+_sessions_lock = threading.Lock()
+
+# the service URLs that the Service Wizard returns for dynamic services are cached for
+# KB_CLIENT_URL_CACHE_SECONDS (0 to look them up for every call), by wizard URL, module and
+# version, and shared by all of the clients in the process
+URL_CACHE_SECONDS = float(os.environ.get('KB_CLIENT_URL_CACHE_SECONDS') or 300)
+_service_urls = dict()
+_service_urls_lock = threading.Lock()
+
+
+def get_session(url, pool_size=None):
+    ''' the shared requests session for the scheme and host of url '''
+    pool_size = int(pool_size or POOL_SIZE)
+    parsed = urlparse(url)
+    key = (parsed.scheme, parsed.netloc, pool_size)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            session.mount(parsed.scheme + '://' + parsed.netloc,
+                          HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+            # the session is shared by clients with different tokens; keep no cookies
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            _sessions[key] = session
+    return session
+
+
+class PooledBaseClient(_GeneratedBaseClient):
+    '''
+    The SDK base client (installed_clients/baseclient.py), with its calls made on pooled,
+    kept alive connections instead of a new connection per call, and optionally with gzipped
+    request bodies.  The URLs of dynamic services are cached (see URL_CACHE_SECONDS); a call
+    that can't connect to a cached URL looks the service up again, and is retried if it
+    has moved.
+
+    baseclient.py is generated by kb-sdk and overwritten whenever the clients are installed
+    again, so the changes are made here; install() makes the installed clients use this
+    class, and is called when kb_MsuiteImpl is imported.
+
+    pool_size - the number of connections to keep open per host; the default is
+        KB_CLIENT_POOL_SIZE, or 10.
+    compress_min_bytes - send request bodies of at least this many bytes gzipped; the
+        default is KB_CLIENT_COMPRESS_MIN_BYTES, or 0 (never).
+    '''
+
+    def __init__(self, *args, pool_size=None, compress_min_bytes=None, **kwargs):
+        super(PooledBaseClient, self).__init__(*args, **kwargs)
+        self.pool_size = pool_size
+        self.compress_min_bytes = int(compress_min_bytes or COMPRESS_MIN_BYTES)
+
+    def _call(self, url, method, params, context=None):
+        # as the generated _call, but posted on a pooled session
+        arg_hash = {'method': method,
+                    'params': params,
+                    'version': '1.1',
+                    'id': str(random.random())[2:]
+                    }
+        if context:
+            if type(context) is not dict:
+                raise ValueError('context is not type dict as required.')
+            arg_hash['context'] = context
+
+        body = json.dumps(arg_hash, cls=_JSONObjectEncoder)
+        headers = self._headers
+        if self.compress_min_bytes and len(body) >= self.compress_min_bytes:
+            body = gzip.compress(body.encode('utf-8'))
+            headers = dict(self._headers)
+            headers['Content-Encoding'] = 'gzip'
+        ret = get_session(url, self.pool_size).post(
+            url, data=body, headers=headers, timeout=self.timeout,
+            verify=not self.trust_all_ssl_certificates)
+        ret.encoding = 'utf-8'
+        if ret.status_code == 500:
+            if ret.headers.get(baseclient._CT) == baseclient._AJ:
+                err = ret.json()
+                if 'error' in err:
+                    raise ServerError(**err['error'])
+                else:
+                    raise ServerError('Unknown', 0, ret.text)
+            else:
+                raise ServerError('Unknown', 0, ret.text)
+        if not ret.ok:
+            ret.raise_for_status()
+        resp = ret.json()
+        if 'result' not in resp:
+            raise ServerError('Unknown', 0, 'An unknown server error occurred')
+        if not resp['result']:
+            return
+        if len(resp['result']) == 1:
+            return resp['result'][0]
+        return resp['result']
+
+    def _get_service_url(self, service_method, service_version, refresh=False):
+        if not self.lookup_url:
+            return self.url
+        service, _ = service_method.split('.')
+        key = (self.url, service, service_version)
+        if not refresh and URL_CACHE_SECONDS > 0:
+            with _service_urls_lock:
+                cached = _service_urls.get(key)
+            if cached and time.time() - cached[1] < URL_CACHE_SECONDS:
+                return cached[0]
+        url = super(PooledBaseClient, self)._get_service_url(service_method, service_version)
+        with _service_urls_lock:
+            _service_urls[key] = (url, time.time())
+        return url
+
+    def call_method(self, service_method, args, service_ver=None, context=None):
+        url = self._get_service_url(service_method, service_ver)
+        context = self._set_up_context(service_ver, context)
+        try:
+            return self._call(url, service_method, args, context)
+        except ConnectionError:
+            if not self.lookup_url:
+                raise
+            # the cached url may be stale, e.g. the service was restarted elsewhere; only
+            # retry if it has moved, so the call isn't made twice on the same service
+            new_url = self._get_service_url(service_method, service_ver, refresh=True)
+            if new_url == url:
+                raise
+            return self._call(new_url, service_method, args, context)
+
+
+def install():
+    '''
+    Make the installed SDK clients use PooledBaseClient: those imported from now on, through
+    baseclient.BaseClient, and those already imported, through their _BaseClient
+    '''
+    baseclient.BaseClient = PooledBaseClient
+    for name, module in list(sys.modules.items()):
+        if name.startswith('installed_clients.') and \
+           getattr(module, '_BaseClient', None) is _GeneratedBaseClient:
+            module._BaseClient = PooledBaseClient
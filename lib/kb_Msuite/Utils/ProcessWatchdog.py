@@ -0,0 +1,245 @@
+import os
+import sys
+import time
+import shutil
+import signal
+import subprocess
+
+from kb_Msuite.Utils.ResourceTimeline import ResourceTimeline
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+    sys.stdout.flush()
+
+
+class CheckMProcessError(ValueError):
+    '''
+    A CheckM subprocess failed.  oom is set if it was most likely killed for running out of
+    memory, timed_out if it ran over its time limit and stalled if it stopped making progress.
+    '''
+
+    def __init__(self, message, exit_code=None, oom=False, timed_out=False, stalled=False):
+        super(CheckMProcessError, self).__init__(message)
+        self.exit_code = exit_code
+        self.oom = oom
+        self.timed_out = timed_out
+        self.stalled = stalled
+
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+_CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+# messages that processes in a CheckM run print when they run out of memory
+_OOM_MESSAGES = ['MemoryError', 'Cannot allocate memory', 'Out of memory', 'out of memory']
+
+
+def sample_process_group(pgid):
+    '''
+    Resource use of the processes in process group pgid, read from /proc:
+        {'procs': n, 'threads': n, 'rss': bytes, 'cpu_seconds': s,
+         'read_bytes': b, 'write_bytes': b}
+    cpu_seconds includes the children that the processes have waited for; the I/O counters
+    are for the live processes only.
+    Returns None if /proc is not available.
+    '''
+    if not os.path.isdir('/proc'):
+        return None
+    sample = {'procs': 0, 'threads': 0, 'rss': 0, 'cpu_seconds': 0.0,
+              'read_bytes': 0, 'write_bytes': 0}
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/' + pid + '/stat') as stat_handle:
+                # the command name is in parentheses and may contain spaces
+                fields = stat_handle.read().rsplit(')', 1)[1].split()
+            if int(fields[2]) != pgid:
+                continue
+            sample['procs'] += 1
+            sample['cpu_seconds'] += sum(int(f) for f in fields[11:15]) / float(_CLK_TCK)
+            sample['threads'] += int(fields[17])
+            sample['rss'] += int(fields[21]) * _PAGE_SIZE
+            with open('/proc/' + pid + '/io') as io_handle:
+                for line in io_handle:
+                    key, value = line.split(':', 1)
+                    if key in ('read_bytes', 'write_bytes'):
+                        sample[key] += int(value)
+        except (IOError, OSError, IndexError, ValueError):
+            # the process exited, or /proc/<pid>/io is not readable
+            continue
+    return sample
+
+
+def _cgroup_oom_kills():
+    ''' the OOM kill count of this cgroup, or None if it can't be read '''
+    for path, key in [('/sys/fs/cgroup/memory.events', 'oom_kill'),
+                      ('/sys/fs/cgroup/memory/memory.oom_control', 'oom_kill')]:
+        try:
+            with open(path) as events_handle:
+                for line in events_handle:
+                    parts = line.split()
+                    if len(parts) == 2 and parts[0] == key:
+                        return int(parts[1])
+        except (IOError, OSError, ValueError):
+            continue
+    return None
+
+
+class ProcessWatchdog(object):
+    '''
+    Runs a command and supervises it until it exits: it samples the RSS, CPU time and I/O of
+    the whole process tree, logs a heartbeat, and kills the tree if it runs over timeout seconds
+    or makes no progress (neither uses CPU nor writes output) for stall_timeout seconds.
+    The command's output goes to output_path; with echo_output it is also copied to stdout.
+    The samples, taken every interval seconds, are kept in timeline (a ResourceTimeline).
+    With cpus, the command (and so every process and thread it starts) is pinned to that list
+    of CPUs.
+    '''
+
+    def __init__(self, command, output_path, cwd=None, timeout=None, stall_timeout=None,
+                 interval=5, heartbeat_interval=300, echo_output=False, cpus=None):
+        self.command = command
+        self.output_path = output_path
+        self.cwd = cwd
+        self.timeout = timeout or None
+        self.stall_timeout = stall_timeout or None
+        self.interval = interval
+        self.heartbeat_interval = heartbeat_interval
+        self.echo_output = echo_output
+        self.cpus = cpus
+
+        self.exit_code = None
+        self.timed_out = False
+        self.stalled = False
+        self.oom = False
+        self.peak_rss = 0
+        self.cpu_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.timeline = ResourceTimeline()
+
+    def run(self):
+        ''' Run the command to completion; returns its exit code '''
+        oom_kills = _cgroup_oom_kills()
+        output_handle = open(self.output_path, 'w')
+        echo_handle = open(self.output_path, errors='replace') if self.echo_output else None
+        start = time.time()
+        try:
+            # a session of its own, so the whole tree can be sampled and killed as a group;
+            # the affinity is set by taskset before the command starts, so it is inherited by
+            # everything it starts (a preexec_fn is not safe in a process with threads)
+            command = self.command
+            taskset = shutil.which('taskset') if self.cpus else None
+            if taskset:
+                command = [taskset, '--cpu-list',
+                           ','.join(str(c) for c in sorted(self.cpus))] + list(command)
+            p = subprocess.Popen(command, cwd=self.cwd, shell=False,
+                                 stdout=output_handle, stderr=subprocess.STDOUT,
+                                 start_new_session=True)
+            if self.cpus and not taskset:
+                # anything it started before this runs on any CPU
+                try:
+                    os.sched_setaffinity(p.pid, set(self.cpus))
+                except OSError as e:
+                    log(self._name() + ': unable to pin to CPUs: ' + str(e))
+            last_progress = start
+            last_heartbeat = start
+            last_cpu = 0.0
+            last_output_size = 0
+            while True:
+                try:
+                    self.exit_code = p.wait(timeout=self.interval)
+                except subprocess.TimeoutExpired:
+                    self.exit_code = None
+                self._echo(echo_handle)
+                if self.exit_code is not None:
+                    break
+
+                now = time.time()
+                sample = sample_process_group(p.pid)
+                output_size = os.path.getsize(self.output_path)
+                if sample:
+                    self.timeline.add(now - start, sample)
+                    self.peak_rss = max(self.peak_rss, sample['rss'])
+                    # children that exit without being waited for take their CPU time with
+                    # them; keep the maximum
+                    self.cpu_seconds = max(self.cpu_seconds, sample['cpu_seconds'])
+                    self.read_bytes = max(self.read_bytes, sample['read_bytes'])
+                    self.write_bytes = max(self.write_bytes, sample['write_bytes'])
+                    if sample['cpu_seconds'] > last_cpu + 0.1 * self.interval:
+                        last_progress = now
+                    last_cpu = sample['cpu_seconds']
+                if output_size != last_output_size:
+                    last_progress = now
+                    last_output_size = output_size
+
+                if now - last_heartbeat >= self.heartbeat_interval:
+                    last_heartbeat = now
+                    log(self._name() + ': running for ' + str(int(now - start)) + 's' +
+                        ('; ' + self._describe(sample) if sample else ''))
+
+                if self.timeout and now - start > self.timeout:
+                    log(self._name() + ': exceeded the time limit of ' + str(self.timeout) +
+                        's; stopping it')
+                    self.timed_out = True
+                    self.exit_code = self._kill(p)
+                    break
+                if self.stall_timeout and sample and now - last_progress > self.stall_timeout:
+                    log(self._name() + ': no CPU use or output for ' +
+                        str(int(now - last_progress)) + 's; stopping it')
+                    self.stalled = True
+                    self.exit_code = self._kill(p)
+                    break
+        finally:
+            output_handle.close()
+            self.wall_seconds = time.time() - start
+            self._echo(echo_handle)
+            if echo_handle:
+                echo_handle.close()
+
+        if self.exit_code != 0 and not (self.timed_out or self.stalled):
+            self.oom = self._detect_oom(oom_kills)
+        return self.exit_code
+
+    def _name(self):
+        return ' '.join(self.command[:2])
+
+    def _describe(self, sample):
+        return '{0} processes, {1} threads, RSS {2:.1f} MB, CPU time {3:.0f}s'.format(
+            sample['procs'], sample['threads'], sample['rss'] / 1048576.0, sample['cpu_seconds'])
+
+    def _echo(self, echo_handle):
+        if echo_handle:
+            data = echo_handle.read()
+            if data:
+                sys.stdout.write(data)
+                sys.stdout.flush()
+
+    def _kill(self, p, grace=10):
+        try:
+            os.killpg(p.pid, signal.SIGTERM)
+            return p.wait(timeout=grace)
+        except subprocess.TimeoutExpired:
+            os.killpg(p.pid, signal.SIGKILL)
+            return p.wait()
+        except OSError:
+            return p.wait()
+
+    def _detect_oom(self, oom_kills_before):
+        oom_kills = _cgroup_oom_kills()
+        if oom_kills is not None and oom_kills_before is not None and \
+           oom_kills > oom_kills_before:
+            return True
+        # the kernel OOM killer uses SIGKILL
+        if self.exit_code == -signal.SIGKILL:
+            return True
+        try:
+            with open(self.output_path, 'rb') as output_handle:
+                output_handle.seek(max(0, os.path.getsize(self.output_path) - 65536))
+                tail = output_handle.read().decode('utf-8', 'replace')
+        except (IOError, OSError):
+            return False
+        return any(message in tail for message in _OOM_MESSAGES)
@@ -0,0 +1,216 @@
+import os
+import re
+import sys
+import time
+import json
+import uuid
+import fcntl
+from contextlib import contextmanager
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+    sys.stdout.flush()
+
+
+def _available_cpus():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def _parse_cpulist(cpulist):
+    ''' the CPUs in a kernel cpulist, e.g. "0-3,8-11" '''
+    cpus = []
+    for part in cpulist.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def _numa_nodes(cpus, node_dir='/sys/devices/system/node'):
+    '''
+    cpus grouped by NUMA node, as a list of lists; one group with all of them if the
+    topology can't be read
+    '''
+    nodes = []
+    try:
+        for name in sorted(os.listdir(node_dir)):
+            if not re.match(r'node\d+$', name):
+                continue
+            with open(os.path.join(node_dir, name, 'cpulist')) as cpulist_handle:
+                node_cpus = [c for c in _parse_cpulist(cpulist_handle.read()) if c in cpus]
+            if node_cpus:
+                nodes.append(node_cpus)
+    except (IOError, OSError, ValueError):
+        nodes = []
+    if sorted(c for node in nodes for c in node) != sorted(cpus):
+        return [list(cpus)]
+    return nodes
+
+
+def _available_memory():
+    ''' the memory limit of this cgroup, or the total memory, in bytes '''
+    for path in ['/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes']:
+        try:
+            with open(path) as limit_handle:
+                limit = limit_handle.read().strip()
+            # an unlimited cgroup v1 reports a huge number
+            if limit != 'max' and int(limit) < 2 ** 60:
+                return int(limit)
+        except (IOError, OSError, ValueError):
+            continue
+    try:
+        with open('/proc/meminfo') as meminfo_handle:
+            for line in meminfo_handle:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+class ResourceBroker(object):
+    '''
+    Admission control for the CheckM subprocesses of every run in the container: a process
+    asks for a grant of threads and memory before it starts, and waits in a queue until the
+    grants already out leave room for it.  The queue is first come, first served, so large
+    requests (e.g. a full tree lineage_wf) are not starved by small ones, and a request that
+    is larger than the whole container is granted once it would run alone.
+
+    With pin, a grant also gets a set of CPUs, one per thread, that no other pinned grant
+    holds, to run its processes on (see ProcessWatchdog); the CPUs are taken from a single
+    NUMA node if one has enough of them free.
+
+    The ledger of grants and waiting requests is a JSON file in ledger_dir, read and written
+    under an flock(), so it is shared by all threads and server processes that use the same
+    ledger_dir.  Entries of processes that no longer exist are dropped.
+    '''
+
+    LEDGER_FILE = 'resource_ledger.json'
+    LOCK_FILE = 'resource_ledger.lock'
+
+    def __init__(self, ledger_dir, total_threads=None, total_memory=None, poll_interval=2):
+        self.ledger_dir = ledger_dir
+        self.cpus = _available_cpus()
+        self.numa_nodes = _numa_nodes(self.cpus)
+        self.total_threads = int(total_threads or len(self.cpus))
+        self.total_memory = int(total_memory or _available_memory() or 0) or None
+        self.poll_interval = poll_interval
+        if not os.path.exists(self.ledger_dir):
+            os.makedirs(self.ledger_dir)
+
+    @contextmanager
+    def grant(self, threads, memory=0, label='', pin=False):
+        '''
+        Wait for, and hold in the with block, a grant of threads and memory (bytes).  Yields
+        the grant: {'id', 'threads', 'memory', 'label', 'pid', 'cpus', 'wait_seconds'};
+        threads is capped at total_threads, and cpus is the list of CPUs to pin to, or None
+        without pin or if there aren't enough free CPUs.
+        '''
+        request = {'id': str(uuid.uuid4()),
+                   'pid': os.getpid(),
+                   'threads': max(1, min(int(threads or 1), self.total_threads)),
+                   'memory': int(memory or 0),
+                   'label': label,
+                   'cpus': None,
+                   'queued': time.time()}
+        start = time.time()
+        logged = False
+        try:
+            while True:
+                with self._ledger() as ledger:
+                    if not any(q['id'] == request['id'] for q in ledger['queue']):
+                        ledger['queue'].append(request)
+                    if ledger['queue'][0]['id'] == request['id'] and \
+                       self._fits(request, ledger['grants']):
+                        ledger['queue'].pop(0)
+                        if pin:
+                            request['cpus'] = self._allocate_cpus(request['threads'],
+                                                                  ledger['grants'])
+                        ledger['grants'].append(request)
+                        break
+                    in_use = self._in_use(ledger['grants'])
+                if not logged:
+                    log('Waiting for {0} threads and {1:.1f} GB of memory for {2} ({3} threads '
+                        'and {4:.1f} GB in use)'.format(request['threads'],
+                                                        request['memory'] / 1073741824.0,
+                                                        label, in_use[0],
+                                                        in_use[1] / 1073741824.0))
+                    logged = True
+                time.sleep(self.poll_interval)
+            request['wait_seconds'] = round(time.time() - start, 3)
+            if logged:
+                log('Granted resources for ' + label + ' after {0:.1f}s'.format(
+                    request['wait_seconds']))
+            yield request
+        finally:
+            with self._ledger() as ledger:
+                ledger['queue'] = [q for q in ledger['queue'] if q['id'] != request['id']]
+                ledger['grants'] = [g for g in ledger['grants'] if g['id'] != request['id']]
+
+    def _in_use(self, grants):
+        return (sum(g['threads'] for g in grants), sum(g['memory'] for g in grants))
+
+    def _fits(self, request, grants):
+        if not grants:
+            return True
+        threads, memory = self._in_use(grants)
+        if threads + request['threads'] > self.total_threads:
+            return False
+        if self.total_memory and memory + request['memory'] > self.total_memory:
+            return False
+        return True
+
+    def _allocate_cpus(self, threads, grants):
+        ''' threads CPUs that no grant is pinned to, or None if there aren't enough '''
+        held = set(c for g in grants for c in (g.get('cpus') or []))
+        free_nodes = [[c for c in node if c not in held] for node in self.numa_nodes]
+        if sum(len(node) for node in free_nodes) < threads:
+            return None
+        # the fullest node that fits all of the threads, so the emptier ones stay free for
+        # larger grants; otherwise spread over the nodes with the most CPUs free
+        fitting = [node for node in free_nodes if len(node) >= threads]
+        if fitting:
+            return min(fitting, key=len)[:threads]
+        cpus = []
+        for node in sorted(free_nodes, key=len, reverse=True):
+            cpus.extend(node[:threads - len(cpus)])
+        return sorted(cpus)
+
+    def _pid_alive(self, pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            return True
+        return True
+
+    @contextmanager
+    def _ledger(self):
+        ''' the ledger, locked; changes to it are saved at the end of the with block '''
+        with open(os.path.join(self.ledger_dir, self.LOCK_FILE), 'a') as lock_handle:
+            fcntl.flock(lock_handle, fcntl.LOCK_EX)
+            try:
+                ledger_path = os.path.join(self.ledger_dir, self.LEDGER_FILE)
+                try:
+                    with open(ledger_path) as ledger_handle:
+                        ledger = json.load(ledger_handle)
+                except (IOError, OSError, ValueError):
+                    ledger = {'grants': [], 'queue': []}
+                for key in ['grants', 'queue']:
+                    ledger[key] = [entry for entry in ledger.get(key, [])
+                                   if self._pid_alive(entry['pid'])]
+                yield ledger
+                tmp_path = ledger_path + '.tmp'
+                with open(tmp_path, 'w') as ledger_handle:
+                    json.dump(ledger, ledger_handle)
+                os.replace(tmp_path, ledger_path)
+            finally:
+                fcntl.flock(lock_handle, fcntl.LOCK_UN)
@@ -0,0 +1,107 @@
+from xml.sax.saxutils import escape
+
+
+class ResourceTimeline(object):
+    '''
+    Time series of the resource use of a process tree, from the samples that ProcessWatchdog
+    takes while a CheckM subcommand runs (see sample_process_group).  Each point is
+        [t, cpu_percent, rss, threads, read_bytes, write_bytes]
+    with t in seconds from the start of the process; cpu_percent is the CPU use since the
+    previous point, where 100 is one busy core.  To stay small for long runs, whenever there
+    are more than max_points the points are merged in pairs, and from then on twice as many
+    samples go into each point: the CPU use is averaged and the RSS and thread counts keep
+    their maximum.
+    '''
+
+    FIELDS = ['t', 'cpu_percent', 'rss', 'threads', 'read_bytes', 'write_bytes']
+    MAX_POINTS = 720
+
+    def __init__(self, max_points=None):
+        self.max_points = max(2, int(max_points or self.MAX_POINTS))
+        self.points = []
+        self._samples_per_point = 1
+        self._pending = None
+        self._pending_samples = 0
+        self._last_t = 0.0
+        self._last_cpu = 0.0
+
+    def add(self, t, sample):
+        ''' add a sample taken t seconds after the start of the process '''
+        elapsed = t - self._last_t
+        cpu_percent = 0.0
+        if elapsed > 0:
+            cpu_percent = max(0.0, 100.0 * (sample['cpu_seconds'] - self._last_cpu) / elapsed)
+        self._last_t = t
+        self._last_cpu = max(self._last_cpu, sample['cpu_seconds'])
+        point = [round(t, 1), round(cpu_percent, 1), sample['rss'], sample['threads'],
+                 sample['read_bytes'], sample['write_bytes']]
+
+        if self._pending is None:
+            self._pending = point
+            self._pending_samples = 1
+        else:
+            self._pending = self._merge(self._pending, self._pending_samples, point, 1)
+            self._pending_samples += 1
+        if self._pending_samples >= self._samples_per_point:
+            self.points.append(self._pending)
+            self._pending = None
+            if len(self.points) > self.max_points:
+                self.points = [self._merge(self.points[i], 1, self.points[i + 1], 1)
+                               for i in range(0, len(self.points) - 1, 2)] + \
+                    self.points[len(self.points) - len(self.points) % 2:]
+                self._samples_per_point *= 2
+
+    def _merge(self, first, first_weight, second, second_weight):
+        ''' one point for two consecutive ones, with the CPU use weighted by sample count '''
+        cpu_percent = (first[1] * first_weight + second[1] * second_weight) / \
+            float(first_weight + second_weight)
+        return [second[0], round(cpu_percent, 1), max(first[2], second[2]),
+                max(first[3], second[3]), second[4], second[5]]
+
+    def to_dict(self):
+        points = self.points + ([self._pending] if self._pending is not None else [])
+        return {'fields': self.FIELDS, 'points': points}
+
+
+def timeline_svg(timeline, title, width=640, height=180):
+    '''
+    A small SVG chart of a ResourceTimeline.to_dict(): the number of busy cores and the RSS
+    over time, each scaled to its own maximum.  Returns None if there are too few points.
+    '''
+    points = timeline.get('points') or []
+    if len(points) < 2:
+        return None
+    left, right, top, bottom = 50, 60, 24, 30
+    plot_w = width - left - right
+    plot_h = height - top - bottom
+    t_max = max(p[0] for p in points) or 1.0
+    cores_max = max(1.0, max(p[1] for p in points) / 100.0)
+    rss_max = max(p[2] for p in points) or 1
+
+    def polyline(values, v_max, color):
+        coords = ['{0:.1f},{1:.1f}'.format(left + plot_w * p[0] / t_max,
+                                           top + plot_h * (1 - v / float(v_max)))
+                  for p, v in zip(points, values)]
+        return ('<polyline fill="none" stroke="' + color + '" stroke-width="1.5" points="' +
+                ' '.join(coords) + '"/>\n')
+
+    svg = ['<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" '
+           'font-family="sans-serif" font-size="11">\n'.format(width, height),
+           '<text x="{0}" y="14" font-weight="bold">{1}</text>\n'.format(left, escape(title)),
+           '<rect x="{0}" y="{1}" width="{2}" height="{3}" fill="none" stroke="#bbb"/>\n'
+           .format(left, top, plot_w, plot_h),
+           polyline([p[1] / 100.0 for p in points], cores_max, '#337ab7'),
+           polyline([p[2] for p in points], rss_max, '#d9534f'),
+           '<text x="{0}" y="{1}" text-anchor="end" fill="#337ab7">{2:.1f}</text>\n'
+           .format(left - 4, top + 10, cores_max),
+           '<text x="{0}" y="{1}" text-anchor="end" fill="#337ab7">cores</text>\n'
+           .format(left - 4, top + plot_h),
+           '<text x="{0}" y="{1}" fill="#d9534f">{2:.0f} MB</text>\n'
+           .format(left + plot_w + 4, top + 10, rss_max / 1048576.0),
+           '<text x="{0}" y="{1}" fill="#d9534f">RSS</text>\n'
+           .format(left + plot_w + 4, top + plot_h),
+           '<text x="{0}" y="{1}">0</text>\n'.format(left, height - 10),
+           '<text x="{0}" y="{1}" text-anchor="end">{2:.0f}s</text>\n'
+           .format(left + plot_w, height - 10, t_max),
+           '</svg>\n']
+    return ''.join(svg)
@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import fcntl
+from contextlib import contextmanager
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+    sys.stdout.flush()
+
+
+class RunCoalescer(object):
+    '''
+    Coalesces identical lineage_wf runs: runs with the same run ID share a run directory,
+    and only one of them may work in it at a time.  A duplicate of a run in progress waits
+    for it to finish, and then finds its completed stages checkpointed (see
+    PipelineExecutor), so it only redoes the stages that are particular to it, such as
+    its own report and packages.
+
+    The lock is an exclusive flock() on a file per run ID in lock_dir, so it works across
+    threads and server processes, and is released by the kernel if a process dies.  Runs
+    also hold a shared flock() on a second file while they wait and run, so idle() can
+    tell whether any run with the ID is in progress or waiting.
+    '''
+
+    LOCK_EXT = '.lock'
+    USERS_EXT = '.users'
+
+    def __init__(self, lock_dir):
+        self.lock_dir = lock_dir
+
+    def _open(self, run_id, ext):
+        if not os.path.exists(self.lock_dir):
+            os.makedirs(self.lock_dir)
+        return open(os.path.join(self.lock_dir, 'run_' + run_id + ext), 'a')
+
+    @contextmanager
+    def run(self, run_id):
+        '''
+        Hold the lock for run_id in the with block; yields the number of seconds spent
+        waiting for an identical run to finish
+        '''
+        users_handle = self._open(run_id, self.USERS_EXT)
+        lock_handle = self._open(run_id, self.LOCK_EXT)
+        try:
+            start = time.time()
+            fcntl.flock(users_handle, fcntl.LOCK_SH)
+            try:
+                fcntl.flock(lock_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                log('An identical run (' + run_id + ') is in progress; waiting for it to ' +
+                    'finish to reuse its results')
+                fcntl.flock(lock_handle, fcntl.LOCK_EX)
+                log('Identical run ' + run_id + ' finished after {0:.1f}s of waiting'
+                    .format(time.time() - start))
+            yield time.time() - start
+        finally:
+            fcntl.flock(lock_handle, fcntl.LOCK_UN)
+            fcntl.flock(users_handle, fcntl.LOCK_UN)
+            lock_handle.close()
+            users_handle.close()
+
+    @contextmanager
+    def idle(self, run_id):
+        '''
+        Keep runs with run_id from starting in the with block, if none is in progress or
+        waiting; yields True if so, and False (without waiting) otherwise.  E.g. to remove
+        the results of a run, unless an identical run is about to reuse them.
+        '''
+        users_handle = self._open(run_id, self.USERS_EXT)
+        try:
+            try:
+                fcntl.flock(users_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(users_handle, fcntl.LOCK_UN)
+        finally:
+            users_handle.close()
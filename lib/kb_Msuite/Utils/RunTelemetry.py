@@ -0,0 +1,169 @@
+import sys
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+    sys.stdout.flush()
+
+
+def _thread_io():
+    ''' (read_bytes, write_bytes) of the calling thread, or (0, 0) if they can't be read '''
+    counters = {'read_bytes': 0, 'write_bytes': 0}
+    try:
+        with open('/proc/thread-self/io') as io_handle:
+            for line in io_handle:
+                key, value = line.split(':', 1)
+                if key in counters:
+                    counters[key] = int(value)
+    except (IOError, OSError, ValueError):
+        pass
+    return counters['read_bytes'], counters['write_bytes']
+
+
+def _thread_cpu():
+    ''' the CPU time, in seconds, of the calling thread, or 0 if it can't be measured '''
+    # not time.thread_time(), which needs Python 3.7
+    if not hasattr(resource, 'RUSAGE_THREAD'):
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _children_peak_rss():
+    ''' the peak RSS, in bytes, of the largest child process waited for so far '''
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+
+class RunTelemetry(object):
+    '''
+    A per-stage record of where the time and resources of a run go.  Each stage is measured
+    with stage(), on the thread that runs it:
+        wall_seconds - elapsed time
+        cpu_seconds - CPU time of the stage's thread plus that of the CheckM processes it ran
+        peak_rss - the largest peak RSS of the stage's CheckM processes, or of any other child
+                   process if the peak RSS of the children (getrusage) went up during the stage
+        read_bytes, write_bytes - block I/O of the stage's thread and CheckM processes
+        queue_wait_seconds - time the stage's CheckM processes waited for a grant of threads
+                             and memory (see ResourceBroker)
+        counts - e.g. the number of bins, set with count()
+    CheckM processes are added with add_process(), from the stage's thread, with the
+    timeline of their resource use.
+    summary() adds totals for the whole run from getrusage.
+    '''
+
+    def __init__(self):
+        self.start = time.time()
+        self.stages = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._self_rusage = resource.getrusage(resource.RUSAGE_SELF)
+        self._children_rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    @contextmanager
+    def stage(self, name):
+        ''' measure the code in the with block as stage name '''
+        record = {'name': name,
+                  'start': round(time.time() - self.start, 3),
+                  'wall_seconds': 0.0,
+                  'cpu_seconds': 0.0,
+                  'peak_rss': 0,
+                  'read_bytes': 0,
+                  'write_bytes': 0,
+                  'queue_wait_seconds': 0.0,
+                  'processes': [],
+                  'counts': dict(),
+                  'failed': False}
+        outer = getattr(self._local, 'record', None)
+        self._local.record = record
+        start = time.time()
+        thread_cpu = _thread_cpu()
+        read_bytes, write_bytes = _thread_io()
+        children_peak_rss = _children_peak_rss()
+        try:
+            yield record
+        except Exception:
+            record['failed'] = True
+            raise
+        finally:
+            self._local.record = outer
+            end_read_bytes, end_write_bytes = _thread_io()
+            record['wall_seconds'] = round(time.time() - start, 3)
+            record['cpu_seconds'] = round(record['cpu_seconds'] + _thread_cpu() - thread_cpu,
+                                          3)
+            record['read_bytes'] += end_read_bytes - read_bytes
+            record['write_bytes'] += end_write_bytes - write_bytes
+            if _children_peak_rss() > children_peak_rss:
+                record['peak_rss'] = max(record['peak_rss'], _children_peak_rss())
+            with self._lock:
+                self.stages.append(record)
+
+    def add_process(self, name, watchdog, queue_wait_seconds=0.0):
+        '''
+        add the resource use of a finished ProcessWatchdog, and the time it waited to be
+        started, to the current stage
+        '''
+        record = getattr(self._local, 'record', None)
+        if record is None:
+            return
+        record['processes'].append({'name': name,
+                                    'exit_code': watchdog.exit_code,
+                                    'wall_seconds': round(watchdog.wall_seconds, 3),
+                                    'cpu_seconds': round(watchdog.cpu_seconds, 3),
+                                    'peak_rss': watchdog.peak_rss,
+                                    'read_bytes': watchdog.read_bytes,
+                                    'write_bytes': watchdog.write_bytes,
+                                    'queue_wait_seconds': queue_wait_seconds,
+                                    'timeline': watchdog.timeline.to_dict()})
+        record['cpu_seconds'] += watchdog.cpu_seconds
+        record['peak_rss'] = max(record['peak_rss'], watchdog.peak_rss)
+        record['read_bytes'] += watchdog.read_bytes
+        record['write_bytes'] += watchdog.write_bytes
+        record['queue_wait_seconds'] = round(record['queue_wait_seconds'] + queue_wait_seconds, 3)
+
+    def count(self, **counts):
+        ''' set counts (e.g. bins=10) on the current stage '''
+        record = getattr(self._local, 'record', None)
+        if record is not None:
+            record['counts'].update(counts)
+
+    def summary(self, **extra):
+        '''
+        The telemetry as a JSON-able dict: the stages measured so far, in start order, and
+        totals for the run; extra items (e.g. the pipeline timing) are added as they are.
+        '''
+        self_rusage = resource.getrusage(resource.RUSAGE_SELF)
+        children_rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with self._lock:
+            stages = sorted(self.stages, key=lambda s: s['start'])
+        summary = {'created': time.time(),
+                   'wall_seconds': round(time.time() - self.start, 3),
+                   'cpu_seconds': round(
+                       (self_rusage.ru_utime + self_rusage.ru_stime) -
+                       (self._self_rusage.ru_utime + self._self_rusage.ru_stime), 3),
+                   'children_cpu_seconds': round(
+                       (children_rusage.ru_utime + children_rusage.ru_stime) -
+                       (self._children_rusage.ru_utime + self._children_rusage.ru_stime), 3),
+                   'peak_rss': self_rusage.ru_maxrss * 1024,
+                   'children_peak_rss': children_rusage.ru_maxrss * 1024,
+                   'queue_wait_seconds': round(sum(s['queue_wait_seconds'] for s in stages), 3),
+                   'stages': stages}
+        summary.update(extra)
+        return summary
+
+    def log_summary(self):
+        lines = ['Run telemetry:']
+        for s in self.summary()['stages']:
+            lines.append('  {0:<24} wall {1:>9.2f}s  CPU {2:>9.2f}s  peak RSS {3:>8.1f} MB  '
+                         'read {4:>8.1f} MB  written {5:>8.1f} MB  queued {6:>7.1f}s{7}'
+                         .format(s['name'], s['wall_seconds'], s['cpu_seconds'],
+                                 s['peak_rss'] / 1048576.0, s['read_bytes'] / 1048576.0,
+                                 s['write_bytes'] / 1048576.0, s['queue_wait_seconds'],
+                                 ''.join('  ' + k + ' ' + str(v)
+                                         for k, v in sorted(s['counts'].items()))))
+        log('\n'.join(lines))
@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import uuid
+import shutil
+import tempfile
+import itertools
+
+from kb_Msuite.Utils.RunCoalescer import RunCoalescer
+from kb_Msuite.Utils.ScratchManager import remove_path
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+    sys.stdout.flush()
+
+
+class RunWorkspace(object):
+    '''
+    A directory tree of its own, root/<run_id>, for the intermediates and logs of a run, so
+    that runs sharing a scratch directory never write to the same paths.  Runs with the same
+    run ID share the tree, one at a time (see RunCoalescer, whose locks are kept in root),
+    which is how an identical run reuses the completed stages of another.
+
+    Trees are removed with remove() once a run succeeds and no identical run is waiting for
+    it; allocate() also removes the trees of other runs that have not been used for
+    retention_hours (e.g. of runs that failed and were not retried), so a node's scratch
+    only holds the runs in progress.
+    '''
+
+    LOG_DIR = 'logs'
+    LOG_EXT = '.out'
+    DEFAULT_RETENTION_HOURS = 24
+
+    @classmethod
+    def allocate(cls, root, run_id=None, retention_hours=None):
+        '''
+        Create the workspace for run_id, or for a new unique ID if none is given, and prune
+        stale workspaces in root
+        '''
+        workspace = cls(root, run_id or str(uuid.uuid4()))
+        cls.prune(root, retention_hours, keep=[workspace.run_id])
+        if not os.path.exists(workspace.path):
+            os.makedirs(workspace.path)
+        # a workspace being reused is not stale
+        os.utime(workspace.path, None)
+        return workspace
+
+    @classmethod
+    def prune(cls, root, retention_hours=None, keep=None):
+        ''' remove the workspaces in root that are not in use and older than retention_hours '''
+        if retention_hours is None:
+            retention_hours = cls.DEFAULT_RETENTION_HOURS
+        if not os.path.isdir(root):
+            return
+        coalescer = RunCoalescer(root)
+        cutoff = time.time() - float(retention_hours) * 3600
+        for run_id in os.listdir(root):
+            path = os.path.join(root, run_id)
+            if run_id in (keep or []) or not os.path.isdir(path):
+                continue
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    continue
+            except OSError:
+                continue
+            with coalescer.idle(run_id) as idle:
+                if idle:
+                    log('Removing stale run workspace ' + path)
+                    cls._remove_tree(path)
+
+    @staticmethod
+    def _remove_tree(path):
+        # entries may be symlinks to input staged elsewhere, e.g. on tmpfs
+        for name in os.listdir(path):
+            remove_path(os.path.join(path, name))
+        shutil.rmtree(path, ignore_errors=True)
+
+    def __init__(self, root, run_id):
+        self.root = root
+        self.run_id = run_id
+        self.path = os.path.join(root, run_id)
+
+    def dir(self, *parts):
+        ''' a path in the workspace; it is not created '''
+        return os.path.join(self.path, *parts)
+
+    def private_dir(self, prefix):
+        ''' a new directory in the workspace that no other run with the same run ID uses '''
+        return tempfile.mkdtemp(prefix=prefix + '_', dir=self.path)
+
+    def log_path(self, name):
+        ''' a new, empty log file for name (e.g. a checkm subcommand) in the workspace '''
+        log_dir = self.dir(self.LOG_DIR)
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        for n in itertools.count(1):
+            path = os.path.join(log_dir, name + '.' + str(n) + self.LOG_EXT)
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return path
+            except FileExistsError:
+                continue
+
+    def remove(self):
+        '''
+        Remove the workspace, unless a run with the same run ID is in progress or waiting
+        (and so will reuse it); returns True if it was removed
+        '''
+        with RunCoalescer(self.root).idle(self.run_id) as idle:
+            if not idle:
+                log('Keeping run workspace ' + self.path + ' for an identical run')
+                return False
+            self._remove_tree(self.path)
+        log('Removed run workspace ' + self.path)
+        return True
@@ -0,0 +1,216 @@
+import os
+import sys
+import time
+import shutil
+import threading
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+    sys.stdout.flush()
+
+
+def path_size(path):
+    ''' bytes in a file or directory tree; symlinks are not followed '''
+    if os.path.islink(path):
+        return 0
+    if not os.path.isdir(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    size = 0
+    for root, dirs, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(root, filename)).st_size
+            except OSError:
+                # removed while walking
+                continue
+    return size
+
+
+def remove_path(path):
+    ''' remove a file or directory tree; a symlink is removed with its target '''
+    if os.path.islink(path):
+        target = os.path.realpath(path)
+        os.remove(path)
+        remove_path(target)
+        try:
+            # the directory the target was staged in, if it is now empty
+            os.rmdir(os.path.dirname(target))
+        except OSError:
+            pass
+    elif os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+class ScratchManager(object):
+    '''
+    Keeps the scratch footprint of a run down, and measures it:
+      - intermediates are registered with the stages that read them, and removed as soon as
+        the last of those stages has completed (see PipelineExecutor); a stage that is
+        skipped or not needed counts as completed, and nothing is removed if a stage fails,
+        so that a retry can resume; the checkpoint of the stage that made an intermediate stays
+        valid once it is removed, until a stage that reads it has to run again
+      - with a tmpfs_dir, input that is known in advance to be up to tmpfs_max_bytes is moved
+        to tmpfs (in memory) once it is staged on disk, and symlinked into the run directory
+      - the bytes in each entry of the run directory, and on tmpfs, are measured every
+        interval seconds and whenever a stage completes; summary() has the peak
+    '''
+
+    def __init__(self, run_dir, tmpfs_dir=None, tmpfs_max_bytes=0, interval=30):
+        self.run_dir = run_dir
+        self.tmpfs_dir = tmpfs_dir if tmpfs_dir and tmpfs_max_bytes else None
+        self.tmpfs_max_bytes = int(tmpfs_max_bytes or 0)
+        self.interval = interval
+        self.tmpfs_staging_dir = None
+        self.peak_bytes = 0
+        self.peak_tmpfs_bytes = 0
+        self.peak_by_dir = dict()
+        self.peak_time = None
+        self.freed_bytes = 0
+        self.removed = []
+        self._intermediates = dict()
+        self._consumers = dict()
+        self._done = set()
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        ''' start measuring the footprint in the background '''
+        self.measure()
+        self._thread = threading.Thread(target=self._sample, name='scratch-manager')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.measure()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.measure()
+
+    def measure(self):
+        ''' measure the footprint now; returns the bytes on disk and on tmpfs '''
+        by_dir = dict()
+        if os.path.isdir(self.run_dir):
+            for name in os.listdir(self.run_dir):
+                by_dir[name] = path_size(os.path.join(self.run_dir, name))
+        disk_bytes = sum(by_dir.values())
+        tmpfs_bytes = 0
+        if self.tmpfs_staging_dir and os.path.isdir(self.tmpfs_staging_dir):
+            tmpfs_bytes = path_size(self.tmpfs_staging_dir)
+        with self._lock:
+            if disk_bytes + tmpfs_bytes > self.peak_bytes + self.peak_tmpfs_bytes:
+                self.peak_bytes = disk_bytes
+                self.peak_tmpfs_bytes = tmpfs_bytes
+                self.peak_by_dir = by_dir
+                self.peak_time = round(time.time() - self._start, 3)
+        return disk_bytes, tmpfs_bytes
+
+    def register(self, path, consumers):
+        ''' remove path once all of the consumers (stage names) have completed '''
+        with self._lock:
+            self._intermediates[path] = set(consumers)
+            self._consumers[path] = set(consumers)
+
+    def consumers(self, path):
+        ''' the stages that path was registered for, also once it has been removed '''
+        with self._lock:
+            return set(self._consumers.get(path, ()))
+
+    def stage_done(self, name):
+        ''' stage name has completed (or did not have to run); remove what it last needed '''
+        self.measure()
+        with self._lock:
+            self._done.add(name)
+            finished = [path for path, consumers in self._intermediates.items()
+                        if consumers <= self._done]
+            for path in finished:
+                del self._intermediates[path]
+        for path in finished:
+            if not os.path.lexists(path):
+                continue
+            size = path_size(os.path.realpath(path))
+            remove_path(path)
+            with self._lock:
+                self.freed_bytes += size
+                self.removed.append(path)
+            log('Removed ' + path + ' ({0:.1f} MB), no longer needed after {1}'.format(
+                size / 1048576.0, name))
+
+    def use_tmpfs(self, expected_bytes):
+        '''
+        Whether input of expected_bytes, estimated before it is staged, is to be moved to
+        tmpfs: a tmpfs_dir must be configured, the size known and up to tmpfs_max_bytes, and
+        tmpfs must have room for twice that
+        '''
+        if not self.tmpfs_dir or not os.path.isdir(self.tmpfs_dir):
+            return False
+        if expected_bytes is None or expected_bytes > self.tmpfs_max_bytes:
+            log('Input size ' + ('unknown' if expected_bytes is None else
+                                 '{0:.1f} MB'.format(expected_bytes / 1048576.0)) +
+                '; keeping it on disk')
+            return False
+        stat = os.statvfs(self.tmpfs_dir)
+        if stat.f_bavail * stat.f_frsize < 2 * expected_bytes:
+            log('Not enough room on ' + self.tmpfs_dir + ' for the input; keeping it on disk')
+            return False
+        return True
+
+    def move_to_tmpfs(self, paths, run_id):
+        '''
+        Move paths, staged in the run directory, to a directory of their own on tmpfs, and
+        symlink them back in under the same names.  The input is always staged on disk first:
+        it is written by other containers (e.g. AssemblyUtil), which only share scratch.
+        Nothing is moved if the paths turn out to be larger than tmpfs_max_bytes, or cannot be
+        copied; returns whether they were moved.
+        '''
+        staged_bytes = sum(path_size(path) for path in paths)
+        if staged_bytes > self.tmpfs_max_bytes:
+            log('Staged input is {0:.1f} MB; keeping it on disk'.format(
+                staged_bytes / 1048576.0))
+            return False
+        staging_dir = os.path.join(self.tmpfs_dir, 'kb_Msuite_' + run_id)
+        try:
+            remove_path(staging_dir)
+            os.makedirs(staging_dir)
+            # copy everything before replacing anything, so a failure leaves the disk copy
+            for path in paths:
+                copy = os.path.join(staging_dir, os.path.basename(path))
+                if os.path.isdir(path):
+                    shutil.copytree(path, copy)
+                else:
+                    shutil.copy2(path, copy)
+        except (OSError, shutil.Error) as e:
+            log('Unable to copy the input to ' + staging_dir + ': ' + str(e) +
+                '; keeping it on disk')
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            return False
+        for path in paths:
+            remove_path(path)
+            os.symlink(os.path.join(staging_dir, os.path.basename(path)), path)
+        self.tmpfs_staging_dir = staging_dir
+        log('Staged input is {0:.1f} MB; moved it to tmpfs'.format(staged_bytes / 1048576.0))
+        self.measure()
+        return True
+
+    def summary(self):
+        with self._lock:
+            return {'peak_bytes': self.peak_bytes,
+                    'peak_tmpfs_bytes': self.peak_tmpfs_bytes,
+                    'peak_time': self.peak_time,
+                    'peak_by_dir': dict(self.peak_by_dir),
+                    'freed_bytes': self.freed_bytes,
+                    'removed': list(self.removed),
+                    'tmpfs_staging': self.tmpfs_staging_dir is not None}
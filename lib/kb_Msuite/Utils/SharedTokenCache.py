@@ -0,0 +1,126 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class SharedTokenCache(object):
+    '''
+    A token cache for authclient.KBaseAuth that is shared by all of the server processes on a
+    host, in an SQLite database at path, so that a token is only validated with the auth
+    service once per 5 minutes for the whole server.  A per-process LRU cache of up to
+    maxsize tokens is kept in front of it.  Tokens are only stored as their SHA-256 hash.
+
+    authclient.py is generated by kb-sdk and overwritten whenever the server is compiled
+    again, so the cache is installed by the server with install().
+
+    Connections are opened when first used, one per process and thread: the server is
+    constructed before uwsgi forks its workers, and an SQLite connection must not be used
+    by more than one process.  Every evict_interval tokens added by a process, expired
+    tokens are deleted through an index on the time they were added, and the least
+    recently used ones through an index on the time they were last used, if there are more
+    than maxsize; in between, the table may grow past maxsize by the tokens added since.
+    The database is an optimization only: if it can't be used, tokens are validated with
+    the auth service.
+    '''
+
+    # as authclient.TokenCache
+    _MAX_TIME_SEC = 5 * 60  # 5 min
+
+    def __init__(self, path, maxsize=2000, evict_interval=100):
+        self._path = path
+        self._maxsize = maxsize
+        self._evict_interval = evict_interval
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._added = 0
+        self._local = threading.local()
+
+    def install(self, auth_client):
+        ''' make auth_client (an authclient.KBaseAuth) use this cache; returns auth_client '''
+        auth_client._cache = self
+        return auth_client
+
+    def _hash(self, token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def _get(self, token_hash):
+        ''' the user of a token hash in the process cache, or None if not cached or expired '''
+        with self._lock:
+            usertime = self._cache.get(token_hash)
+            if not usertime:
+                return None
+            if time.time() - usertime[1] > self._MAX_TIME_SEC:
+                del self._cache[token_hash]
+                return None
+            self._cache.move_to_end(token_hash)
+        return usertime[0]
+
+    def _put(self, token_hash, user, intime):
+        with self._lock:
+            self._cache[token_hash] = [user, intime]
+            self._cache.move_to_end(token_hash)
+            while len(self._cache) > self._maxsize:
+                self._cache.popitem(last=False)
+
+    def _db(self):
+        # a connection of this thread; a thread of a forked process has a new one
+        pid_db = getattr(self._local, 'pid_db', None)
+        if pid_db is None or pid_db[0] != os.getpid():
+            db = sqlite3.connect(self._path, timeout=10, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS tokens (token TEXT PRIMARY KEY, ' +
+                       'user TEXT NOT NULL, added REAL NOT NULL, used REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS tokens_added ON tokens (added)')
+            db.execute('CREATE INDEX IF NOT EXISTS tokens_used ON tokens (used)')
+            pid_db = (os.getpid(), db)
+            self._local.pid_db = pid_db
+        return pid_db[1]
+
+    def get_user(self, token):
+        token_hash = self._hash(token)
+        user = self._get(token_hash)
+        if user:
+            return user
+        now = time.time()
+        try:
+            db = self._db()
+            row = db.execute('SELECT user, added FROM tokens WHERE token = ? AND added >= ?',
+                             (token_hash, now - self._MAX_TIME_SEC)).fetchone()
+            if not row:
+                return None
+            db.execute('UPDATE tokens SET used = ? WHERE token = ?', (now, token_hash))
+        except sqlite3.Error:
+            return None
+        # it expires here when it expires in the database
+        self._put(token_hash, row[0], row[1])
+        return row[0]
+
+    def add_valid_token(self, token, user):
+        if not token:
+            raise ValueError('Must supply token')
+        if not user:
+            raise ValueError('Must supply user')
+        token_hash = self._hash(token)
+        now = time.time()
+        self._put(token_hash, user, now)
+        try:
+            db = self._db()
+            db.execute('INSERT OR REPLACE INTO tokens (token, user, added, used) ' +
+                       'VALUES (?, ?, ?, ?)', (token_hash, user, now, now))
+            with self._lock:
+                self._added += 1
+                evict = self._added % self._evict_interval == 0
+            if evict:
+                self._evict(db, now)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, db, now):
+        db.execute('DELETE FROM tokens WHERE added < ?', (now - self._MAX_TIME_SEC,))
+        excess = db.execute('SELECT COUNT(*) FROM tokens').fetchone()[0] - self._maxsize
+        if excess > 0:
+            db.execute('DELETE FROM tokens WHERE token IN ' +
+                       '(SELECT token FROM tokens ORDER BY used LIMIT ?)', (excess,))
@@ -66,13 +66,53 @@ class kb_Msuite(object):
         """
         :param params: instance of type "CheckMLineageWfParams" (input_ref -
            reference to the input Assembly, AssemblySet, Genome, GenomeSet,
-           or BinnedContigs data) -> structure: parameter "input_ref" of
-           String, parameter "workspace_name" of String, parameter
-           "reduced_tree" of type "boolean" (A boolean - 0 for false, 1 for
-           true. @range (0, 1)), parameter "save_output_dir" of type
+           or BinnedContigs data summary_table_mode - how the HTML summary
+           table is written; one of html - every bin is written as a row of
+           the HTML table data - the bin stats are written to a data file and
+           rendered in the browser, with virtual scrolling, sorting and
+           filtering auto - (default) use 'data' for large numbers of bins,
+           otherwise 'html' optimize_plot_images - if set to 1 (the default),
+           the dist plots in the HTML report are recompressed and thumbnails
+           are added to the summary table plot_image_byte_budget - optional
+           cap, in bytes, on the total size of the plot images in the HTML
+           report; full size images are scaled down (or dropped) to fit
+           dist_plot_mode - how the per-bin distribution plots are made; one
+           of image - (default) rendered as PNG images by checkm dist_plot
+           interactive - the per-contig GC, coding density and
+           tetranucleotide distance data is written out and the plots are
+           drawn in the browser native - rendered as PNG images in parallel
+           by the module itself, which is much faster than checkm dist_plot
+           for large numbers of bins plot_policy - which bins get a
+           distribution plot; bins that are skipped are shown as 'not
+           plotted' in the summary table.  One of all - (default) every bin
+           retained - only the bins that pass the QC filters (with
+           output_filtered_binnedcontigs_obj_name set; otherwise every bin)
+           flagged - only bins with contamination above
+           plot_contamination_perc (default 10) or, if set, completeness
+           below plot_completeness_perc top_n - the plot_top_n (default 100)
+           largest bins by genome size isolate_failed_bins - if set to 1 (the
+           default) and lineage_wf fails, the bins are split up to find the
+           ones it fails on; the others are completed and the failed bins are
+           listed as errors in the summary table profile - if set to 1, the
+           run is profiled with cProfile and tracemalloc and the results are
+           added to the report as profile.zip (also enabled by setting the
+           KB_MSUITE_PROFILE environment variable)) -> structure: parameter
+           "dir_name" of String, parameter "input_ref" of String, parameter
+           "workspace_name" of String, parameter "reduced_tree" of type
            "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1)),
-           parameter "save_plots_dir" of type "boolean" (A boolean - 0 for
-           false, 1 for true. @range (0, 1)), parameter "threads" of Long
+           parameter "save_output_dir" of type "boolean" (A boolean - 0 for
+           false, 1 for true. @range (0, 1)), parameter "save_plots_dir" of
+           type "boolean" (A boolean - 0 for false, 1 for true. @range (0,
+           1)), parameter "threads" of Long, parameter "summary_table_mode"
+           of String, parameter "optimize_plot_images" of type "boolean" (A
+           boolean - 0 for false, 1 for true. @range (0, 1)), parameter
+           "plot_image_byte_budget" of Long, parameter "dist_plot_mode" of
+           String, parameter "plot_policy" of String, parameter
+           "plot_contamination_perc" of Double, parameter
+           "plot_completeness_perc" of Double, parameter "plot_top_n" of
+           Long, parameter "isolate_failed_bins" of type "boolean" (A boolean
+           - 0 for false, 1 for true. @range (0, 1)), parameter "profile" of
+           type "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1))
         :returns: instance of type "CheckMLineageWfResult" -> structure:
            parameter "report_name" of String, parameter "report_ref" of String
         """
@@ -82,15 +122,28 @@ class kb_Msuite(object):
     def run_checkM_lineage_wf_withFilter(self, params, context=None):
         """
         :param params: instance of type "CheckMLineageWf_withFilter_Params"
-           (input_ref - reference to the input BinnedContigs data) ->
-           structure: parameter "input_ref" of String, parameter
-           "workspace_name" of String, parameter "reduced_tree" of type
+           (input_ref - reference to the input BinnedContigs data see
+           CheckMLineageWfParams for summary_table_mode,
+           optimize_plot_images, plot_image_byte_budget, dist_plot_mode, the
+           plot_policy options, isolate_failed_bins and profile) ->
+           structure: parameter "dir_name" of String, parameter "input_ref"
+           of String, parameter "workspace_name" of String, parameter
+           "reduced_tree" of type "boolean" (A boolean - 0 for false, 1 for
+           true. @range (0, 1)), parameter "save_output_dir" of type
            "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1)),
-           parameter "save_output_dir" of type "boolean" (A boolean - 0 for
-           false, 1 for true. @range (0, 1)), parameter "save_plots_dir" of
-           type "boolean" (A boolean - 0 for false, 1 for true. @range (0,
-           1)), parameter "threads" of Long, parameter "completeness_perc" of
-           Double, parameter "contamination_perc" of Double, parameter
+           parameter "save_plots_dir" of type "boolean" (A boolean - 0 for
+           false, 1 for true. @range (0, 1)), parameter "threads" of Long,
+           parameter "summary_table_mode" of String, parameter
+           "optimize_plot_images" of type "boolean" (A boolean - 0 for false,
+           1 for true. @range (0, 1)), parameter "plot_image_byte_budget" of
+           Long, parameter "dist_plot_mode" of String, parameter
+           "plot_policy" of String, parameter "plot_contamination_perc" of
+           Double, parameter "plot_completeness_perc" of Double, parameter
+           "plot_top_n" of Long, parameter "isolate_failed_bins" of type
+           "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1)),
+           parameter "profile" of type "boolean" (A boolean - 0 for false, 1
+           for true. @range (0, 1)), parameter "completeness_perc" of Double,
+           parameter "contamination_perc" of Double, parameter
            "output_filtered_binnedcontigs_obj_name" of String
         :returns: instance of type "CheckMLineageWf_withFilter_Result" ->
            structure: parameter "report_name" of String, parameter
@@ -2,8 +2,14 @@
 #BEGIN_HEADER
 import os
 import json
+import uuid
 from kb_Msuite.Utils.CheckMUtil import CheckMUtil
+from kb_Msuite.Utils.MethodProfiler import MethodProfiler
 from kb_Msuite.Utils.simple_run_checkm import run_checkm
+from kb_Msuite.Utils.PooledBaseClient import install as install_pooled_base_client
+
+# the installed clients call other services on pooled, kept alive connections
+install_pooled_base_client()
 #END_HEADER
 
 
@@ -36,6 +42,10 @@ Parks DH, Imelfort M, Skennerton CT, Hugenholtz P, Tyson GW. 2015. CheckM: asses
     GIT_COMMIT_HASH = "d0b7da86da423aa43bb33139d35cff996de19e4f"
 
     #BEGIN_CLASS_HEADER
+    def _profile_dir(self, method_name):
+        ''' where a MethodProfiler writes if the method has no output package for it '''
+        return os.path.join(self.config['scratch'],
+                            'profile_' + method_name + '_' + str(uuid.uuid4()))
     #END_CLASS_HEADER
 
     # config contains contents of config file in a hash or None if it couldn't
@@ -88,8 +98,13 @@ Parks DH, Imelfort M, Skennerton CT, Hugenholtz P, Tyson GW. 2015. CheckM: asses
             raise ValueError('"subcommand" parameter field must be specified ' +
                              '(to one of lineage_wf, tetra, bin_qa_plot, dist_plot, etc)')
 
+        profiler = MethodProfiler.from_params('run_checkM', params)
         checkM_runner = CheckMUtil(self.config, ctx)
-        checkM_runner.run_checkM(params['subcommand'], params)
+        try:
+            checkM_runner.run_checkM(params['subcommand'], params)
+        finally:
+            if profiler:
+                profiler.finish(self._profile_dir('run_checkM'))
 
         #END run_checkM
         pass
@@ -98,13 +113,53 @@ Parks DH, Imelfort M, Skennerton CT, Hugenholtz P, Tyson GW. 2015. CheckM: asses
         """
         :param params: instance of type "CheckMLineageWfParams" (input_ref -
            reference to the input Assembly, AssemblySet, Genome, GenomeSet,
-           or BinnedContigs data) -> structure: parameter "input_ref" of
-           String, parameter "workspace_name" of String, parameter
-           "reduced_tree" of type "boolean" (A boolean - 0 for false, 1 for
-           true. @range (0, 1)), parameter "save_output_dir" of type
+           or BinnedContigs data summary_table_mode - how the HTML summary
+           table is written; one of html - every bin is written as a row of
+           the HTML table data - the bin stats are written to a data file and
+           rendered in the browser, with virtual scrolling, sorting and
+           filtering auto - (default) use 'data' for large numbers of bins,
+           otherwise 'html' optimize_plot_images - if set to 1 (the default),
+           the dist plots in the HTML report are recompressed and thumbnails
+           are added to the summary table plot_image_byte_budget - optional
+           cap, in bytes, on the total size of the plot images in the HTML
+           report; full size images are scaled down (or dropped) to fit
+           dist_plot_mode - how the per-bin distribution plots are made; one
+           of image - (default) rendered as PNG images by checkm dist_plot
+           interactive - the per-contig GC, coding density and
+           tetranucleotide distance data is written out and the plots are
+           drawn in the browser native - rendered as PNG images in parallel
+           by the module itself, which is much faster than checkm dist_plot
+           for large numbers of bins plot_policy - which bins get a
+           distribution plot; bins that are skipped are shown as 'not
+           plotted' in the summary table.  One of all - (default) every bin
+           retained - only the bins that pass the QC filters (with
+           output_filtered_binnedcontigs_obj_name set; otherwise every bin)
+           flagged - only bins with contamination above
+           plot_contamination_perc (default 10) or, if set, completeness
+           below plot_completeness_perc top_n - the plot_top_n (default 100)
+           largest bins by genome size isolate_failed_bins - if set to 1 (the
+           default) and lineage_wf fails, the bins are split up to find the
+           ones it fails on; the others are completed and the failed bins are
+           listed as errors in the summary table profile - if set to 1, the
+           run is profiled with cProfile and tracemalloc and the results are
+           added to the report as profile.zip (also enabled by setting the
+           KB_MSUITE_PROFILE environment variable)) -> structure: parameter
+           "dir_name" of String, parameter "input_ref" of String, parameter
+           "workspace_name" of String, parameter "reduced_tree" of type
            "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1)),
-           parameter "save_plots_dir" of type "boolean" (A boolean - 0 for
-           false, 1 for true. @range (0, 1)), parameter "threads" of Long
+           parameter "save_output_dir" of type "boolean" (A boolean - 0 for
+           false, 1 for true. @range (0, 1)), parameter "save_plots_dir" of
+           type "boolean" (A boolean - 0 for false, 1 for true. @range (0,
+           1)), parameter "threads" of Long, parameter "summary_table_mode"
+           of String, parameter "optimize_plot_images" of type "boolean" (A
+           boolean - 0 for false, 1 for true. @range (0, 1)), parameter
+           "plot_image_byte_budget" of Long, parameter "dist_plot_mode" of
+           String, parameter "plot_policy" of String, parameter
+           "plot_contamination_perc" of Double, parameter
+           "plot_completeness_perc" of Double, parameter "plot_top_n" of
+           Long, parameter "isolate_failed_bins" of type "boolean" (A boolean
+           - 0 for false, 1 for true. @range (0, 1)), parameter "profile" of
+           type "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1))
         :returns: instance of type "CheckMLineageWfResult" -> structure:
            parameter "report_name" of String, parameter "report_ref" of String
         """
@@ -114,8 +169,14 @@ Parks DH, Imelfort M, Skennerton CT, Hugenholtz P, Tyson GW. 2015. CheckM: asses
         print('--->\nRunning kb_Msuite.run_checkM_lineage_wf\nparams:')
         print(json.dumps(params, indent=1))
 
+        profiler = MethodProfiler.from_params('run_checkM_lineage_wf', params)
         cmu = CheckMUtil(self.config, ctx)
-        result = cmu.run_checkM_lineage_wf(params)
+        try:
+            result = cmu.run_checkM_lineage_wf(params, profiler=profiler)
+        finally:
+            # the profile is in the report unless the run failed
+            if profiler:
+                profiler.finish(self._profile_dir('run_checkM_lineage_wf'))
 
         #END run_checkM_lineage_wf
 
@@ -129,15 +190,28 @@ Parks DH, Imelfort M, Skennerton CT, Hugenholtz P, Tyson GW. 2015. CheckM: asses
     def run_checkM_lineage_wf_withFilter(self, ctx, params):
         """
         :param params: instance of type "CheckMLineageWf_withFilter_Params"
-           (input_ref - reference to the input BinnedContigs data) ->
-           structure: parameter "input_ref" of String, parameter
-           "workspace_name" of String, parameter "reduced_tree" of type
+           (input_ref - reference to the input BinnedContigs data see
+           CheckMLineageWfParams for summary_table_mode,
+           optimize_plot_images, plot_image_byte_budget, dist_plot_mode, the
+           plot_policy options, isolate_failed_bins and profile) ->
+           structure: parameter "dir_name" of String, parameter "input_ref"
+           of String, parameter "workspace_name" of String, parameter
+           "reduced_tree" of type "boolean" (A boolean - 0 for false, 1 for
+           true. @range (0, 1)), parameter "save_output_dir" of type
            "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1)),
-           parameter "save_output_dir" of type "boolean" (A boolean - 0 for
-           false, 1 for true. @range (0, 1)), parameter "save_plots_dir" of
-           type "boolean" (A boolean - 0 for false, 1 for true. @range (0,
-           1)), parameter "threads" of Long, parameter "completeness_perc" of
-           Double, parameter "contamination_perc" of Double, parameter
+           parameter "save_plots_dir" of type "boolean" (A boolean - 0 for
+           false, 1 for true. @range (0, 1)), parameter "threads" of Long,
+           parameter "summary_table_mode" of String, parameter
+           "optimize_plot_images" of type "boolean" (A boolean - 0 for false,
+           1 for true. @range (0, 1)), parameter "plot_image_byte_budget" of
+           Long, parameter "dist_plot_mode" of String, parameter
+           "plot_policy" of String, parameter "plot_contamination_perc" of
+           Double, parameter "plot_completeness_perc" of Double, parameter
+           "plot_top_n" of Long, parameter "isolate_failed_bins" of type
+           "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1)),
+           parameter "profile" of type "boolean" (A boolean - 0 for false, 1
+           for true. @range (0, 1)), parameter "completeness_perc" of Double,
+           parameter "contamination_perc" of Double, parameter
            "output_filtered_binnedcontigs_obj_name" of String
         :returns: instance of type "CheckMLineageWf_withFilter_Result" ->
            structure: parameter "report_name" of String, parameter
@@ -150,8 +224,14 @@ Parks DH, Imelfort M, Skennerton CT, Hugenholtz P, Tyson GW. 2015. CheckM: asses
         print('--->\nRunning kb_Msuite.run_checkM_lineage_wf_withFilter\nparams:')
         print(json.dumps(params, indent=1))
 
+        profiler = MethodProfiler.from_params('run_checkM_lineage_wf_withFilter', params)
         cmu = CheckMUtil(self.config, ctx)
-        result = cmu.run_checkM_lineage_wf(params)
+        try:
+            result = cmu.run_checkM_lineage_wf(params, profiler=profiler)
+        finally:
+            # the profile is in the report unless the run failed
+            if profiler:
+                profiler.finish(self._profile_dir('run_checkM_lineage_wf_withFilter'))
 
         #END run_checkM_lineage_wf_withFilter
 
@@ -196,7 +276,12 @@ Parks DH, Imelfort M, Skennerton CT, Hugenholtz P, Tyson GW. 2015. CheckM: asses
         in_dir = params['input_dir']
         out_dir = params['output_dir']
         log_path = params['log_path']
-        run_checkm(in_dir, out_dir, log_path, params.get('options'))
+        profiler = MethodProfiler.from_params('lineage_wf', params)
+        try:
+            run_checkm(in_dir, out_dir, log_path, params.get('options'))
+        finally:
+            if profiler:
+                profiler.finish(self._profile_dir('lineage_wf'))
         result = {}
         #END lineage_wf
 
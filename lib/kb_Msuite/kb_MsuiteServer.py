@@ -1,11 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import copy
 import datetime
 import json
 import os
 import random as _random
 import sys
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from getopt import getopt, GetoptError
 from multiprocessing import Process
 from os import environ
@@ -18,6 +21,8 @@ from jsonrpcbase import ServerError as JSONServerError
 
 from biokbase import log
 from kb_Msuite.authclient import KBaseAuth as _KBaseAuth
+from kb_Msuite.Utils.LocalJobQueue import LocalJobQueue
+from kb_Msuite.Utils.SharedTokenCache import SharedTokenCache
 
 try:
     from ConfigParser import ConfigParser
@@ -69,6 +74,21 @@ class JSONObjectEncoder(json.JSONEncoder):
 
 class JSONRPCServiceCustom(JSONRPCService):
 
+    def __init__(self, batch_workers=1, batch_method_limits=None):
+        """
+        batch_workers -- the number of calls of a batch request that run at
+            once; with 1 (the default) they run one after the other
+        batch_method_limits -- optional dict of method name => the maximum
+            number of calls of that method that run at once, across batches
+        """
+        super(JSONRPCServiceCustom, self).__init__()
+        self.batch_workers = max(1, int(batch_workers or 1))
+        self._batch_pool = None
+        self._batch_pool_lock = threading.Lock()
+        self._method_semaphores = dict(
+            (name, threading.BoundedSemaphore(max(1, int(limit))))
+            for name, limit in (batch_method_limits or {}).items())
+
     def call(self, ctx, jsondata):
         """
         Calls jsonrpc service's method and returns its return value in a JSON
@@ -163,8 +183,15 @@ class JSONRPCServiceCustom(JSONRPCService):
                 self._fill_request(request_, rdata_)
                 requests.append(request_)
 
-            for request_ in requests:
-                respond = self._handle_request(ctx, request_)
+            if self.batch_workers > 1 and len(requests) > 1:
+                batch_responds = self._handle_batch_parallel(ctx, requests)
+            else:
+                batch_responds = [
+                    self._handle_request(self._batch_ctx(ctx, request_),
+                                         request_)
+                    for request_ in requests]
+
+            for respond in batch_responds:
                 # Don't respond to notifications
                 if respond is not None:
                     responds.append(respond)
@@ -178,6 +205,56 @@ class JSONRPCServiceCustom(JSONRPCService):
             # empty dict, list or wrong type
             raise InvalidRequestError
 
+    def _batch_ctx(self, ctx, request):
+        """A copy of the context for one call of a batch request."""
+        if not isinstance(request.get('method'), str) or \
+                '.' not in request['method']:
+            return ctx
+        request_ctx = copy.copy(ctx)
+        request_ctx['module'], request_ctx['method'] = \
+            request['method'].split('.', 1)
+        request_ctx['call_id'] = request['id']
+        request_ctx['provenance'] = [{'service': request_ctx['module'],
+                                      'method': request_ctx['method'],
+                                      'method_params': request['params']}]
+        return request_ctx
+
+    def _handle_limited_request(self, ctx, request):
+        """_handle_request, within the concurrency limit of the method."""
+        semaphore = self._method_semaphores.get(request['method'])
+        if semaphore is None:
+            return self._handle_request(ctx, request)
+        with semaphore:
+            return self._handle_request(ctx, request)
+
+    def _handle_batch_parallel(self, ctx, requests):
+        """
+        Handles the calls of a batch request at the same time on a pool of
+        batch_workers threads, and returns their responses in request order.
+        As when they run one after the other, if any call fails the error of
+        the first failed call (in request order) is raised, but only once
+        every call has finished.
+        """
+        with self._batch_pool_lock:
+            if self._batch_pool is None:
+                self._batch_pool = ThreadPoolExecutor(
+                    max_workers=self.batch_workers)
+        futures = [self._batch_pool.submit(self._handle_limited_request,
+                                           self._batch_ctx(ctx, request_),
+                                           request_)
+                   for request_ in requests]
+        responds = []
+        error = None
+        for future in futures:
+            try:
+                responds.append(future.result())
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+        return responds
+
     def _handle_request(self, ctx, request):
         """Handles given request and returns its response."""
         if 'types' in self.method_data[request['method']]:
@@ -318,6 +395,13 @@ class Application(object):
     # do some initialization and avoid regenerating stuff over
     # and over
 
+    # methods that can also be run as jobs: kb_Msuite._<method>_submit queues a call and
+    # returns a job ID, which kb_Msuite._check_job and kb_Msuite._get_job_result poll
+    ASYNC_METHODS = ['kb_Msuite.run_checkM',
+                     'kb_Msuite.run_checkM_lineage_wf',
+                     'kb_Msuite.run_checkM_lineage_wf_withFilter',
+                     'kb_Msuite.lineage_wf']
+
     def logcallback(self):
         self.serverlog.set_log_file(self.userlog.get_log_file())
 
@@ -336,7 +420,9 @@ class Application(object):
             submod, ip_address=True, authuser=True, module=True, method=True,
             call_id=True, logfile=self.userlog.get_log_file())
         self.serverlog.set_log_level(6)
-        self.rpc_service = JSONRPCServiceCustom()
+        self.rpc_service = JSONRPCServiceCustom(
+            batch_workers=config.get('batch_workers') if config else None,
+            batch_method_limits=self._batch_method_limits())
         self.method_authentication = dict()
         self.rpc_service.add(impl_kb_Msuite.run_checkM,
                              name='kb_Msuite.run_checkM',
@@ -357,8 +443,104 @@ class Application(object):
         self.rpc_service.add(impl_kb_Msuite.status,
                              name='kb_Msuite.status',
                              types=[dict])
+        # async jobs keep their state in scratch, so they need the config
+        self.job_queue = None
+        if config:
+            self.job_queue = LocalJobQueue(
+                config.get('async_job_dir') or os.path.join(config['scratch'], 'async_jobs'),
+                workers=config.get('async_job_workers') or 1)
+            for method_name in self.ASYNC_METHODS:
+                submit_name = 'kb_Msuite._' + method_name.split('.')[1] + '_submit'
+                self.rpc_service.add(self._submit_function(method_name),
+                                     name=submit_name,
+                                     types=[dict])
+                self.method_authentication[submit_name] = 'required'  # noqa
+            self.rpc_service.add(self._check_job,
+                                 name='kb_Msuite._check_job',
+                                 types=[str])
+            self.method_authentication['kb_Msuite._check_job'] = 'required'  # noqa
+            self.rpc_service.add(self._get_job_result,
+                                 name='kb_Msuite._get_job_result',
+                                 types=[str])
+            self.method_authentication['kb_Msuite._get_job_result'] = 'required'  # noqa
         authurl = config.get(AUTH) if config else None
+        # validated tokens are cached in a database shared by the server processes
+        token_cache = None
+        if config and str(config.get('shared_token_cache', 1)) == '1':
+            token_cache = config.get('token_cache_path')
+            if not token_cache and config.get('scratch'):
+                token_cache = os.path.join(config['scratch'], 'token_cache.sqlite')
         self.auth_client = _KBaseAuth(authurl)
+        if token_cache:
+            SharedTokenCache(token_cache).install(self.auth_client)
+
+    def _batch_method_limits(self):
+        """
+        The per-method limits on concurrent batch calls, from the
+        batch_method_limits config value, e.g.
+        "kb_Msuite.run_checkM=2, kb_Msuite.run_checkM_lineage_wf=1"
+        """
+        limits = dict()
+        limits_config = config.get('batch_method_limits') if config else None
+        for item in (limits_config or '').split(','):
+            if item.strip():
+                name, limit = item.split('=')
+                limits[name.strip()] = int(limit)
+        return limits
+
+    def _auth_requirement(self, method_names):
+        """
+        The authentication requirement of a call of the given methods (one,
+        or several for a batch request): the strictest of theirs.
+        """
+        auth_reqs = [self.method_authentication.get(method_name, 'none')
+                     for method_name in method_names]
+        for auth_req in ['required', 'optional']:
+            if auth_req in auth_reqs:
+                return auth_req
+        return 'none'
+
+    def _submit_function(self, method_name):
+        """
+        Returns a JSON-RPC method that queues a call to method_name as a job and returns
+        the job ID.  The job runs with a copy of the submitting call's context.
+        """
+        method = self.rpc_service.method_data[method_name]['method']
+
+        def submit(ctx, params):
+            job_ctx = MethodContext(self.userlog)
+            job_ctx.update(ctx)
+            job_ctx['method'] = method_name.split('.')[1]
+            job_ctx['provenance'] = [{'service': job_ctx['module'],
+                                      'method': job_ctx['method'],
+                                      'method_params': [params]}]
+            job_id = self.job_queue.submit(method_name,
+                                           lambda: method(job_ctx, params),
+                                           user_id=ctx.get('user_id'))
+            return [job_id]
+        return submit
+
+    def _check_job(self, ctx, job_id):
+        """
+        The state of a job: status (queued, running, completed or error), finished (0 or
+        1), the submitted, started and completed times, and the result or error.
+        """
+        return [self.job_queue.check(job_id, ctx.get('user_id'))]
+
+    def _get_job_result(self, ctx, job_id):
+        """
+        The result of a completed job, as the method would have returned it; raises the
+        job's error if it failed.
+        """
+        job = self.job_queue.check(job_id, ctx.get('user_id'))
+        if job['status'] == 'error':
+            err = JSONServerError()
+            err.data = job['error']['message']
+            err.trace = job['error']['error']
+            raise err
+        if not job['finished']:
+            raise ValueError('Job ' + job['job_id'] + ' is ' + job['status'])
+        return job['result']
 
     def __call__(self, environ, start_response):
         # Context object, equivalent to the perl impl CallContext
@@ -386,25 +568,27 @@ class Application(object):
                        }
                 rpc_result = self.process_error(err, ctx, {'version': '1.1'})
             else:
-                ctx['module'], ctx['method'] = req['method'].split('.')
-                ctx['call_id'] = req['id']
+                # a batch request is authenticated and logged as its first
+                # call; each call gets its own context (see call_py)
+                calls = req if isinstance(req, list) and req else [req]
+                ctx['module'], ctx['method'] = calls[0]['method'].split('.')
+                ctx['call_id'] = calls[0]['id']
                 ctx['rpc_context'] = {
                     'call_stack': [{'time': self.now_in_utc(),
-                                    'method': req['method']}
+                                    'method': calls[0]['method']}
                                    ]
                 }
                 prov_action = {'service': ctx['module'],
                                'method': ctx['method'],
-                               'method_params': req['params']
+                               'method_params': calls[0]['params']
                                }
                 ctx['provenance'] = [prov_action]
                 try:
                     token = environ.get('HTTP_AUTHORIZATION')
-                    # parse out the method being requested and check if it
-                    # has an authentication requirement
-                    method_name = req['method']
-                    auth_req = self.method_authentication.get(
-                        method_name, 'none')
+                    # parse out the methods being requested and check if they
+                    # have an authentication requirement
+                    auth_req = self._auth_requirement(
+                        [call.get('method') for call in calls])
                     if auth_req != 'none':
                         if token is None and auth_req == 'required':
                             err = JSONServerError()
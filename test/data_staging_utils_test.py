@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from kb_Msuite.Utils.DataStagingUtils import DataStagingUtils
+
+
+def object_info(type_name, meta=None):
+    return [1, 'input', type_name + '-1.0', '', 1, 'user', 2, 'ws', '', 100, meta]
+
+
+class EstimateStagedSizeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dsu = DataStagingUtils({'scratch': self.tmp_dir,
+                                     'workspace-url': 'http://localhost',
+                                     'srv-wiz-url': 'http://localhost',
+                                     'SDK_CALLBACK_URL': 'http://localhost'}, {})
+        patcher = mock.patch('kb_Msuite.Utils.DataStagingUtils.Workspace')
+        self.ws = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def estimate(self, info):
+        self.ws.get_object_info3.return_value = {'infos': [info]}
+        return self.dsu.estimate_staged_size('2/1/1')
+
+    def test_assembly(self):
+        # the bins and the file of all sequences
+        self.assertEqual(self.estimate(object_info('KBaseGenomeAnnotations.Assembly',
+                                                   {'Size': '1000'})), 2200)
+        self.assertEqual(self.estimate(object_info('KBaseGenomes.Genome', {'Size': '10'})), 22)
+        self.assertIsNone(self.estimate(object_info('KBaseGenomeAnnotations.Assembly', {})))
+        self.assertIsNone(self.estimate(object_info('KBaseGenomeAnnotations.Assembly')))
+
+    def test_binned_contigs(self):
+        self.ws.get_objects2.return_value = {'data': [{'data': {'bins': [
+            {'sum_contig_len': 600}, {'sum_contig_len': 400}]}}]}
+        self.assertEqual(self.estimate(object_info('KBaseMetagenomes.BinnedContigs')), 2200)
+        request = self.ws.get_objects2.call_args[0][0]
+        # only the bin lengths are fetched
+        self.assertEqual(request['objects'][0]['included'], ['/bins/[*]/sum_contig_len'])
+
+    def test_unknown(self):
+        self.assertIsNone(self.estimate(object_info('KBaseSets.AssemblySet')))
+        self.assertIsNone(self.estimate(object_info('KBaseSearch.GenomeSet')))
+
+
+if __name__ == '__main__':
+    unittest.main()
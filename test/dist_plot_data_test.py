@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from kb_Msuite.Utils.DistPlotData import DistPlotData
+from kb_Msuite.Utils.DistPlotRenderer import DistPlotRenderer
+
+PERCENTILES = [1.0, 2.5, 5.0, 95.0, 97.5, 99.0]
+
+
+def gc_table(mean, spread):
+    ''' a CheckM-shaped table for one mean: window size => percentile => fraction '''
+    table = dict()
+    for window_size in [5000, 10000, 20000]:
+        width = spread * 5000.0 / window_size
+        table[window_size] = {p: mean + width * (p - 50.0) / 50.0 for p in PERCENTILES}
+    return table
+
+
+# the shape of CheckM's distributions/*.txt: GC and coding density keyed by the genome mean
+# as a fraction, tetra distance keyed by window size only, all values fractions or distances
+CHECKM_DISTRIBUTIONS = {
+    'gc_dist': {0.3: gc_table(0.0, 0.1), 0.5: gc_table(0.0, 0.2), 0.7: gc_table(0.0, 0.3)},
+    'cd_dist': {0.8: gc_table(0.0, 0.05), 0.9: gc_table(0.0, 0.04)},
+    'td_dist': {5000: {95.0: 0.3, 99.0: 0.4},
+                10000: {95.0: 0.2, 99.0: 0.3},
+                20000: {95.0: 0.1, 99.0: 0.2}},
+}
+
+
+class DistPlotDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.bin_folder = os.path.join(self.tmp_dir, 'bins')
+        self.out_folder = os.path.join(self.tmp_dir, 'output')
+        os.makedirs(self.bin_folder)
+        os.makedirs(os.path.join(self.out_folder, 'bins', 'bin.001'))
+        self.tetra_file = os.path.join(self.tmp_dir, 'tetra.tsv')
+        # 50% GC, with genes covering 90% of each contig
+        with open(os.path.join(self.bin_folder, 'bin.001.fna'), 'w') as fasta_handle, \
+                open(os.path.join(self.out_folder, 'bins', 'bin.001', 'genes.gff'),
+                     'w') as gff_handle, \
+                open(self.tetra_file, 'w') as tetra_handle:
+            for c in range(3):
+                contig_id = 'contig_' + str(c)
+                fasta_handle.write('>' + contig_id + '\n' + 'ACGT' * 2500 + '\n')
+                gff_handle.write('\t'.join([contig_id, 'Prodigal', 'CDS', '1', '9000', '.',
+                                            '+', '0', '.']) + '\n')
+                tetra_handle.write(contig_id + '\t0.{0}\t0.5\n'.format(c))
+        self._reference_cache = DistPlotData._reference_cache
+        DistPlotData._reference_cache = CHECKM_DISTRIBUTIONS
+        self.dist_data = DistPlotData(self.bin_folder, self.out_folder, self.tetra_file,
+                                      'fna')
+
+    def tearDown(self):
+        DistPlotData._reference_cache = self._reference_cache
+        shutil.rmtree(self.tmp_dir)
+
+    def test_gc_bounds(self):
+        # a mean of 52% GC is read from the 0.5 table, between its 2.5 and 97.5 percentiles
+        curve = self.dist_data.reference_bounds('gc_dist', 52.0)
+        self.assertEqual([row[0] for row in curve], [5000.0, 10000.0, 20000.0])
+        self.assertAlmostEqual(curve[0][1], -19.0)
+        self.assertAlmostEqual(curve[0][2], 19.0)
+        self.assertAlmostEqual(curve[2][1], -4.75)
+        self.assertAlmostEqual(curve[2][2], 4.75)
+
+    def test_gc_bounds_nearest_mean(self):
+        low = self.dist_data.reference_bounds('gc_dist', 20.0)
+        high = self.dist_data.reference_bounds('gc_dist', 75.0)
+        self.assertAlmostEqual(low[0][2], 9.5)
+        self.assertAlmostEqual(high[0][2], 28.5)
+
+    def test_dist_value(self):
+        dist_data = DistPlotData(self.bin_folder, self.out_folder, self.tetra_file, 'fna',
+                                 dist_value=98)
+        curve = dist_data.reference_bounds('gc_dist', 50.0)
+        # the 1st and 99th percentiles
+        self.assertAlmostEqual(curve[0][1], -19.6)
+        self.assertAlmostEqual(curve[0][2], 19.6)
+        self.assertEqual(dist_data.reference_bounds('td_dist')[0], [5000.0, None, 0.4])
+
+    def test_td_bounds(self):
+        self.assertEqual(self.dist_data.reference_bounds('td_dist'),
+                         [[5000.0, None, 0.3], [10000.0, None, 0.2], [20000.0, None, 0.1]])
+
+    def test_no_mean(self):
+        self.assertEqual(self.dist_data.reference_bounds('cd_dist'), [])
+
+    def test_bin_data(self):
+        data = self.dist_data.bin_data('bin.001', os.path.join(self.bin_folder, 'bin.001.fna'))
+        self.assertEqual(data['mean_gc'], 50.0)
+        self.assertEqual(data['mean_cd'], 90.0)
+        self.assertEqual(data['delta_gc'], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(data['reference']['gc'][0][2], 19.0)
+        self.assertAlmostEqual(data['reference']['cd'][0][2], 3.8)
+        self.assertEqual(data['reference']['td'][0], [5000.0, None, 0.3])
+
+    def test_render(self):
+        plots_folder = os.path.join(self.tmp_dir, 'plots')
+        written = DistPlotRenderer(self.dist_data).render(plots_folder)
+        self.assertEqual(written, [os.path.join(plots_folder,
+                                                'bin.001' + DistPlotRenderer.PLOT_EXT)])
+
+
+if __name__ == '__main__':
+    unittest.main()
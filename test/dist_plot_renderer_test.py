@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+
+from kb_Msuite.Utils.DistPlotData import DistPlotData
+from kb_Msuite.Utils.DistPlotRenderer import DistPlotRenderer
+
+PNG_MAGIC = b'\x89PNG'
+
+
+class DistPlotRendererTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.bin_folder = os.path.join(self.tmp_dir, 'bins')
+        self.out_folder = os.path.join(self.tmp_dir, 'output')
+        self.plots_folder = os.path.join(self.tmp_dir, 'plots')
+        os.makedirs(self.bin_folder)
+        os.makedirs(self.out_folder)
+        tetra_file = os.path.join(self.tmp_dir, 'tetra.tsv')
+        with open(tetra_file, 'w') as tetra_handle:
+            tetra_handle.write('Sequence Id\tAAAA\tAAAC\n')
+            for n in range(4):
+                with open(os.path.join(self.bin_folder, 'bin.00' + str(n) + '.fasta'),
+                          'w') as fasta_handle:
+                    for c in range(5):
+                        contig_id = 'contig_' + str(n) + '_' + str(c)
+                        fasta_handle.write('>' + contig_id + '\n')
+                        fasta_handle.write('ACGT' * (50 * (c + 1)) + 'GG' * c + '\n')
+                        tetra_handle.write(contig_id + '\t0.{0}\t0.{1}\n'.format(c, n))
+        self.dist_data = DistPlotData(self.bin_folder, self.out_folder, tetra_file, 'fasta')
+        self._reference_cache = DistPlotData._reference_cache
+        DistPlotData._reference_cache = dict()
+
+    def tearDown(self):
+        DistPlotData._reference_cache = self._reference_cache
+        shutil.rmtree(self.tmp_dir)
+
+    def assertPlots(self, written, bin_ids):
+        self.assertEqual(sorted(written),
+                         sorted(os.path.join(self.plots_folder, bin_id + DistPlotRenderer.PLOT_EXT)
+                                for bin_id in bin_ids))
+        for path in written:
+            with open(path, 'rb') as plot_handle:
+                self.assertEqual(plot_handle.read(4), PNG_MAGIC)
+
+    def test_render_one_worker(self):
+        written = DistPlotRenderer(self.dist_data).render(self.plots_folder)
+        self.assertPlots(written, ['bin.000', 'bin.001', 'bin.002', 'bin.003'])
+
+    def test_render_bin_ids(self):
+        written = DistPlotRenderer(self.dist_data).render(self.plots_folder,
+                                                          bin_ids=['bin.002'])
+        self.assertPlots(written, ['bin.002'])
+
+    def test_render_workers_from_thread(self):
+        # the pipeline renders from a stage thread, alongside other stages
+        results = dict()
+
+        def render():
+            results['written'] = DistPlotRenderer(self.dist_data, workers=2).render(
+                self.plots_folder)
+
+        thread = threading.Thread(target=render)
+        thread.start()
+        thread.join()
+        self.assertPlots(results['written'], ['bin.000', 'bin.001', 'bin.002', 'bin.003'])
+
+
+if __name__ == '__main__':
+    unittest.main()
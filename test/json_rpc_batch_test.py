@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+import threading
+
+from jsonrpcbase import ServerError as JSONServerError
+
+from kb_Msuite.kb_MsuiteServer import JSONRPCServiceCustom
+
+
+class JSONRPCBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = dict()
+        self.peak = dict()
+
+    def service(self, batch_workers, batch_method_limits=None):
+        service = JSONRPCServiceCustom(batch_workers=batch_workers,
+                                       batch_method_limits=batch_method_limits)
+        service.add(self.method('slow', 0.3), name='kb_Msuite.slow')
+        service.add(self.method('limited', 0.2), name='kb_Msuite.limited')
+        return service
+
+    def method(self, name, delay):
+        def run(ctx, params):
+            with self.lock:
+                self.running[name] = self.running.get(name, 0) + 1
+                self.peak[name] = max(self.peak.get(name, 0), self.running[name])
+            time.sleep(delay)
+            with self.lock:
+                self.running[name] -= 1
+            if params.get('fail'):
+                raise ValueError('call ' + str(params['i']) + ' failed')
+            return [{'i': params['i'], 'method': ctx['method'], 'call_id': ctx['call_id']}]
+        return run
+
+    def batch(self, method, n, failed=()):
+        return [{'method': 'kb_Msuite.' + method, 'params': [{'i': i, 'fail': i in failed}],
+                 'version': '1.1', 'id': str(i)} for i in range(n)]
+
+    def ctx(self):
+        return {'module': 'kb_Msuite', 'method': 'batch', 'call_id': 'batch'}
+
+    def test_parallel(self):
+        start = time.time()
+        responds = self.service(4).call_py(self.ctx(), self.batch('slow', 4))
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(self.peak['slow'], 4)
+        # in request order, each with a context of its own
+        self.assertEqual([r['id'] for r in responds], ['0', '1', '2', '3'])
+        self.assertEqual([r['result'][0]['i'] for r in responds], [0, 1, 2, 3])
+        self.assertEqual(set(r['result'][0]['method'] for r in responds), set(['slow']))
+        self.assertEqual([r['result'][0]['call_id'] for r in responds], ['0', '1', '2', '3'])
+
+    def test_sequential(self):
+        responds = self.service(1).call_py(self.ctx(), self.batch('slow', 3))
+        self.assertEqual(self.peak['slow'], 1)
+        self.assertEqual([r['result'][0]['i'] for r in responds], [0, 1, 2])
+
+    def test_method_limit(self):
+        service = self.service(4, {'kb_Msuite.limited': 1})
+        responds = service.call_py(self.ctx(), self.batch('limited', 3) + self.batch('slow', 2))
+        self.assertEqual(len(responds), 5)
+        self.assertEqual(self.peak['limited'], 1)
+
+    def test_first_error(self):
+        service = self.service(4)
+        with self.assertRaises(JSONServerError) as cm:
+            service.call_py(self.ctx(), self.batch('slow', 4, failed=(1, 2)))
+        self.assertIn('call 1 failed', cm.exception.data)
+        # every call had finished
+        self.assertEqual(self.running['slow'], 0)
+
+    def test_single_request(self):
+        respond = self.service(4).call_py(self.ctx(), self.batch('slow', 1)[0])
+        self.assertEqual(respond['result'][0]['i'], 0)
+        # a single request keeps the context it came with
+        self.assertEqual(respond['result'][0]['call_id'], 'batch')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from kb_Msuite.Utils.CheckMUtil import CheckMUtil
+from kb_Msuite.Utils.OutputBuilder import read_failed_bins
+from kb_Msuite.Utils.ProcessWatchdog import CheckMProcessError
+
+
+class LineageWfBisectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cmu = CheckMUtil({'SDK_CALLBACK_URL': 'http://localhost',
+                               'scratch': self.tmp_dir,
+                               'threads': 1}, {})
+        self.bin_folder = os.path.join(self.tmp_dir, 'bins')
+        self.out_folder = os.path.join(self.tmp_dir, 'output')
+        os.makedirs(self.bin_folder)
+        self.bin_ids = ['bin.00' + str(n) for n in range(1, 6)]
+        for bin_id in self.bin_ids:
+            with open(os.path.join(self.bin_folder, bin_id + '.fna'), 'w') as bin_handle:
+                bin_handle.write('>contig\nACGT\n')
+        self.calls = []
+        self.bad_bins = set()
+        # 'full' to run out of memory with the full reference tree, 'always' with either
+        self.oom = None
+        self.cmu.run_checkM = self.run_checkM
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_checkM(self, subcommand, options, dropOutput=False):
+        ''' a lineage_wf that fails on the bad bins, and runs out of memory as set by self.oom '''
+        bin_ids = self.cmu._bin_ids_in_folder(options['bin_folder'])
+        reduced_tree = str(options.get('reduced_tree')) == '1'
+        self.calls.append((bin_ids, reduced_tree))
+        if self.oom == 'always' or (self.oom == 'full' and not reduced_tree):
+            raise CheckMProcessError('killed', exit_code=-9, oom=True)
+        if self.bad_bins.intersection(bin_ids):
+            raise ValueError('Error running lineage_wf\nbad bin')
+        storage = os.path.join(options['out_folder'], 'storage')
+        os.makedirs(storage)
+        with open(os.path.join(storage, 'bin_stats_ext.tsv'), 'w') as stats_handle:
+            for bin_id in bin_ids:
+                os.makedirs(os.path.join(options['out_folder'], 'bins', bin_id))
+                stats_handle.write(bin_id + '\t{}\n')
+
+    def options(self, **options):
+        return dict(options, bin_folder=self.bin_folder, out_folder=self.out_folder)
+
+    def stats_bins(self):
+        with open(os.path.join(self.out_folder, 'storage', 'bin_stats_ext.tsv')) as stats_handle:
+            return sorted(line.split('\t')[0] for line in stats_handle)
+
+    def test_success(self):
+        self.assertEqual(self.cmu._run_lineage_wf(self.options()), {})
+        self.assertEqual(self.calls, [(self.bin_ids, False)])
+
+    def test_oom_reduced_tree(self):
+        self.oom = 'full'
+        self.assertEqual(self.cmu._run_lineage_wf(self.options()), {})
+        self.assertEqual(self.calls, [(self.bin_ids, False), (self.bin_ids, True)])
+
+    def test_oom_with_reduced_tree(self):
+        # already on the reduced tree, so there's nothing to fall back to
+        self.oom = 'always'
+        with self.assertRaises(CheckMProcessError):
+            self.cmu._run_lineage_wf(self.options(reduced_tree=1))
+        self.assertEqual(self.calls, [(self.bin_ids, True)])
+
+    def test_oom_not_bisected(self):
+        # fewer bins at a time would run out of memory too
+        self.oom = 'always'
+        with self.assertRaises(CheckMProcessError) as cm:
+            self.cmu._run_lineage_wf(self.options())
+        self.assertTrue(cm.exception.oom)
+        self.assertEqual(self.calls, [(self.bin_ids, False), (self.bin_ids, True)])
+
+    def test_bisect(self):
+        self.bad_bins = set(['bin.002', 'bin.005'])
+        failed_bins = self.cmu._run_lineage_wf(self.options())
+        self.assertEqual(sorted(failed_bins.keys()), ['bin.002', 'bin.005'])
+        self.assertIn('bad bin', failed_bins['bin.002'])
+        self.assertEqual(read_failed_bins(self.out_folder), failed_bins)
+        # the outputs of the subsets that passed are merged
+        self.assertEqual(self.stats_bins(), ['bin.001', 'bin.003', 'bin.004'])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.out_folder, 'bins'))),
+                         ['bin.001', 'bin.003', 'bin.004'])
+        self.assertFalse(os.path.exists(self.out_folder + '_bisect'))
+        # every bin was run, alone or with others, on its last attempt
+        last_runs = [ids for ids, _ in self.calls if len(ids) == 1 or
+                     not self.bad_bins.intersection(ids)]
+        self.assertEqual(sorted(b for ids in last_runs for b in ids), self.bin_ids)
+
+    def test_bisect_after_oom(self):
+        self.oom = 'full'
+        self.bad_bins = set(['bin.003'])
+        failed_bins = self.cmu._run_lineage_wf(self.options())
+        self.assertEqual(list(failed_bins.keys()), ['bin.003'])
+        # the subsets run on the reduced tree too
+        self.assertTrue(all(reduced_tree for _, reduced_tree in self.calls[1:]))
+
+    def test_all_bins_fail(self):
+        self.bad_bins = set(self.bin_ids)
+        with self.assertRaises(ValueError) as cm:
+            self.cmu._run_lineage_wf(self.options())
+        self.assertIn('bad bin', str(cm.exception))
+        self.assertEqual(read_failed_bins(self.out_folder), {})
+
+    def test_no_isolation(self):
+        self.bad_bins = set(['bin.001'])
+        with self.assertRaises(ValueError):
+            self.cmu._run_lineage_wf(self.options(), isolate_failed_bins=False)
+        self.assertEqual(len(self.calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
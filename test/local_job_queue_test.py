@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import uuid
+import shutil
+import tempfile
+import unittest
+import threading
+import subprocess
+
+from kb_Msuite.Utils.LocalJobQueue import LocalJobQueue
+
+
+def dead_pid():
+    ''' the pid of a process that has exited '''
+    p = subprocess.Popen(['true'])
+    p.wait()
+    return p.pid
+
+
+class LocalJobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.queue = LocalJobQueue(self.state_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def wait_for(self, job_id, timeout=10):
+        end = time.time() + timeout
+        while time.time() < end:
+            job = self.queue.check(job_id)
+            if job['finished']:
+                return job
+            time.sleep(0.05)
+        self.fail('job ' + job_id + ' did not finish')
+
+    def write_job(self, **fields):
+        job = {'job_id': str(uuid.uuid4()), 'method': 'kb_Msuite.run_checkM',
+               'user_id': 'user', 'status': 'running', 'submitted': time.time(),
+               'started': time.time(), 'completed': None, 'pid': os.getpid(),
+               'host': self.queue.host, 'result': None, 'error': None}
+        job.update(fields)
+        self.queue._write_state(job)
+        return job['job_id']
+
+    def test_completed(self):
+        job_id = self.queue.submit('kb_Msuite.run_checkM', lambda: [{'report': 'x'}],
+                                   user_id='user')
+        job = self.wait_for(job_id)
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(job['result'], [{'report': 'x'}])
+        self.assertIsNone(job['error'])
+
+    def test_error(self):
+        def fail():
+            raise ValueError('bad input')
+        job = self.wait_for(self.queue.submit('kb_Msuite.run_checkM', fail))
+        self.assertEqual(job['status'], 'error')
+        self.assertEqual(job['error']['message'], 'bad input')
+        self.assertIn('ValueError', job['error']['error'])
+
+    def test_unserializable_result(self):
+        job = self.wait_for(self.queue.submit('kb_Msuite.run_checkM', lambda: object()))
+        self.assertEqual(job['status'], 'error')
+        self.assertIsNone(job['result'])
+
+    def test_running(self):
+        release = threading.Event()
+        job_id = self.queue.submit('kb_Msuite.run_checkM', lambda: release.wait(10))
+        try:
+            end = time.time() + 10
+            while self.queue.check(job_id)['status'] != 'running' and time.time() < end:
+                time.sleep(0.05)
+            job = self.queue.check(job_id)
+            self.assertEqual(job['status'], 'running')
+            self.assertEqual(job['finished'], 0)
+        finally:
+            release.set()
+        self.assertEqual(self.wait_for(job_id)['result'], True)
+
+    def test_other_user(self):
+        job_id = self.write_job(status='completed', user_id='user')
+        self.assertEqual(self.queue.check(job_id, 'user')['finished'], 1)
+        with self.assertRaises(ValueError):
+            self.queue.check(job_id, 'other_user')
+
+    def test_invalid_job_id(self):
+        with self.assertRaises(ValueError):
+            self.queue.check('../../etc/passwd')
+        with self.assertRaises(ValueError):
+            self.queue.check(str(uuid.uuid4()))
+
+    def test_check_orphaned(self):
+        # a job whose server process exited after the queue was created
+        job_id = self.write_job(pid=dead_pid())
+        job = self.queue.check(job_id)
+        self.assertEqual(job['status'], 'error')
+        self.assertEqual(job['finished'], 1)
+        self.assertEqual(job['error']['name'], 'Job interrupted')
+        self.assertEqual(LocalJobQueue(self.state_dir).check(job_id)['status'], 'error')
+
+    def test_check_other_host(self):
+        job_id = self.write_job(pid=dead_pid(), host='another-host')
+        self.assertEqual(self.queue.check(job_id)['status'], 'running')
+
+    def test_recover(self):
+        orphaned_id = self.write_job(pid=dead_pid())
+        running_id = self.write_job()
+        old_id = self.write_job(status='completed', completed=time.time() - 8 * 86400)
+        LocalJobQueue(self.state_dir)
+        with open(self.queue._state_path(orphaned_id)) as state_handle:
+            self.assertEqual(json.load(state_handle)['status'], 'error')
+        self.assertEqual(self.queue.check(running_id)['status'], 'running')
+        self.assertFalse(os.path.exists(self.queue._state_path(old_id)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+from unittest import mock
+
+from kb_Msuite.Utils.MethodProfiler import MethodProfiler
+
+
+def profiled_work():
+    return sum(len(str(n)) for n in range(20000))
+
+
+class MethodProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_not_requested(self):
+        with mock.patch.dict(os.environ, {MethodProfiler.ENV_VAR: ''}):
+            self.assertIsNone(MethodProfiler.from_params('run_checkM', {}))
+            self.assertIsNone(MethodProfiler.from_params('run_checkM', {'profile': 0}))
+
+    def test_env_var(self):
+        with mock.patch.dict(os.environ, {MethodProfiler.ENV_VAR: 'lineage_wf, run_checkM'}):
+            profiler = MethodProfiler.from_params('run_checkM', {})
+            self.assertIsNotNone(profiler)
+            profiler.stop()
+            self.assertIsNone(MethodProfiler.from_params('run_checkM_lineage_wf', {}))
+
+    def test_write(self):
+        profiler = MethodProfiler.from_params('run_checkM', {'profile': 1})
+        thread = threading.Thread(target=profiled_work)
+        thread.start()
+        thread.join()
+        written = profiler.write(self.tmp_dir)
+        self.assertEqual(sorted(os.path.basename(f) for f in written),
+                         ['run_checkM.allocations.txt', 'run_checkM.prof',
+                          'run_checkM.profile.txt'])
+        with open(os.path.join(self.tmp_dir, 'run_checkM.profile.txt')) as text_handle:
+            self.assertIn('profiled_work', text_handle.read())
+        # finish() does not write again
+        profiler.finish(os.path.join(self.tmp_dir, 'elsewhere'))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'elsewhere')))
+
+    def test_one_at_a_time(self):
+        first = MethodProfiler.from_params('run_checkM', {'profile': 1})
+        self.assertIsNotNone(first)
+        try:
+            # a call on another thread, while the first is being profiled, runs without
+            results = []
+            thread = threading.Thread(target=lambda: results.append(
+                MethodProfiler.from_params('lineage_wf', {'profile': 1})))
+            thread.start()
+            thread.join()
+            self.assertEqual(results, [None])
+        finally:
+            first.stop()
+        second = MethodProfiler.from_params('lineage_wf', {'profile': 1})
+        self.assertIsNotNone(second)
+        second.stop()
+        # stopping twice does not release the lock held by another profile
+        third = MethodProfiler.from_params('lineage_wf', {'profile': 1})
+        second.stop()
+        self.assertIsNone(MethodProfiler.from_params('lineage_wf', {'profile': 1}))
+        third.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+from unittest import mock
+from html.parser import HTMLParser
+from urllib.parse import quote, unquote
+
+from PIL import Image
+
+from kb_Msuite.Utils.OutputBuilder import OutputBuilder, write_failed_bins
+
+N_PLOTS = 4
+
+
+def write_bin_stats(output_dir, bin_ids):
+    storage_dir = os.path.join(output_dir, 'storage')
+    if not os.path.exists(storage_dir):
+        os.makedirs(storage_dir)
+    with open(os.path.join(storage_dir, 'bin_stats_ext.tsv'), 'w') as stats_handle:
+        for n, bin_id in enumerate(bin_ids):
+            stats_handle.write(bin_id + '\t' + str({'marker lineage': 'k__Bacteria',
+                                                    'Completeness': 90.0 + n % 10,
+                                                    'Contamination': 1.5,
+                                                    'Genome size': 1000 * (n + 1)}) + '\n')
+
+
+class OptimizePlotImagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.html_dir = os.path.join(self.tmp_dir, 'html')
+        os.makedirs(self.html_dir)
+        # noise, which compresses about as badly as a plot can
+        for n in range(N_PLOTS):
+            img = Image.frombytes('RGB', (600, 600), os.urandom(600 * 600 * 3))
+            img.save(os.path.join(self.html_dir, 'bin.00' + str(n) + '.ref_dist_plots.png'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def optimize(self, budget=None):
+        builder = OutputBuilder(self.tmp_dir, self.tmp_dir, self.tmp_dir, None,
+                                image_workers=2, image_byte_budget=budget)
+        return builder.optimize_plot_images(self.html_dir)
+
+    def files(self, ext):
+        return sorted(f for f in os.listdir(self.html_dir) if f.endswith(ext))
+
+    def test_no_budget(self):
+        stats = self.optimize()
+        self.assertEqual(stats['n_images'], N_PLOTS)
+        self.assertTrue(stats['within_budget'])
+        self.assertEqual(len(self.files(OutputBuilder.THUMB_EXT)), N_PLOTS)
+        with Image.open(os.path.join(self.html_dir, self.files(OutputBuilder.THUMB_EXT)[0])) \
+                as thumb:
+            self.assertLessEqual(thumb.width, OutputBuilder.THUMB_SIZE[0])
+            self.assertLessEqual(thumb.height, OutputBuilder.THUMB_SIZE[1])
+
+    def test_scaled_to_budget(self):
+        unbudgeted = self.optimize()
+        budget = (unbudgeted['image_bytes'] + unbudgeted['thumbnail_bytes']) // 2
+        stats = self.optimize(budget)
+        self.assertTrue(stats['within_budget'])
+        self.assertLessEqual(stats['image_bytes'] + stats['thumbnail_bytes'], budget)
+        self.assertEqual(len(self.files('.ref_dist_plots.png')), N_PLOTS)
+
+    def test_thumbnails_shrunk(self):
+        # the default size thumbnails alone are over the budget
+        thumb_bytes = self.optimize()['thumbnail_bytes']
+        budget = thumb_bytes // 2
+        stats = self.optimize(budget)
+        self.assertLess(stats['thumbnail_bytes'], budget)
+        self.assertLessEqual(stats['image_bytes'] + stats['thumbnail_bytes'], budget)
+        self.assertTrue(stats['within_budget'])
+        with Image.open(os.path.join(self.html_dir, self.files(OutputBuilder.THUMB_EXT)[0])) \
+                as thumb:
+            self.assertLess(thumb.width, OutputBuilder.THUMB_SIZE[0])
+
+    def test_budget_not_met(self):
+        stats = self.optimize(100)
+        self.assertFalse(stats['within_budget'])
+        self.assertEqual(stats['image_bytes'], 0)
+        self.assertEqual(self.files('.ref_dist_plots.png'), [])
+        self.assertEqual(len(self.files(OutputBuilder.THUMB_EXT)), N_PLOTS)
+
+
+class ReportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.tmp_dir, 'output')
+        self.plots_dir = os.path.join(self.tmp_dir, 'plot')
+        self.dist_plots_dir = os.path.join(self.plots_dir, 'dist')
+        self.html_dir = os.path.join(self.tmp_dir, 'html')
+        for folder in [self.dist_plots_dir, self.html_dir]:
+            os.makedirs(folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def builder(self, **kwargs):
+        return OutputBuilder(self.output_dir, self.plots_dir, self.tmp_dir, None,
+                             optimize_images=False, dist_plots_dir=self.dist_plots_dir,
+                             **kwargs)
+
+    def write_plot(self, folder, bin_id, ext='.ref_dist_plots.png'):
+        with open(os.path.join(folder, bin_id + ext), 'w') as plot_handle:
+            plot_handle.write('plot')
+
+    def read(self, filename):
+        with open(os.path.join(self.html_dir, filename)) as html_handle:
+            return html_handle.read()
+
+
+class HtmlReportTest(ReportTestCase):
+
+    def test_dist_plots_dir(self):
+        write_bin_stats(self.output_dir, ['bin.001', 'bin.002'])
+        self.write_plot(self.dist_plots_dir, 'bin.001')
+        # left in the plots dir by something else, e.g. an interactive run before
+        self.write_plot(self.plots_dir, 'bin.002', OutputBuilder.DIST_DATA_EXT)
+        self.builder().build_html_output_for_lineage_wf(self.html_dir, 'input')
+        self.assertTrue(os.path.isfile(os.path.join(self.html_dir,
+                                                    'bin.001.ref_dist_plots.png')))
+        self.assertFalse(os.path.exists(os.path.join(self.html_dir, 'bin.002' +
+                                                     OutputBuilder.DIST_DATA_EXT)))
+        # the image viewer, not the interactive one
+        self.assertIn('dist-plot', self.read(OutputBuilder.DIST_PLOT_VIEWER))
+        table = self.read('CheckM_Table.html')
+        self.assertIn('<a href="CheckM_Bin_Plot.html#bin.001">', table)
+        self.assertNotIn('#bin.002', table)
+
+
+class SummaryTableTest(ReportTestCase):
+
+    def bin_ids(self, n_bins):
+        return ['bin.' + str(n).zfill(4) for n in range(1, n_bins + 1)]
+
+    def summary_table(self, n_bins, **kwargs):
+        write_bin_stats(self.output_dir, self.bin_ids(n_bins))
+        html = io.StringIO()
+        self.builder(table_mode=kwargs.pop('table_mode', 'auto')).build_summary_table(
+            html, self.html_dir, **kwargs)
+        return html.getvalue()
+
+    def summary_data(self):
+        prefix = 'window.CHECKM_SUMMARY = '
+        data = self.read(OutputBuilder.SUMMARY_DATA_FILE)
+        self.assertTrue(data.startswith(prefix))
+        return json.loads(data[len(prefix):].rstrip().rstrip(';'))
+
+    def has_data_file(self):
+        return os.path.exists(os.path.join(self.html_dir, OutputBuilder.SUMMARY_DATA_FILE))
+
+    def test_auto_html(self):
+        html = self.summary_table(OutputBuilder.DATA_TABLE_MIN_BINS - 1)
+        self.assertFalse(self.has_data_file())
+        self.assertEqual(html.count('<tr>'), OutputBuilder.DATA_TABLE_MIN_BINS)
+        self.assertIn('<td>bin.0499</td>', html)
+
+    def test_auto_data(self):
+        html = self.summary_table(OutputBuilder.DATA_TABLE_MIN_BINS)
+        self.assertTrue(self.has_data_file())
+        # the table is rendered from the data file; the HTML does not grow with the bins
+        self.assertNotIn('bin.0001', html)
+        self.assertIn('<script src="' + OutputBuilder.SUMMARY_DATA_FILE + '"></script>', html)
+        self.assertEqual(len(self.summary_data()['rows']), OutputBuilder.DATA_TABLE_MIN_BINS)
+
+    def test_forced_mode(self):
+        self.summary_table(OutputBuilder.DATA_TABLE_MIN_BINS, table_mode='html')
+        self.assertFalse(self.has_data_file())
+        shutil.rmtree(self.output_dir)
+        self.summary_table(2, table_mode='data')
+        self.assertEqual(len(self.summary_data()['rows']), 2)
+
+    def test_data_table(self):
+        write_failed_bins(self.output_dir, {'bin.0005': 'pplacer failed'})
+        self.write_plot(self.html_dir, 'bin.0001')
+        self.write_plot(self.html_dir, 'bin.0002', OutputBuilder.THUMB_EXT)
+        self.summary_table(4, table_mode='data', removed_bins=['0003'],
+                           plotted_bins=set(['bin.0001', 'bin.0002', 'bin.0003']))
+        data = self.summary_data()
+        self.assertEqual(data['columns'], ['Bin Name'] + [f['display'] for f in
+                                                          OutputBuilder.SUMMARY_FIELDS])
+        self.assertTrue(data['thumbnails'])
+        self.assertTrue(data['plot_column'])
+        rows = dict((row[0], row) for row in data['rows'])
+        self.assertEqual(sorted(rows.keys()),
+                         ['bin.0001', 'bin.0002', 'bin.0003', 'bin.0004', 'bin.0005'])
+        # the flags: 1 removed, 2 dist plot, 4 thumbnail, 8 not plotted, 16 failed
+        self.assertEqual(dict((bid, row[-1]) for bid, row in rows.items()),
+                         {'bin.0001': 2, 'bin.0002': 2 | 4, 'bin.0003': 1,
+                          'bin.0004': 8, 'bin.0005': 8 | 16})
+        self.assertEqual(rows['bin.0001'][1], 'k__Bacteria')
+        completeness = data['columns'].index('Completeness')
+        self.assertEqual(rows['bin.0002'][completeness], 91.0)
+        self.assertIsNone(rows['bin.0002'][data['columns'].index('# Genomes')])
+        self.assertEqual(rows['bin.0005'][1], 'ERROR: pplacer failed')
+
+
+class LinkParser(HTMLParser):
+    ''' the links, with their text, and the image sources in a page '''
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = []
+        self.images = []
+        self._href = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'a':
+            self._href = attrs['href']
+            self.links.append([self._href, ''])
+        elif tag == 'img':
+            self.images.append(attrs['src'])
+
+    def handle_endtag(self, tag):
+        if tag == 'a':
+            self._href = None
+
+    def handle_data(self, data):
+        if self._href is not None:
+            self.links[-1][1] += data
+
+
+def encode_uri_component(value):
+    # as JavaScript's encodeURIComponent
+    return quote(value, safe="-_.!~*'()")
+
+
+class DistPlotViewerTest(ReportTestCase):
+
+    BIN_IDS = ['bin.001', 'bin 2', 'bin#3', 'bin%4', 'bin&<5>', "bin'6\"", 'bin+7?x=1']
+
+    def test_viewer(self):
+        write_bin_stats(self.output_dir, self.BIN_IDS)
+        for bin_id in self.BIN_IDS:
+            self.write_plot(self.dist_plots_dir, bin_id)
+        self.builder().build_html_output_for_lineage_wf(self.html_dir, 'input')
+        viewer = self.read(OutputBuilder.DIST_PLOT_VIEWER)
+        # the bin is taken from the fragment, and its image file requested encoded
+        self.assertIn('decodeURIComponent(window.location.hash.substring(1))', viewer)
+        self.assertIn("img.src = encodeURIComponent(binId) + '" + '.ref_dist_plots.png' + "'",
+                      viewer)
+        self.assertNotIn('DIST_PLOT_EXT', viewer)
+        self.assertNotIn('THUMB_EXT', viewer)
+
+        parser = LinkParser()
+        parser.feed(self.read('CheckM_Table.html'))
+        links = [link for link in parser.links
+                 if link[0].startswith(OutputBuilder.DIST_PLOT_VIEWER + '#')]
+        self.assertEqual(sorted(text for href, text in links), sorted(self.BIN_IDS))
+        for href, text in links:
+            fragment = href[len(OutputBuilder.DIST_PLOT_VIEWER) + 1:]
+            # the fragment is all of the bin ID, and decodes to it
+            self.assertNotIn('#', fragment)
+            self.assertEqual(unquote(fragment), text)
+            # the image the viewer then loads, as the web server decodes the URL
+            image = unquote(encode_uri_component(unquote(fragment)) + '.ref_dist_plots.png')
+            self.assertTrue(os.path.isfile(os.path.join(self.html_dir, image)), image)
+
+    def test_thumbnails(self):
+        write_bin_stats(self.output_dir, self.BIN_IDS)
+        for bin_id in self.BIN_IDS:
+            self.write_plot(self.html_dir, bin_id, OutputBuilder.THUMB_EXT)
+        html = io.StringIO()
+        self.builder().build_summary_table(html, self.html_dir)
+        parser = LinkParser()
+        parser.feed(html.getvalue())
+        self.assertEqual(len(parser.images), len(self.BIN_IDS))
+        for src in parser.images:
+            self.assertTrue(os.path.isfile(os.path.join(self.html_dir, unquote(src))), src)
+        fragments = sorted(unquote(href.split('#', 1)[1]) for href, text in parser.links)
+        self.assertEqual(fragments, sorted(self.BIN_IDS * 2))
+
+
+class UploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.folders = []
+        for n in range(4):
+            folder = os.path.join(self.tmp_dir, 'folder' + str(n))
+            os.makedirs(folder)
+            self.folders.append(folder)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.done = []
+        self.barrier = None
+        self.fail = None
+        patcher = mock.patch('kb_Msuite.Utils.OutputBuilder.DataFileUtil')
+        patcher.start().return_value.file_to_shock.side_effect = self.file_to_shock
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def file_to_shock(self, params):
+        name = os.path.basename(params['file_path'])
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            if self.barrier is not None:
+                # every upload waits here until all of them have started
+                self.barrier.wait()
+            time.sleep(0.1)
+            if name == self.fail:
+                raise ValueError('upload of ' + name + ' failed')
+            with self.lock:
+                self.done.append(name)
+            return {'shock_id': 'shock_' + name}
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def upload(self, builder, folders):
+        pending = [builder.package_folder_async(folder, os.path.basename(folder) + '.zip',
+                                                'test') for folder in folders]
+        try:
+            return builder.wait_for_packages(pending)
+        finally:
+            builder.shutdown_uploads()
+
+    def test_concurrent(self):
+        self.barrier = threading.Barrier(3, timeout=5)
+        builder = OutputBuilder(self.tmp_dir, self.tmp_dir, self.tmp_dir, None,
+                                upload_threads=3)
+        packages = self.upload(builder, self.folders[:3])
+        self.assertEqual(self.peak, 3)
+        # in the order they were started
+        self.assertEqual([p['shock_id'] for p in packages],
+                         ['shock_folder0', 'shock_folder1', 'shock_folder2'])
+        self.assertEqual(packages[0]['name'], 'folder0.zip')
+        self.assertIsNone(builder._upload_executor)
+
+    def test_upload_threads(self):
+        builder = OutputBuilder(self.tmp_dir, self.tmp_dir, self.tmp_dir, None,
+                                upload_threads=2)
+        self.assertEqual(len(self.upload(builder, self.folders)), 4)
+        self.assertEqual(self.peak, 2)
+
+    def test_failure(self):
+        self.fail = 'folder1'
+        builder = OutputBuilder(self.tmp_dir, self.tmp_dir, self.tmp_dir, None,
+                                upload_threads=4)
+        with self.assertRaisesRegex(ValueError, 'upload of folder1 failed'):
+            self.upload(builder, self.folders)
+        # the other uploads were waited for, and the thread pool released
+        self.assertEqual(sorted(self.done), ['folder0', 'folder2', 'folder3'])
+        self.assertEqual(self.running, 0)
+        self.assertIsNone(builder._upload_executor)
+        # a new upload gets a new thread pool
+        self.fail = None
+        self.assertEqual(self.upload(builder, self.folders[:1])[0]['shock_id'],
+                         'shock_folder0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import threading
+
+import numpy as np
+
+from kb_Msuite.Utils.OverviewPlot import OverviewPlot
+
+PNG_MAGIC = b'\x89PNG'
+
+
+def bin_stats(n_bins):
+    rng = np.random.RandomState(1)
+    return dict(('bin.' + str(n), {'Completeness': rng.uniform(0, 100),
+                                   'Contamination': rng.exponential(5)})
+                for n in range(n_bins))
+
+
+class OverviewPlotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def assertPlot(self, plot_path):
+        with open(plot_path, 'rb') as plot_handle:
+            self.assertEqual(plot_handle.read(4), PNG_MAGIC)
+
+    def test_scatter_and_density(self):
+        for n_bins in [10, OverviewPlot.MAX_SCATTER_BINS + 1]:
+            plot_path = os.path.join(self.tmp_dir, str(n_bins) + '.png')
+            self.assertTrue(OverviewPlot().plot(bin_stats(n_bins), plot_path))
+            self.assertPlot(plot_path)
+
+    def test_nothing_to_plot(self):
+        plot_path = os.path.join(self.tmp_dir, 'empty.png')
+        self.assertFalse(OverviewPlot().plot({'bin.1': {}}, plot_path))
+        self.assertFalse(os.path.exists(plot_path))
+
+    def test_concurrent_plots(self):
+        # the pipeline draws on several threads at once
+        plot_paths = [os.path.join(self.tmp_dir, str(n) + '.png') for n in range(4)]
+        threads = [threading.Thread(target=OverviewPlot().plot, args=(bin_stats(200), path))
+                   for path in plot_paths]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for plot_path in plot_paths:
+            self.assertPlot(plot_path)
+
+    def test_tier_labels(self):
+        self.assertEqual([OverviewPlot.tier_label(*t) for t in OverviewPlot.QUALITY_TIERS],
+                         ['High (>=90% / <5%)', 'Medium (>=50% / <10%)', 'Low'])
+
+    def test_tiers(self):
+        # the tier boundaries are as the labels say
+        completeness = np.array([90.0, 89.9, 95.0, 50.0, 50.0, 10.0])
+        contamination = np.array([4.9, 1.0, 5.0, 9.9, 10.0, 0.0])
+        counts = []
+        plot = OverviewPlot()
+        plot._plot_counts = lambda ax, tier_counts, labels, xlabel: counts.extend(tier_counts)
+        plot._plot_tiers(mock.MagicMock(), completeness, contamination)
+        self.assertEqual(counts, [1, 3, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
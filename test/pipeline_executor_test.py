@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+
+from kb_Msuite.Utils.PipelineExecutor import PipelineExecutor
+from kb_Msuite.Utils.ScratchManager import ScratchManager
+
+
+def sleeper(seconds, result=None):
+    def stage(results):
+        time.sleep(seconds)
+        return result
+    return stage
+
+
+class PipelineExecutorTest(unittest.TestCase):
+
+    def test_results_and_order(self):
+        calls = []
+
+        def stage(name, value):
+            def run(results):
+                calls.append((name, sorted(results.keys())))
+                time.sleep(0.05)
+                return value
+            return run
+
+        pipeline = PipelineExecutor(4)
+        pipeline.add_stage('a', stage('a', 1))
+        pipeline.add_stage('b', stage('b', 2), deps=['a'])
+        pipeline.add_stage('c', lambda results: sleeper(0.05)(results) or
+                           results['a'] + results['b'], deps=['a', 'b'])
+        results = pipeline.run()
+        self.assertEqual(results, {'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(calls, [('a', []), ('b', ['a'])])
+        self.assertEqual(pipeline.critical_path(), ['a', 'b', 'c'])
+
+    def test_overlap(self):
+        pipeline = PipelineExecutor(2)
+        pipeline.add_stage('lineage_wf', sleeper(0.3))
+        pipeline.add_stage('tetra', sleeper(0.3))
+        start = time.time()
+        pipeline.run()
+        self.assertLess(time.time() - start, 0.55)
+        timing = dict((t['name'], t) for t in pipeline.stage_timing())
+        self.assertLess(timing['tetra']['start'], timing['lineage_wf']['end'])
+
+    def test_cpu_budget(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def stage(results):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.1)
+            with lock:
+                running.pop()
+
+        pipeline = PipelineExecutor(3)
+        for n in range(4):
+            pipeline.add_stage('s' + str(n), stage, cpus=2)
+        # needs more than the budget, so runs alone
+        pipeline.add_stage('big', stage, cpus=8)
+        # no CPUs, e.g. waiting for uploads
+        pipeline.add_stage('upload', stage, cpus=0)
+        pipeline.run()
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(pipeline.stages[4]['cpus'], 3)
+
+    def test_failure(self):
+        started = []
+
+        def fail(results):
+            raise ValueError('stage failed')
+
+        def after(results):
+            started.append('after')
+
+        pipeline = PipelineExecutor(2)
+        pipeline.add_stage('fails', fail)
+        pipeline.add_stage('slow', sleeper(0.2, 'done'))
+        pipeline.add_stage('after', after, deps=['fails'])
+        with self.assertRaises(ValueError) as cm:
+            pipeline.run()
+        self.assertEqual(str(cm.exception), 'stage failed')
+        self.assertEqual(started, [])
+        # the stages already running were waited for
+        self.assertEqual(pipeline.results['slow'], 'done')
+
+    def test_invalid_stages(self):
+        pipeline = PipelineExecutor(1)
+        pipeline.add_stage('a', sleeper(0))
+        with self.assertRaises(ValueError):
+            pipeline.add_stage('a', sleeper(0))
+        with self.assertRaises(ValueError):
+            pipeline.add_stage('b', sleeper(0), deps=['missing'])
+
+
+class PipelineCheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.run_dir = os.path.join(self.tmp_dir, 'checkpoints')
+        self.staged = os.path.join(self.tmp_dir, 'staged.fna')
+        self.output_dir = os.path.join(self.tmp_dir, 'output')
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def pipeline(self, stage_key='ref/1/1', fail=None, scratch_manager=None):
+        def stage_input(results):
+            self.calls.append('stage_input')
+            with open(self.staged, 'w') as staged_handle:
+                staged_handle.write('>contig\nACGT\n')
+            return {'bins': 2}
+
+        def lineage_wf(results):
+            self.calls.append('lineage_wf')
+            if fail == 'lineage_wf':
+                raise ValueError('lineage_wf failed')
+            os.makedirs(self.output_dir)
+            return {'failed_bins': [], 'bins': results['stage_input']['bins']}
+
+        def report(results):
+            self.calls.append('report')
+            return results['lineage_wf']['bins']
+
+        pipeline = PipelineExecutor(2, run_dir=self.run_dir, scratch_manager=scratch_manager)
+        pipeline.add_stage('stage_input', stage_input, key=stage_key, outputs=[self.staged],
+                           checkpoint=True)
+        pipeline.add_stage('lineage_wf', lineage_wf, deps=['stage_input'],
+                           outputs=[self.output_dir], checkpoint=True)
+        pipeline.add_stage('report', report, deps=['lineage_wf'])
+        return pipeline
+
+    def test_resume(self):
+        self.assertEqual(self.pipeline().run()['report'], 2)
+        self.assertEqual(self.calls, ['stage_input', 'lineage_wf', 'report'])
+        del self.calls[:]
+        pipeline = self.pipeline()
+        results = pipeline.run()
+        self.assertEqual(self.calls, ['report'])
+        # stage_input is only needed by lineage_wf, which is complete
+        self.assertEqual(pipeline.skipped, ['lineage_wf'])
+        self.assertNotIn('stage_input', results)
+        self.assertEqual(results['lineage_wf'], {'failed_bins': [], 'bins': 2})
+        self.assertEqual(results['report'], 2)
+
+    def test_resume_after_failure(self):
+        with self.assertRaises(ValueError):
+            self.pipeline(fail='lineage_wf').run()
+        del self.calls[:]
+        self.pipeline().run()
+        self.assertEqual(self.calls, ['lineage_wf', 'report'])
+
+    def test_changed_key(self):
+        self.pipeline().run()
+        del self.calls[:]
+        # the dependents of a stage with a new input hash run again too
+        self.pipeline(stage_key='ref/1/2').run()
+        self.assertEqual(self.calls, ['stage_input', 'lineage_wf', 'report'])
+
+    def test_missing_output(self):
+        self.pipeline().run()
+        shutil.rmtree(self.output_dir)
+        del self.calls[:]
+        self.pipeline().run()
+        self.assertEqual(self.calls, ['lineage_wf', 'report'])
+
+    def test_unneeded_stage_not_run(self):
+        # once lineage_wf is complete, the input it was made from is not needed again
+        self.pipeline().run()
+        os.remove(self.staged)
+        del self.calls[:]
+        pipeline = self.pipeline()
+        pipeline.run()
+        self.assertEqual(self.calls, ['report'])
+        self.assertEqual(pipeline.skipped, ['lineage_wf'])
+
+    def scratch_manager(self):
+        scratch_manager = ScratchManager(self.tmp_dir)
+        scratch_manager.register(self.staged, ['lineage_wf'])
+        return scratch_manager
+
+    def test_removed_intermediate(self):
+        self.pipeline(scratch_manager=self.scratch_manager()).run()
+        self.assertFalse(os.path.exists(self.staged))
+        del self.calls[:]
+        # the input was removed as an intermediate, and lineage_wf does not have to run again
+        self.pipeline(scratch_manager=self.scratch_manager()).run()
+        self.assertEqual(self.calls, ['report'])
+        # ...until it does; then the input is staged again
+        shutil.rmtree(self.output_dir)
+        del self.calls[:]
+        self.pipeline(scratch_manager=self.scratch_manager()).run()
+        self.assertEqual(self.calls, ['stage_input', 'lineage_wf', 'report'])
+
+    def test_corrupt_manifest(self):
+        self.pipeline().run()
+        with open(os.path.join(self.run_dir, 'lineage_wf' + PipelineExecutor.MANIFEST_EXT),
+                  'w') as manifest_handle:
+            manifest_handle.write('{')
+        del self.calls[:]
+        self.pipeline().run()
+        self.assertEqual(self.calls, ['lineage_wf', 'report'])
+
+
+if __name__ == '__main__':
+    unittest.main()
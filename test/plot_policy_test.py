@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+import unittest
+
+from kb_Msuite.Utils.CheckMUtil import CheckMUtil
+
+BIN_STATS = {'bin.001': {'Completeness': 98.0, 'Contamination': 0.0, 'Genome size': 3000},
+             'bin.002': {'Completeness': 95.0, 'Contamination': 2.5, 'Genome size': 5000},
+             'bin.003': {'Completeness': 40.0, 'Contamination': 12.0, 'Genome size': 1000},
+             'bin.004': {'Completeness': 70.0, 'Contamination': 10.0, 'Genome size': 5000}}
+
+
+class PlotPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cmu = CheckMUtil({'SDK_CALLBACK_URL': 'http://localhost',
+                               'scratch': self.tmp_dir,
+                               'threads': 1}, {})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def select(self, plot_policy, retained_bins=None, **params):
+        return self.cmu._select_plot_bins(params, plot_policy, BIN_STATS, retained_bins)
+
+    def test_all(self):
+        self.assertIsNone(self.select('all'))
+        # nothing to select from
+        self.assertIsNone(self.cmu._select_plot_bins({}, 'top_n', {}, None))
+
+    def test_retained(self):
+        # the filter keys the bins without their 'bin.' prefix
+        self.assertEqual(self.select('retained', retained_bins={'001': 1, '004': 1}),
+                         set(['bin.001', 'bin.004']))
+        self.assertEqual(self.select('retained', retained_bins={}), set())
+        # the bins were not filtered
+        self.assertIsNone(self.select('retained'))
+
+    def test_flagged(self):
+        # contamination above the default of 10%
+        self.assertEqual(self.select('flagged'), set(['bin.003']))
+        self.assertEqual(self.select('flagged', plot_contamination_perc=2),
+                         set(['bin.002', 'bin.003', 'bin.004']))
+        self.assertEqual(self.select('flagged', plot_completeness_perc=75),
+                         set(['bin.003', 'bin.004']))
+
+    def test_flagged_zero(self):
+        # 0 means any contamination, not the default
+        self.assertEqual(self.select('flagged', plot_contamination_perc=0),
+                         set(['bin.002', 'bin.003', 'bin.004']))
+        self.assertEqual(self.select('flagged', plot_contamination_perc=0,
+                                     plot_completeness_perc=0),
+                         set(['bin.002', 'bin.003', 'bin.004']))
+        # unset
+        self.assertEqual(self.select('flagged', plot_contamination_perc=None,
+                                     plot_completeness_perc=None), set(['bin.003']))
+
+    def test_top_n(self):
+        # the largest bins, ties by bin ID
+        self.assertEqual(self.select('top_n', plot_top_n=2), set(['bin.002', 'bin.004']))
+        self.assertEqual(self.select('top_n', plot_top_n=3),
+                         set(['bin.001', 'bin.002', 'bin.004']))
+        # the default of 100 is more than there are
+        self.assertEqual(self.select('top_n'), set(BIN_STATS.keys()))
+        self.assertEqual(self.select('top_n', plot_top_n=0), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import unittest
+import threading
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from installed_clients import baseclient
+from installed_clients.baseclient import ServerError
+from kb_Msuite.Utils import PooledBaseClient as pooled
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    ''' a JSON-RPC service that returns its params, and records the calls made to it '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        encoding = self.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        request = json.loads(body.decode('utf-8'))
+        self.server.calls.append({'method': request['method'],
+                                  'port': self.client_address[1],
+                                  'encoding': encoding})
+        status = 200
+        if request['method'] == 'Service.fail':
+            status = 500
+            response = {'error': {'name': 'JSONRPCError', 'code': -32000,
+                                  'message': 'failed', 'error': 'trace'}}
+        elif request['method'] == 'ServiceWizard.get_service_status':
+            response = {'result': [{'url': self.server.service_url}]}
+        else:
+            response = {'result': request['params']}
+        data = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class PooledBaseClientTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = _Server(('127.0.0.1', 0), _Handler)
+        cls.server.calls = []
+        cls.url = 'http://127.0.0.1:' + str(cls.server.server_address[1])
+        cls.server.service_url = cls.url + '/services/echo'
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        del self.server.calls[:]
+        pooled._service_urls.clear()
+
+    def methods(self):
+        return [call['method'] for call in self.server.calls]
+
+    def test_keep_alive(self):
+        client = pooled.PooledBaseClient(self.url, pool_size=1)
+        for n in range(5):
+            self.assertEqual(client.call_method('Service.echo', [{'n': n}]), {'n': n})
+        # another client of the same host shares the connection
+        other = pooled.PooledBaseClient(self.url, pool_size=1)
+        self.assertEqual(other.call_method('Service.echo', [1, 2]), [1, 2])
+        self.assertEqual(len(self.server.calls), 6)
+        self.assertEqual(len(set(call['port'] for call in self.server.calls)), 1)
+
+    def test_compression(self):
+        client = pooled.PooledBaseClient(self.url, compress_min_bytes=100)
+        self.assertEqual(client.call_method('Service.echo', ['x' * 200]), 'x' * 200)
+        self.assertEqual(client.call_method('Service.echo', ['x']), 'x')
+        self.assertEqual([call['encoding'] for call in self.server.calls], ['gzip', None])
+
+    def test_server_error(self):
+        client = pooled.PooledBaseClient(self.url)
+        with self.assertRaises(ServerError) as cm:
+            client.call_method('Service.fail', [])
+        self.assertEqual(cm.exception.message, 'failed')
+
+    def test_url_cache(self):
+        client = pooled.PooledBaseClient(self.url, lookup_url=True)
+        for n in range(3):
+            self.assertEqual(client.call_method('Service.echo', [n], service_ver='dev'), n)
+        # shared with other clients of the same wizard
+        other = pooled.PooledBaseClient(self.url, lookup_url=True)
+        self.assertEqual(other.call_method('Service.echo', [3], service_ver='dev'), 3)
+        self.assertEqual(self.methods(), ['ServiceWizard.get_service_status'] +
+                         ['Service.echo'] * 4)
+        # another version is looked up
+        client.call_method('Service.echo', [4], service_ver='beta')
+        self.assertEqual(self.methods()[-2], 'ServiceWizard.get_service_status')
+
+    def test_moved_service(self):
+        # a cached URL of a service that has moved elsewhere
+        pooled._service_urls[(self.url, 'Service', None)] = ('http://127.0.0.1:1',
+                                                             pooled.time.time())
+        client = pooled.PooledBaseClient(self.url, lookup_url=True)
+        self.assertEqual(client.call_method('Service.echo', ['moved']), 'moved')
+        self.assertEqual(self.methods(), ['ServiceWizard.get_service_status', 'Service.echo'])
+        self.assertEqual(pooled._service_urls[(self.url, 'Service', None)][0],
+                         self.server.service_url)
+
+    def test_unreachable_service(self):
+        # the wizard still has the same URL, so the call is not retried
+        service_url = self.server.service_url
+        self.server.service_url = 'http://127.0.0.1:1'
+        try:
+            client = pooled.PooledBaseClient(self.url, lookup_url=True)
+            with self.assertRaises(pooled.ConnectionError):
+                client.call_method('Service.echo', [1])
+        finally:
+            self.server.service_url = service_url
+        self.assertEqual(self.methods(), ['ServiceWizard.get_service_status'] * 2)
+
+    def test_install(self):
+        from installed_clients import DataFileUtilClient
+        try:
+            pooled.install()
+            self.assertIs(baseclient.BaseClient, pooled.PooledBaseClient)
+            self.assertIs(DataFileUtilClient._BaseClient, pooled.PooledBaseClient)
+            dfu = DataFileUtilClient.DataFileUtil(self.url, token='token')
+            self.assertIsInstance(dfu._client, pooled.PooledBaseClient)
+            self.assertEqual(dfu._client._headers['AUTHORIZATION'], 'token')
+        finally:
+            baseclient.BaseClient = pooled._GeneratedBaseClient
+            DataFileUtilClient._BaseClient = pooled._GeneratedBaseClient
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import shutil
+import signal
+import tempfile
+import unittest
+from unittest import mock
+
+from kb_Msuite.Utils.ProcessWatchdog import ProcessWatchdog, sample_process_group
+
+PRINT_AFFINITY = [sys.executable, '-c',
+                  'import os, time; time.sleep(0.2); print(sorted(os.sched_getaffinity(0)))']
+
+
+class ProcessWatchdogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.tmp_dir, 'command.out')
+        self.cpu = sorted(os.sched_getaffinity(0))[-1]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_output(self):
+        with open(self.output_path) as output_handle:
+            return output_handle.read()
+
+    def test_run(self):
+        watchdog = ProcessWatchdog([sys.executable, '-c', 'print("done")'], self.output_path,
+                                   interval=0.1)
+        self.assertEqual(watchdog.run(), 0)
+        self.assertEqual(self.read_output(), 'done\n')
+        self.assertGreater(watchdog.wall_seconds, 0)
+
+    def test_exit_code(self):
+        watchdog = ProcessWatchdog([sys.executable, '-c', 'import sys; sys.exit(3)'],
+                                   self.output_path, interval=0.1)
+        self.assertEqual(watchdog.run(), 3)
+        self.assertFalse(watchdog.timed_out)
+
+    def test_timeout(self):
+        watchdog = ProcessWatchdog([sys.executable, '-c', 'import time; time.sleep(60)'],
+                                   self.output_path, timeout=0.5, interval=0.1)
+        self.assertNotEqual(watchdog.run(), 0)
+        self.assertTrue(watchdog.timed_out)
+        self.assertLess(watchdog.wall_seconds, 30)
+
+    def test_stall(self):
+        # neither uses CPU nor writes output after the first line
+        watchdog = ProcessWatchdog([sys.executable, '-c',
+                                    'import time; print("start", flush=True); time.sleep(60)'],
+                                   self.output_path, stall_timeout=0.5, interval=0.1)
+        self.assertNotEqual(watchdog.run(), 0)
+        self.assertTrue(watchdog.stalled)
+        self.assertFalse(watchdog.timed_out)
+        self.assertFalse(watchdog.oom)
+        self.assertLess(watchdog.wall_seconds, 30)
+
+    def test_no_stall_while_busy(self):
+        busy = 'import time\nend = time.time() + 1\nwhile time.time() < end:\n    pass\n'
+        watchdog = ProcessWatchdog([sys.executable, '-c', busy], self.output_path,
+                                   stall_timeout=0.5, interval=0.1)
+        self.assertEqual(watchdog.run(), 0)
+        self.assertFalse(watchdog.stalled)
+        self.assertGreater(watchdog.cpu_seconds, 0)
+        self.assertGreater(watchdog.peak_rss, 0)
+        self.assertGreater(len(watchdog.timeline.to_dict()['points']), 0)
+
+    def test_oom_message(self):
+        watchdog = ProcessWatchdog([sys.executable, '-c', 'raise MemoryError()'],
+                                   self.output_path, interval=0.1)
+        self.assertNotEqual(watchdog.run(), 0)
+        self.assertTrue(watchdog.oom)
+
+    def test_oom_sigkill(self):
+        # the kernel OOM killer uses SIGKILL
+        watchdog = ProcessWatchdog([sys.executable, '-c',
+                                    'import os, signal; os.kill(os.getpid(), signal.SIGKILL)'],
+                                   self.output_path, interval=0.1)
+        self.assertEqual(watchdog.run(), -signal.SIGKILL)
+        self.assertTrue(watchdog.oom)
+
+    def test_not_oom(self):
+        watchdog = ProcessWatchdog([sys.executable, '-c', 'raise ValueError("bad input")'],
+                                   self.output_path, interval=0.1)
+        self.assertNotEqual(watchdog.run(), 0)
+        self.assertFalse(watchdog.oom)
+
+    def test_timeout_kills_children(self):
+        pid_path = os.path.join(self.tmp_dir, 'child.pid')
+        parent = ('import subprocess, sys, time\n'
+                  'child = subprocess.Popen([sys.executable, "-c",\n'
+                  '                          "import time; time.sleep(60)"])\n'
+                  'open(sys.argv[1], "w").write(str(child.pid))\n'
+                  'time.sleep(60)\n')
+        watchdog = ProcessWatchdog([sys.executable, '-c', parent, pid_path], self.output_path,
+                                   timeout=1, interval=0.1)
+        watchdog.run()
+        self.assertTrue(watchdog.timed_out)
+        with open(pid_path) as pid_handle:
+            child_pid = int(pid_handle.read())
+        # the child is in the same process group, so was stopped too
+        for _ in range(50):
+            if not self.running(child_pid):
+                break
+            time.sleep(0.1)
+        self.assertFalse(self.running(child_pid))
+
+    def running(self, pid):
+        try:
+            with open('/proc/' + str(pid) + '/stat') as stat_handle:
+                # a zombie, not yet reaped by init, has stopped
+                return stat_handle.read().rsplit(')', 1)[1].split()[0] != 'Z'
+        except (IOError, OSError):
+            return False
+
+    def test_sample_process_group(self):
+        sample = sample_process_group(os.getpgid(0))
+        self.assertGreaterEqual(sample['procs'], 1)
+        self.assertGreater(sample['rss'], 0)
+        self.assertEqual(sample_process_group(-1)['procs'], 0)
+
+    @unittest.skipUnless(shutil.which('taskset'), 'taskset is not installed')
+    def test_cpus_taskset(self):
+        watchdog = ProcessWatchdog(PRINT_AFFINITY, self.output_path, interval=0.1,
+                                   cpus=[self.cpu])
+        self.assertEqual(watchdog.run(), 0)
+        self.assertEqual(self.read_output(), str([self.cpu]) + '\n')
+
+    def test_cpus_without_taskset(self):
+        with mock.patch('kb_Msuite.Utils.ProcessWatchdog.shutil.which', return_value=None):
+            watchdog = ProcessWatchdog(PRINT_AFFINITY, self.output_path, interval=0.1,
+                                       cpus=[self.cpu])
+            self.assertEqual(watchdog.run(), 0)
+        self.assertEqual(self.read_output(), str([self.cpu]) + '\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
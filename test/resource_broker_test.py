@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+import subprocess
+
+from kb_Msuite.Utils import ResourceBroker as broker_module
+from kb_Msuite.Utils.ResourceBroker import ResourceBroker, _numa_nodes, _parse_cpulist
+
+
+class ResourceBrokerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ledger_dir = os.path.join(self.tmp_dir, 'ledger')
+        self.events = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def broker(self, **kwargs):
+        return ResourceBroker(self.ledger_dir, **dict(dict(total_threads=4, total_memory=10,
+                                                           poll_interval=0.02), **kwargs))
+
+    def ledger(self):
+        with open(os.path.join(self.ledger_dir, ResourceBroker.LEDGER_FILE)) as ledger_handle:
+            return json.load(ledger_handle)
+
+    def hold(self, name, threads, memory, seconds):
+        with self.broker().grant(threads, memory, name) as grant:
+            with self.lock:
+                self.events.append(name)
+            time.sleep(seconds)
+        return grant
+
+    def start(self, *args):
+        thread = threading.Thread(target=self.hold, args=args)
+        thread.start()
+        return thread
+
+    def test_grant(self):
+        with self.broker().grant(2, 5, 'lineage_wf') as grant:
+            self.assertEqual(grant['threads'], 2)
+            self.assertEqual(grant['memory'], 5)
+            self.assertIsNone(grant['cpus'])
+            self.assertEqual([g['id'] for g in self.ledger()['grants']], [grant['id']])
+        self.assertEqual(self.ledger(), {'grants': [], 'queue': []})
+
+    def test_threads_capped(self):
+        # larger than the container, so runs alone with all of it
+        with self.broker().grant(16, 0, 'big') as grant:
+            self.assertEqual(grant['threads'], 4)
+
+    def test_first_come_first_served(self):
+        threads = [self.start('a', 3, 0, 0.3)]
+        time.sleep(0.1)
+        # b waits for a; c would fit beside a, but is behind b in the queue
+        threads.append(self.start('b', 2, 0, 0.1))
+        time.sleep(0.1)
+        threads.append(self.start('c', 1, 0, 0.1))
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.events, ['a', 'b', 'c'])
+
+    def test_memory(self):
+        threads = [self.start('a', 1, 8, 0.3)]
+        time.sleep(0.1)
+        start = time.time()
+        grant = self.hold('b', 1, 4, 0)
+        self.assertGreater(time.time() - start, 0.1)
+        self.assertGreater(grant['wait_seconds'], 0.1)
+        threads[0].join()
+
+    def test_fits(self):
+        broker = self.broker()
+        grants = [{'threads': 2, 'memory': 6}]
+        self.assertTrue(broker._fits({'threads': 2, 'memory': 4}, grants))
+        self.assertFalse(broker._fits({'threads': 3, 'memory': 0}, grants))
+        self.assertFalse(broker._fits({'threads': 1, 'memory': 5}, grants))
+        # anything fits in an empty container
+        self.assertTrue(broker._fits({'threads': 4, 'memory': 50}, []))
+        # without a memory limit only the threads count
+        broker.total_memory = None
+        self.assertTrue(broker._fits({'threads': 1, 'memory': 2 ** 50}, grants))
+
+    def test_allocate_cpus(self):
+        broker = self.broker(total_threads=8)
+        broker.numa_nodes = [[0, 1, 2, 3], [4, 5, 6, 7]]
+        # the fullest node that fits
+        self.assertEqual(broker._allocate_cpus(2, [{'cpus': [0, 1]}]), [2, 3])
+        self.assertEqual(broker._allocate_cpus(3, [{'cpus': [0, 1]}]), [4, 5, 6])
+        # spread over the nodes, the one with the most free first
+        self.assertEqual(broker._allocate_cpus(5, [{'cpus': [0, 1]}, {'cpus': None}]),
+                         [2, 4, 5, 6, 7])
+        self.assertIsNone(broker._allocate_cpus(3, [{'cpus': [0, 1, 2, 3, 4, 5]}]))
+
+    def test_pinned_grants(self):
+        broker = self.broker()
+        broker.numa_nodes = [[0, 1], [2, 3]]
+        with broker.grant(2, 0, 'a', pin=True) as first:
+            with broker.grant(2, 0, 'b', pin=True) as second:
+                self.assertEqual(len(first['cpus']), 2)
+                self.assertEqual(sorted(first['cpus'] + second['cpus']), [0, 1, 2, 3])
+
+    def test_dead_process(self):
+        # a grant held by a process that exited without releasing it
+        script = ('import os, sys\n'
+                  'sys.path.insert(0, sys.argv[1])\n'
+                  'from kb_Msuite.Utils.ResourceBroker import ResourceBroker\n'
+                  'grant = ResourceBroker(sys.argv[2], total_threads=4).grant(4, 0, "x")\n'
+                  'grant.__enter__()\n'
+                  'os._exit(0)\n')
+        lib_dir = os.path.dirname(os.path.dirname(os.path.dirname(broker_module.__file__)))
+        subprocess.check_call([sys.executable, '-c', script, lib_dir, self.ledger_dir])
+        self.assertEqual(len(self.ledger()['grants']), 1)
+        with self.broker().grant(4, 0, 'y') as grant:
+            self.assertLess(grant['wait_seconds'], 1)
+            self.assertEqual([g['label'] for g in self.ledger()['grants']], ['y'])
+
+    def test_parse_cpulist(self):
+        self.assertEqual(_parse_cpulist('0-3,8-9,12\n'), [0, 1, 2, 3, 8, 9, 12])
+        self.assertEqual(_parse_cpulist('5'), [5])
+        self.assertEqual(_parse_cpulist(''), [])
+
+    def test_numa_nodes(self):
+        node_dir = os.path.join(self.tmp_dir, 'node')
+        for name, cpulist in [('node0', '0-1'), ('node1', '2-3'), ('possible', '')]:
+            os.makedirs(os.path.join(node_dir, name))
+            with open(os.path.join(node_dir, name, 'cpulist'), 'w') as cpulist_handle:
+                cpulist_handle.write(cpulist + '\n')
+        self.assertEqual(_numa_nodes([0, 1, 2, 3], node_dir), [[0, 1], [2, 3]])
+        # the CPUs outside of this container are left out
+        self.assertEqual(_numa_nodes([1, 2], node_dir), [[1], [2]])
+        # one group if the topology doesn't cover every CPU, or can't be read
+        self.assertEqual(_numa_nodes([0, 1, 2, 3, 4], node_dir), [[0, 1, 2, 3, 4]])
+        self.assertEqual(_numa_nodes([0, 1], os.path.join(self.tmp_dir, 'missing')), [[0, 1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
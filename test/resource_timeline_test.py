@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import unittest
+from xml.dom import minidom
+
+from kb_Msuite.Utils.ResourceTimeline import ResourceTimeline, timeline_svg
+
+
+def sample(cpu_seconds, rss, threads=1, read_bytes=0, write_bytes=0):
+    return {'procs': 1, 'threads': threads, 'rss': rss, 'cpu_seconds': cpu_seconds,
+            'read_bytes': read_bytes, 'write_bytes': write_bytes}
+
+
+class ResourceTimelineTest(unittest.TestCase):
+
+    def test_points(self):
+        timeline = ResourceTimeline()
+        timeline.add(1, sample(0.5, 100))
+        timeline.add(3, sample(4.5, 300, threads=4, read_bytes=10))
+        data = timeline.to_dict()
+        self.assertEqual(data['fields'], ResourceTimeline.FIELDS)
+        self.assertEqual(data['points'], [[1, 50.0, 100, 1, 0, 0],
+                                          [3, 200.0, 300, 4, 10, 0]])
+
+    def test_cpu_never_negative(self):
+        # the CPU time of children that exit without being waited for is lost
+        timeline = ResourceTimeline()
+        timeline.add(1, sample(5, 100))
+        timeline.add(2, sample(1, 100))
+        timeline.add(3, sample(6, 100))
+        self.assertEqual([p[1] for p in timeline.to_dict()['points']], [500.0, 0.0, 100.0])
+
+    def test_downsampling(self):
+        timeline = ResourceTimeline(max_points=4)
+        for t in range(1, 21):
+            # one busy core, with a short RSS peak
+            timeline.add(t, sample(t, 1000 if t == 7 else 100))
+        points = timeline.to_dict()['points']
+        self.assertLessEqual(len(points), 5)
+        self.assertEqual(points[-1][0], 20)
+        self.assertEqual([p[1] for p in points], [100.0] * len(points))
+        # the peak is kept
+        self.assertEqual(max(p[2] for p in points), 1000)
+        # the points are in time order
+        self.assertEqual([p[0] for p in points], sorted(p[0] for p in points))
+
+    def test_long_run_stays_small(self):
+        timeline = ResourceTimeline(max_points=10)
+        for t in range(1, 10001):
+            timeline.add(t, sample(t, 100))
+        self.assertLessEqual(len(timeline.to_dict()['points']), 11)
+
+
+class TimelineSvgTest(unittest.TestCase):
+
+    def test_svg(self):
+        timeline = ResourceTimeline()
+        for t in range(1, 5):
+            timeline.add(t, sample(2 * t, 1048576 * t))
+        svg = timeline_svg(timeline.to_dict(), 'lineage_wf <bins>')
+        # well formed, with the title escaped
+        doc = minidom.parseString(svg)
+        self.assertEqual(len(doc.getElementsByTagName('polyline')), 2)
+        self.assertIn('lineage_wf &lt;bins&gt;', svg)
+        self.assertIn('4 MB', svg)
+
+    def test_too_few_points(self):
+        timeline = ResourceTimeline()
+        self.assertIsNone(timeline_svg(timeline.to_dict(), 'empty'))
+        timeline.add(1, sample(1, 100))
+        self.assertIsNone(timeline_svg(timeline.to_dict(), 'one'))
+        self.assertIsNone(timeline_svg({}, 'none'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+
+from kb_Msuite.Utils.RunCoalescer import RunCoalescer
+from kb_Msuite.Utils.RunWorkspace import RunWorkspace
+
+
+class RunCoalescerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp()
+        self.coalescer = RunCoalescer(self.lock_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.lock_dir)
+
+    def test_one_run_at_a_time(self):
+        events = []
+        started = threading.Event()
+
+        def second_run():
+            started.set()
+            with self.coalescer.run('run_a') as wait:
+                events.append(('second', wait))
+
+        with self.coalescer.run('run_a') as wait:
+            self.assertLess(wait, 1)
+            thread = threading.Thread(target=second_run)
+            thread.start()
+            started.wait()
+            time.sleep(0.3)
+            events.append(('first', None))
+        thread.join()
+        self.assertEqual(events[0], ('first', None))
+        self.assertEqual(events[1][0], 'second')
+        self.assertGreaterEqual(events[1][1], 0.2)
+
+    def test_other_run_ids(self):
+        with self.coalescer.run('run_a'):
+            with self.coalescer.run('run_b') as wait:
+                self.assertLess(wait, 1)
+
+    def test_idle(self):
+        with self.coalescer.idle('run_a') as idle:
+            self.assertTrue(idle)
+        with self.coalescer.run('run_a'):
+            with self.coalescer.idle('run_a') as idle:
+                self.assertFalse(idle)
+            with self.coalescer.idle('run_b') as idle:
+                self.assertTrue(idle)
+
+    def test_workspace_kept_while_run_waits(self):
+        # the workspace of a run is allocated under its lock, so a finishing identical run
+        # can't remove it in between
+        with self.coalescer.run('run_a'):
+            RunWorkspace.allocate(self.lock_dir, 'run_a')
+            finished = RunWorkspace(self.lock_dir, 'run_a')
+            self.assertFalse(finished.remove())
+            self.assertTrue(os.path.isdir(finished.path))
+        self.assertTrue(finished.remove())
+        self.assertFalse(os.path.exists(finished.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
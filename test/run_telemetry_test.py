@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+import threading
+
+from kb_Msuite.Utils.ResourceTimeline import ResourceTimeline
+from kb_Msuite.Utils.RunTelemetry import RunTelemetry
+
+
+class FakeWatchdog(object):
+    ''' the attributes of a finished ProcessWatchdog that RunTelemetry reads '''
+
+    def __init__(self, cpu_seconds=2.0, peak_rss=1048576):
+        self.exit_code = 0
+        self.wall_seconds = 1.0
+        self.cpu_seconds = cpu_seconds
+        self.peak_rss = peak_rss
+        self.read_bytes = 100
+        self.write_bytes = 200
+        self.timeline = ResourceTimeline()
+
+
+def busy_wait(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class RunTelemetryTest(unittest.TestCase):
+
+    def test_stage(self):
+        telemetry = RunTelemetry()
+        with telemetry.stage('busy'):
+            busy_wait(0.2)
+            telemetry.count(bins=3)
+        stages = telemetry.summary()['stages']
+        self.assertEqual(len(stages), 1)
+        self.assertEqual(stages[0]['name'], 'busy')
+        self.assertGreaterEqual(stages[0]['wall_seconds'], 0.2)
+        self.assertGreater(stages[0]['cpu_seconds'], 0.1)
+        self.assertEqual(stages[0]['counts'], {'bins': 3})
+        self.assertFalse(stages[0]['failed'])
+
+    def test_stage_on_threads(self):
+        # the pipeline runs each stage on a thread of its own
+        telemetry = RunTelemetry()
+
+        def run_stage(name, seconds):
+            with telemetry.stage(name):
+                busy_wait(seconds)
+                telemetry.count(name=name)
+
+        threads = [threading.Thread(target=run_stage, args=('stage_' + str(i), 0.1))
+                   for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stages = telemetry.summary()['stages']
+        self.assertEqual(sorted(s['name'] for s in stages), ['stage_0', 'stage_1', 'stage_2'])
+        for stage in stages:
+            self.assertEqual(stage['counts'], {'name': stage['name']})
+            # the CPU time of the stage's own thread only
+            self.assertLess(stage['cpu_seconds'], stage['wall_seconds'] + 0.05)
+
+    def test_failed_stage(self):
+        telemetry = RunTelemetry()
+        with self.assertRaises(ValueError):
+            with telemetry.stage('fails'):
+                raise ValueError('stage failed')
+        self.assertTrue(telemetry.summary()['stages'][0]['failed'])
+
+    def test_add_process(self):
+        telemetry = RunTelemetry()
+        # processes outside of a stage are ignored
+        telemetry.add_process('tetra', FakeWatchdog())
+        with telemetry.stage('lineage_wf'):
+            telemetry.add_process('lineage_wf', FakeWatchdog(cpu_seconds=5.0),
+                                  queue_wait_seconds=1.5)
+        summary = telemetry.summary(run_id='abc')
+        stage = summary['stages'][0]
+        self.assertEqual(len(stage['processes']), 1)
+        self.assertEqual(stage['processes'][0]['name'], 'lineage_wf')
+        self.assertGreaterEqual(stage['cpu_seconds'], 5.0)
+        self.assertEqual(stage['peak_rss'], 1048576)
+        self.assertEqual(stage['queue_wait_seconds'], 1.5)
+        self.assertEqual(summary['queue_wait_seconds'], 1.5)
+        self.assertEqual(summary['run_id'], 'abc')
+        telemetry.log_summary()
+
+
+if __name__ == '__main__':
+    unittest.main()
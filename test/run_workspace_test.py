@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from kb_Msuite.Utils.RunCoalescer import RunCoalescer
+from kb_Msuite.Utils.RunWorkspace import RunWorkspace
+
+
+class RunWorkspaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp_dir, 'runs')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_stale(self, workspace, hours=48):
+        stale = time.time() - hours * 3600
+        os.utime(workspace.path, (stale, stale))
+
+    def test_allocate(self):
+        first = RunWorkspace.allocate(self.root)
+        second = RunWorkspace.allocate(self.root)
+        self.assertNotEqual(first.run_id, second.run_id)
+        self.assertTrue(os.path.isdir(first.path))
+        named = RunWorkspace.allocate(self.root, 'run_a')
+        self.assertEqual(named.path, os.path.join(self.root, 'run_a'))
+        self.assertEqual(named.dir('bins', 'x.fna'), os.path.join(named.path, 'bins', 'x.fna'))
+        self.assertFalse(os.path.exists(named.dir('bins')))
+
+    def test_reuse(self):
+        # an identical run finds the files of the one before
+        workspace = RunWorkspace.allocate(self.root, 'run_a')
+        os.makedirs(workspace.dir('output'))
+        self.make_stale(workspace)
+        again = RunWorkspace.allocate(self.root, 'run_a')
+        self.assertTrue(os.path.isdir(again.dir('output')))
+        # and is no longer stale
+        self.assertGreater(os.path.getmtime(again.path), time.time() - 60)
+
+    def test_prune(self):
+        stale = RunWorkspace.allocate(self.root, 'stale')
+        recent = RunWorkspace.allocate(self.root, 'recent')
+        self.make_stale(stale)
+        RunWorkspace.allocate(self.root, 'new')
+        self.assertFalse(os.path.exists(stale.path))
+        self.assertTrue(os.path.exists(recent.path))
+
+    def test_prune_retention(self):
+        workspace = RunWorkspace.allocate(self.root, 'run_a')
+        self.make_stale(workspace, hours=2)
+        RunWorkspace.prune(self.root, retention_hours=3)
+        self.assertTrue(os.path.exists(workspace.path))
+        RunWorkspace.prune(self.root, retention_hours=1)
+        self.assertFalse(os.path.exists(workspace.path))
+
+    def test_prune_in_use(self):
+        workspace = RunWorkspace.allocate(self.root, 'run_a')
+        self.make_stale(workspace)
+        with RunCoalescer(self.root).run('run_a'):
+            RunWorkspace.prune(self.root)
+            self.assertTrue(os.path.exists(workspace.path))
+        RunWorkspace.prune(self.root)
+        self.assertFalse(os.path.exists(workspace.path))
+
+    def test_private_dir(self):
+        workspace = RunWorkspace.allocate(self.root, 'run_a')
+        first = workspace.private_dir('tetra')
+        second = workspace.private_dir('tetra')
+        self.assertNotEqual(first, second)
+        self.assertTrue(os.path.isdir(first))
+        self.assertEqual(os.path.dirname(first), workspace.path)
+        self.assertTrue(os.path.basename(first).startswith('tetra_'))
+
+    def test_log_path(self):
+        workspace = RunWorkspace.allocate(self.root, 'run_a')
+        paths = [workspace.log_path('lineage_wf') for _ in range(3)]
+        self.assertEqual([os.path.basename(p) for p in paths],
+                         ['lineage_wf.1.out', 'lineage_wf.2.out', 'lineage_wf.3.out'])
+        self.assertTrue(all(os.path.getsize(p) == 0 for p in paths))
+        self.assertEqual(os.path.basename(workspace.log_path('tetra')), 'tetra.1.out')
+
+    def test_remove(self):
+        staged = os.path.join(self.tmp_dir, 'staged')
+        os.makedirs(staged)
+        workspace = RunWorkspace.allocate(self.root, 'run_a')
+        os.makedirs(workspace.dir('output', 'bins'))
+        # input staged elsewhere is removed too, not only the link to it
+        os.symlink(staged, workspace.dir('input'))
+        self.assertTrue(workspace.remove())
+        self.assertFalse(os.path.exists(workspace.path))
+        self.assertFalse(os.path.exists(staged))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from kb_Msuite.Utils.ScratchManager import ScratchManager, path_size, remove_path
+
+
+def write_file(path, size):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as file_handle:
+        file_handle.write(b'x' * size)
+    return path
+
+
+class ScratchManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.run_dir = os.path.join(self.tmp_dir, 'run')
+        # stands in for /dev/shm
+        self.tmpfs_dir = os.path.join(self.tmp_dir, 'shm')
+        os.makedirs(self.run_dir)
+        os.makedirs(self.tmpfs_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_path_size(self):
+        write_file(os.path.join(self.run_dir, 'a', 'one'), 100)
+        write_file(os.path.join(self.run_dir, 'a', 'b', 'two'), 50)
+        os.symlink(os.path.join(self.run_dir, 'a', 'one'), os.path.join(self.run_dir, 'link'))
+        self.assertEqual(path_size(os.path.join(self.run_dir, 'a')), 150)
+        self.assertEqual(path_size(os.path.join(self.run_dir, 'a', 'one')), 100)
+        # symlinks are not followed
+        self.assertEqual(path_size(os.path.join(self.run_dir, 'link')), 0)
+        self.assertEqual(path_size(self.run_dir),
+                         150 + os.lstat(os.path.join(self.run_dir, 'link')).st_size)
+        self.assertEqual(path_size(os.path.join(self.run_dir, 'missing')), 0)
+
+    def test_remove_path(self):
+        target = write_file(os.path.join(self.tmpfs_dir, 'staged', 'input.fna'), 10)
+        link = os.path.join(self.run_dir, 'input.fna')
+        os.symlink(target, link)
+        remove_path(link)
+        self.assertFalse(os.path.lexists(link))
+        self.assertFalse(os.path.exists(target))
+        # with the directory it was staged in, now empty
+        self.assertFalse(os.path.exists(os.path.dirname(target)))
+        tree = os.path.dirname(write_file(os.path.join(self.run_dir, 'tree', 'file'), 10))
+        remove_path(tree)
+        self.assertFalse(os.path.exists(tree))
+        # nothing to remove
+        remove_path(os.path.join(self.run_dir, 'missing'))
+
+    def test_intermediates_removed(self):
+        scratch = ScratchManager(self.run_dir)
+        bins = os.path.dirname(write_file(os.path.join(self.run_dir, 'bins', 'bin.1.fna'), 100))
+        fasta = write_file(os.path.join(self.run_dir, 'all.fna'), 40)
+        scratch.register(bins, ['lineage_wf', 'dist_plot'])
+        scratch.register(fasta, ['tetra'])
+        scratch.stage_done('lineage_wf')
+        self.assertTrue(os.path.exists(bins))
+        scratch.stage_done('tetra')
+        self.assertFalse(os.path.exists(fasta))
+        self.assertTrue(os.path.exists(bins))
+        scratch.stage_done('dist_plot')
+        self.assertFalse(os.path.exists(bins))
+        summary = scratch.summary()
+        self.assertEqual(summary['freed_bytes'], 140)
+        self.assertEqual(summary['removed'], [fasta, bins])
+        self.assertEqual(summary['peak_bytes'], 140)
+        self.assertEqual(summary['peak_by_dir'], {'bins': 100, 'all.fna': 40})
+
+    def test_not_on_tmpfs(self):
+        scratch = ScratchManager(self.run_dir)
+        self.assertFalse(scratch.use_tmpfs(10))
+        scratch = ScratchManager(self.run_dir, tmpfs_dir=os.path.join(self.tmp_dir, 'missing'),
+                                 tmpfs_max_bytes=1000)
+        self.assertFalse(scratch.use_tmpfs(10))
+        scratch = ScratchManager(self.run_dir, tmpfs_dir=self.tmpfs_dir, tmpfs_max_bytes=1000)
+        # known in advance to be too large, or of unknown size
+        self.assertFalse(scratch.use_tmpfs(2000))
+        self.assertFalse(scratch.use_tmpfs(None))
+        self.assertTrue(scratch.use_tmpfs(500))
+        self.assertFalse(scratch.summary()['tmpfs_staging'])
+
+    def test_staged_on_tmpfs(self):
+        scratch = ScratchManager(self.run_dir, tmpfs_dir=self.tmpfs_dir, tmpfs_max_bytes=1000)
+        bins = os.path.dirname(write_file(os.path.join(self.run_dir, 'bins', 'bin.1.fna'), 300))
+        fasta = write_file(os.path.join(self.run_dir, 'all.fna'), 300)
+        self.assertTrue(scratch.move_to_tmpfs([bins, fasta], 'run_a'))
+        staging_dir = os.path.join(self.tmpfs_dir, 'kb_Msuite_run_a')
+        for path in [bins, fasta]:
+            self.assertTrue(os.path.islink(path))
+            self.assertEqual(os.path.dirname(os.path.realpath(path)),
+                             os.path.realpath(staging_dir))
+        self.assertEqual(os.path.getsize(os.path.join(bins, 'bin.1.fna')), 300)
+        summary = scratch.summary()
+        self.assertTrue(summary['tmpfs_staging'])
+        self.assertEqual(summary['peak_tmpfs_bytes'], 600)
+        # removing the intermediate frees the tmpfs copy
+        scratch.register(fasta, ['tetra'])
+        scratch.stage_done('tetra')
+        self.assertFalse(os.path.lexists(fasta))
+        self.assertFalse(os.path.exists(os.path.join(staging_dir, 'all.fna')))
+        self.assertEqual(scratch.summary()['freed_bytes'], 300)
+
+    def test_too_large_for_tmpfs(self):
+        # larger than the estimate
+        scratch = ScratchManager(self.run_dir, tmpfs_dir=self.tmpfs_dir, tmpfs_max_bytes=100)
+        fasta = write_file(os.path.join(self.run_dir, 'all.fna'), 500)
+        self.assertFalse(scratch.move_to_tmpfs([fasta], 'run_a'))
+        self.assertFalse(os.path.islink(fasta))
+        self.assertEqual(os.path.getsize(fasta), 500)
+        self.assertEqual(os.listdir(self.tmpfs_dir), [])
+        self.assertFalse(scratch.summary()['tmpfs_staging'])
+
+    def test_tmpfs_copy_failed(self):
+        scratch = ScratchManager(self.run_dir, tmpfs_dir=self.tmpfs_dir, tmpfs_max_bytes=1000)
+        fasta = write_file(os.path.join(self.run_dir, 'all.fna'), 100)
+        missing = os.path.join(self.run_dir, 'missing.fna')
+        self.assertFalse(scratch.move_to_tmpfs([fasta, missing], 'run_a'))
+        # the disk copy is kept, and the partial tmpfs copy removed
+        self.assertFalse(os.path.islink(fasta))
+        self.assertEqual(os.path.getsize(fasta), 100)
+        self.assertEqual(os.listdir(self.tmpfs_dir), [])
+
+    def test_sampling(self):
+        scratch = ScratchManager(self.run_dir, interval=0.05)
+        scratch.start()
+        write_file(os.path.join(self.run_dir, 'output', 'big'), 1000)
+        scratch.stop()
+        shutil.rmtree(os.path.join(self.run_dir, 'output'))
+        scratch.measure()
+        # the peak is kept
+        self.assertEqual(scratch.summary()['peak_bytes'], 1000)
+        self.assertIsNotNone(scratch.summary()['peak_time'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import multiprocessing
+
+from kb_Msuite.authclient import KBaseAuth
+from kb_Msuite.Utils.SharedTokenCache import SharedTokenCache
+
+
+def add_in_child(cache, queue):
+    cache.add_valid_token('child_token', 'child_user')
+    queue.put((cache._local.pid_db[0] == os.getpid(), cache.get_user('parent_token')))
+
+
+class SharedTokenCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'token_cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def count_rows(self):
+        with sqlite3.connect(self.path) as db:
+            return db.execute('SELECT COUNT(*) FROM tokens').fetchone()[0]
+
+    def test_lru(self):
+        cache = SharedTokenCache(self.path, maxsize=2)
+        cache.add_valid_token('a', 'user_a')
+        cache.add_valid_token('b', 'user_b')
+        self.assertEqual(cache.get_user('a'), 'user_a')
+        cache.add_valid_token('c', 'user_c')
+        self.assertEqual(list(cache._cache.keys()), [cache._hash('a'), cache._hash('c')])
+
+    def test_invalid(self):
+        cache = SharedTokenCache(self.path)
+        with self.assertRaises(ValueError):
+            cache.add_valid_token('', 'user')
+        with self.assertRaises(ValueError):
+            cache.add_valid_token('token', None)
+
+    def test_no_connection_on_construction(self):
+        SharedTokenCache(self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_shared(self):
+        SharedTokenCache(self.path).add_valid_token('token', 'user')
+        other = SharedTokenCache(self.path)
+        self.assertEqual(other.get_user('token'), 'user')
+        self.assertIsNone(other.get_user('other_token'))
+        # no token is stored in the clear
+        with sqlite3.connect(self.path) as db:
+            self.assertEqual(db.execute("SELECT COUNT(*) FROM tokens WHERE token = 'token'")
+                             .fetchone()[0], 0)
+
+    def test_expired(self):
+        SharedTokenCache(self.path).add_valid_token('token', 'user')
+        other = SharedTokenCache(self.path)
+        other._MAX_TIME_SEC = -1
+        self.assertIsNone(other.get_user('token'))
+
+    def test_forked(self):
+        cache = SharedTokenCache(self.path)
+        cache.add_valid_token('parent_token', 'parent_user')
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        child = context.Process(target=add_in_child, args=(cache, queue))
+        child.start()
+        own_connection, user = queue.get(timeout=30)
+        child.join()
+        self.assertTrue(own_connection)
+        self.assertEqual(user, 'parent_user')
+        self.assertEqual(SharedTokenCache(self.path).get_user('child_token'), 'child_user')
+
+    def test_evict(self):
+        cache = SharedTokenCache(self.path, maxsize=3, evict_interval=4)
+        for n in range(3):
+            cache.add_valid_token('token_' + str(n), 'user')
+        # token_0 is now the most recently used
+        self.assertEqual(SharedTokenCache(self.path).get_user('token_0'), 'user')
+        cache.add_valid_token('token_3', 'user')
+        self.assertEqual(self.count_rows(), 3)
+        other = SharedTokenCache(self.path)
+        self.assertIsNone(other.get_user('token_1'))
+        self.assertEqual(other.get_user('token_0'), 'user')
+        # between evictions the table may grow past maxsize
+        for n in range(4, 7):
+            cache.add_valid_token('token_' + str(n), 'user')
+        self.assertEqual(self.count_rows(), 6)
+
+    def test_unusable_database(self):
+        cache = SharedTokenCache(os.path.join(self.tmp_dir, 'missing', 'token_cache.sqlite'))
+        cache.add_valid_token('token', 'user')
+        self.assertEqual(cache.get_user('token'), 'user')
+        self.assertIsNone(SharedTokenCache(cache._path).get_user('token'))
+
+
+class KBaseAuthTest(unittest.TestCase):
+
+    def test_install(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            cache = SharedTokenCache(os.path.join(tmp_dir, 'token_cache.sqlite'))
+            auth = cache.install(KBaseAuth('http://localhost:1/auth'))
+            self.assertIs(auth._cache, cache)
+            cache.add_valid_token('token', 'user')
+            # cached, so the (unreachable) auth service is not called
+            self.assertEqual(auth.get_user('token'), 'user')
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()